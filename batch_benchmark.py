@@ -0,0 +1,254 @@
+"""
+一括処理のベンチマーク
+
+一時フォルダに合成したファイルツリー（既定では 1000 / 10000 / 100000 ファイル）を作成し、
+GUI・CLIと同じ batch_engine の処理で次の段階の時間を計測する。
+
+    ingest          フォルダをたどって対象ファイルを集める
+    plan            新しいファイル名を決める（RenamePlan）
+    preflight       存在確認と同名ファイルの判定（PreflightScan / resolve_conflicts）
+    rename          同じフォルダ内での名前変更
+    move            同じデバイス上の別フォルダへの移動
+    cross_device    別デバイスへの移動（コピー＋削除。--cross-device-dir を指定した場合のみ）
+
+結果はJSONで出力する。--baseline を指定すると、保存済みの結果と比べて
+遅くなった段階を表示し、しきい値を超えた場合は終了コード 1 を返す。
+
+    python batch_benchmark.py --tmpdir /dev/shm --output result.json
+    python batch_benchmark.py --save-baseline benchmark_baseline.json
+    python batch_benchmark.py --baseline benchmark_baseline.json --sizes 1000,10000
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from batch_engine import (
+    CONFLICT_SKIP, BatchJob, DestinationIndex, DeviceScheduler, FileSelection, PreflightScan, RenamePlan,
+    execute_entry, iter_ingest_paths, order_moves, resolve_conflicts
+)
+
+EXIT_OK = 0
+EXIT_REGRESSION = 1
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+FILES_PER_DIR = 100
+PATTERN = "{date}_{text}_{seq}"
+# ファイル名を毎回同じにするため日時を固定する
+FIXED_NOW = datetime(2000, 1, 1)
+
+PHASES = ("ingest", "plan", "preflight", "rename", "move", "cross_device")
+
+
+def parse_sizes(text):
+    return [int(size) for size in text.split(",") if size.strip()]
+
+
+def generate_tree(root, count, files_per_dir=FILES_PER_DIR):
+    """root の下に count 個の小さなファイルを files_per_dir 個ずつのフォルダに分けて作る"""
+    for i in range(count):
+        if i % files_per_dir == 0:
+            directory = os.path.join(root, f"d{i // files_per_dir:05d}")
+            os.makedirs(directory)
+        with open(os.path.join(directory, f"f{i:07d}.txt"), "wb") as f:
+            f.write(b"x")
+
+
+def collect(root):
+    return FileSelection(iter_ingest_paths([root]))
+
+
+def make_plan(selection, dest_dir=None, rename=True):
+    return RenamePlan(selection, pattern=PATTERN, custom_text="bench", sequence_digits=7,
+                      dest_dir=dest_dir, rename=rename, now=FIXED_NOW)
+
+
+def preflight(plan, selection):
+    index = DestinationIndex(PreflightScan(selection))
+    return resolve_conflicts(plan.entries, CONFLICT_SKIP, index)
+
+
+def execute(resolution, workers):
+    """CLIと同じ順序付け・デバイスごとの並列数で BatchJob を実行し、失敗した件数を返す"""
+    units = order_moves(resolution.entries, resolution.index)
+    scheduler = DeviceScheduler.for_index(resolution.index, workers)
+    job = BatchJob(units, lambda entry: execute_entry(entry, resolution.index), scheduler=scheduler).start()
+    failed = 0
+    while True:
+        kind, result = job.events.get()
+        if kind == "finished":
+            return failed
+        if result.error is not None:
+            failed += 1
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.phases = {}
+
+    def measure(self, name, func, *args):
+        started = time.perf_counter()
+        value = func(*args)
+        self.phases[name] = time.perf_counter() - started
+        return value
+
+
+def same_device(path_a, path_b):
+    return os.stat(path_a).st_dev == os.stat(path_b).st_dev
+
+
+def run_size(count, base_dir, workers, cross_device_dir=None):
+    """1つのファイル数について全段階を計測し、{段階: 秒} を返す"""
+    work_dir = tempfile.mkdtemp(prefix="fm_bench_", dir=base_dir)
+    cross_dir = None
+    try:
+        source_root = os.path.join(work_dir, "source")
+        generate_tree(source_root, count)
+        timer = PhaseTimer()
+        failed = 0
+
+        # 名前変更（元のフォルダ内）
+        selection = timer.measure("ingest", collect, source_root)
+        plan = timer.measure("plan", make_plan, selection)
+        resolution = timer.measure("preflight", preflight, plan, selection)
+        failed += timer.measure("rename", execute, resolution, workers)
+
+        # 同じデバイス上の移動（名前はそのまま）
+        move_dir = os.path.join(work_dir, "moved")
+        os.makedirs(move_dir)
+        selection = collect(source_root)
+        resolution = preflight(make_plan(selection, move_dir, rename=False), selection)
+        failed += timer.measure("move", execute, resolution, workers)
+
+        # 別デバイスへの移動
+        if cross_device_dir and not same_device(work_dir, cross_device_dir):
+            cross_dir = tempfile.mkdtemp(prefix="fm_bench_", dir=cross_device_dir)
+            selection = collect(move_dir)
+            resolution = preflight(make_plan(selection, cross_dir, rename=False), selection)
+            failed += timer.measure("cross_device", execute, resolution, workers)
+
+        return {"phases": timer.phases, "failed": failed}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if cross_dir:
+            shutil.rmtree(cross_dir, ignore_errors=True)
+
+
+def run_benchmark(sizes, base_dir=None, workers=1, repeat=1, cross_device_dir=None):
+    """各ファイル数を repeat 回計測し、段階ごとの最短時間を結果にまとめる"""
+    results = {}
+    for count in sizes:
+        best = {}
+        failed = 0
+        for _ in range(repeat):
+            run = run_size(count, base_dir, workers, cross_device_dir)
+            failed += run["failed"]
+            for phase, seconds in run["phases"].items():
+                best[phase] = min(seconds, best.get(phase, seconds))
+        results[str(count)] = {
+            "failed": failed,
+            "phases": {phase: {"seconds": round(seconds, 6),
+                               "files_per_second": round(count / seconds, 1) if seconds else None}
+                       for phase, seconds in best.items()},
+        }
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "base_dir": os.path.abspath(base_dir or tempfile.gettempdir()),
+        "workers": workers,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold):
+    """
+    baseline と比べて、各段階の時間の比（今回 / 基準）を返す
+
+    [(ファイル数, 段階, 基準の秒, 今回の秒, 比, しきい値を超えたか), ...]
+    """
+    rows = []
+    for count, result in report["results"].items():
+        base_result = baseline.get("results", {}).get(count)
+        if base_result is None:
+            continue
+        for phase in PHASES:
+            current = result["phases"].get(phase)
+            base = base_result["phases"].get(phase)
+            if current is None or base is None or not base["seconds"]:
+                continue
+            ratio = current["seconds"] / base["seconds"]
+            rows.append((count, phase, base["seconds"], current["seconds"], ratio, ratio > threshold))
+    return rows
+
+
+def print_report(report, comparison=None):
+    for count, result in report["results"].items():
+        print(f"{count} files" + (f"  (失敗 {result['failed']} 件)" if result["failed"] else ""), file=sys.stderr)
+        for phase in PHASES:
+            timing = result["phases"].get(phase)
+            if timing is not None:
+                print(f"  {phase:<13}{timing['seconds']:>10.3f} s {timing['files_per_second'] or 0:>12.0f} files/s",
+                      file=sys.stderr)
+    if comparison:
+        print("基準との比較:", file=sys.stderr)
+        for count, phase, base, current, ratio, regressed in comparison:
+            mark = "  << 遅くなりました" if regressed else ""
+            print(f"  {count:>7} {phase:<13}{base:>10.3f} s -> {current:>8.3f} s  x{ratio:.2f}{mark}", file=sys.stderr)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="batch_benchmark.py", description="一括処理のベンチマーク")
+    parser.add_argument("--sizes", type=parse_sizes, default=list(DEFAULT_SIZES),
+                        help="ファイル数（カンマ区切り、既定: 1000,10000,100000）")
+    parser.add_argument("--tmpdir", help="ファイルツリーを作るフォルダ（tmpfs なら /dev/shm など）")
+    parser.add_argument("--cross-device-dir", help="別デバイス上のフォルダ（指定した場合のみ cross_device を計測）")
+    parser.add_argument("--workers", type=int, default=1, help="同時実行数（既定: 1）")
+    parser.add_argument("--repeat", type=int, default=1, help="繰り返し回数（段階ごとの最短時間を使う）")
+    parser.add_argument("--output", help="結果をJSONで保存するパス（省略時は標準出力）")
+    parser.add_argument("--baseline", help="比較する基準の結果（JSON）")
+    parser.add_argument("--save-baseline", help="今回の結果を基準として保存するパス")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="基準に対してこの倍率より遅い段階があれば終了コード 1（既定: 1.25）")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    report = run_benchmark(args.sizes, args.tmpdir, max(1, args.workers), max(1, args.repeat),
+                           args.cross_device_dir)
+
+    comparison = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            comparison = compare(report, json.load(f), args.threshold)
+        report["comparison"] = [
+            {"files": int(count), "phase": phase, "baseline_seconds": base, "seconds": current,
+             "ratio": round(ratio, 3), "regressed": regressed}
+            for count, phase, base, current, ratio, regressed in comparison
+        ]
+    print_report(report, comparison)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    if comparison and any(row[-1] for row in comparison):
+        return EXIT_REGRESSION
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
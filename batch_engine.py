@@ -0,0 +1,1307 @@
+"""
+一括処理エンジン
+
+Tkに依存せずに、ファイル名パターンと元ファイルの一覧から
+移動元→移動先の対応表（実行計画）を作成する。
+"""
+import errno
+import fnmatch
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from functools import lru_cache
+
+from diagnostics import METRICS
+
+# ファイル名パターンのプレースホルダー
+_PLACEHOLDER_RE = re.compile(r"\{(date|seq|text)\}")
+
+# 保存先に同名ファイルがある場合の方針
+CONFLICT_ASK = "ask"              # 実行前にまとめて確認する
+CONFLICT_SKIP = "skip"            # スキップする
+CONFLICT_OVERWRITE = "overwrite"  # 上書きする
+CONFLICT_RENAME = "rename"        # _1, _2 ... を付けて別名にする
+CONFLICT_NEWER = "newer"          # 更新日時が新しい方を残す
+CONFLICT_POLICIES = (CONFLICT_ASK, CONFLICT_SKIP, CONFLICT_OVERWRITE, CONFLICT_RENAME, CONFLICT_NEWER)
+
+# 移動の方法（一括処理ごとに移動元と移動先のデバイスを比べて決める）
+MOVE_RENAME = "rename"  # 同じデバイス: os.replace で名前だけ変える
+MOVE_COPY = "copy"      # 別のデバイス: コピーしてから移動元を削除する
+
+# 別のデバイスへのコピーで1回のシステムコールに渡す大きさと、読み書きで使うバッファの大きさ
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+# カーネル内コピー（copy_file_range / sendfile）がこの組み合わせで使えないことを示すエラー
+_COPY_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF,
+                         getattr(errno, "ENOTSUP", errno.EOPNOTSUPP)}
+
+# デバイスごとの上限から決めるワーカー数の上限
+MAX_SCHEDULER_WORKERS = 32
+
+# 1ファイルごとの処理結果
+STATUS_SUCCESS = "success"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"
+STATUS_MISSING = "missing"
+STATUS_CANCELLED = "cancelled"
+
+
+def format_sequence(seq, digits):
+    """連番を桁数に合わせてゼロ埋めした文字列にする"""
+    if digits <= 1:
+        # 桁数が1以下の場合はゼロ埋めしない
+        return str(int(seq))
+    return str(seq).zfill(digits)
+
+
+@lru_cache(maxsize=64)
+def tokenize_pattern(pattern):
+    """
+    パターンを ("literal", 文字列) / ("date"|"seq"|"text", None) のタプル列に分解する
+    同じパターンは二度解析しない
+    """
+    tokens = []
+    pos = 0
+    for match in _PLACEHOLDER_RE.finditer(pattern):
+        if match.start() > pos:
+            tokens.append(("literal", pattern[pos:match.start()]))
+        tokens.append((match.group(1), None))
+        pos = match.end()
+    if pos < len(pattern):
+        tokens.append(("literal", pattern[pos:]))
+    return tuple(tokens)
+
+
+class FilenameFormatter:
+    """
+    コンパイル済みのファイル名パターン
+
+    日付とカスタムテキストは作成時に固定文字列として畳み込み、
+    ファイルごとに変わる連番だけを format() で差し込む。
+    日付は作成時点（now）で一度だけ取得するので、日付をまたぐ一括処理でも揃う。
+    """
+
+    def __init__(self, pattern, date_format="%Y%m%d", sequence_digits=4, custom_text="", now=None):
+        self.pattern = pattern
+        tokens = tokenize_pattern(pattern)
+        kinds = {kind for kind, _ in tokens}
+
+        self.now = now or datetime.now()
+        date_str = self.now.strftime(date_format) if "date" in kinds else ""
+        self.has_seq = "seq" in kinds
+        # 連番を使わないパターンでは桁数を解釈しない
+        self.sequence_digits = int(sequence_digits) if self.has_seq else 0
+
+        # 連番の位置で区切った固定文字列のリスト（連番が k 個なら k+1 個）
+        chunks = [""]
+        for kind, value in tokens:
+            if kind == "seq":
+                chunks.append("")
+            elif kind == "date":
+                chunks[-1] += date_str
+            elif kind == "text":
+                chunks[-1] += custom_text
+            else:
+                chunks[-1] += value
+        self._chunks = chunks
+
+    def format(self, seq=None):
+        """連番を差し込んだファイル名（拡張子なし）を返す"""
+        if not self.has_seq:
+            return self._chunks[0]
+        return format_sequence(seq, self.sequence_digits).join(self._chunks)
+
+
+def parse_glob_patterns(text):
+    """ "*.jpg; *.mp4" のような文字列をパターンのリストにする"""
+    return [pattern.strip() for pattern in re.split(r"[;,]", text or "") if pattern.strip()]
+
+
+def iter_files(root, max_depth=None, include=(), exclude=()):
+    """
+    フォルダ以下のファイルを os.scandir で順に返すジェネレーター
+
+    max_depth: 0 なら root 直下のみ、None なら制限なし
+    include: ファイル名がいずれかに一致するものだけ返す（空ならすべて）
+    exclude: ファイル名・フォルダ名が一致するものは除外する（フォルダは中も見ない）
+    フォルダごとに名前順で、ファイルを先に返してからサブフォルダに進む。
+    """
+    def matches(name, patterns):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+    stack = [(root, 0)]
+    while stack:
+        directory, depth = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                dir_entries = sorted(it, key=lambda dir_entry: dir_entry.name)
+        except (PermissionError, FileNotFoundError, NotADirectoryError):
+            continue
+
+        subdirs = []
+        for dir_entry in dir_entries:
+            if exclude and matches(dir_entry.name, exclude):
+                continue
+            try:
+                if dir_entry.is_dir(follow_symlinks=False):
+                    if max_depth is None or depth < max_depth:
+                        subdirs.append(dir_entry.path)
+                    continue
+                if not dir_entry.is_file():
+                    continue
+            except OSError:
+                continue
+            if include and not matches(dir_entry.name, include):
+                continue
+            yield dir_entry.path
+
+        # 名前順に処理するため逆順で積む
+        for subdir in reversed(subdirs):
+            stack.append((subdir, depth + 1))
+
+
+def iter_ingest_paths(paths, max_depth=None, include=(), exclude=()):
+    """ファイルはそのまま、フォルダは中のファイルを順に返す"""
+    for path in paths:
+        if os.path.isdir(path):
+            yield from iter_files(path, max_depth, include, exclude)
+        else:
+            yield path
+
+
+class FileSelection:
+    """
+    一括処理用に選択されたファイルの一覧
+
+    追加順を保つリストと、パス -> 位置 の辞書を併せ持つので、
+    重複判定・削除・位置の取得がファイル数に関係なく O(1) で済む。
+    削除は位置を空けておくだけにして、位置で参照するときにまとめて詰める。
+    Windowsの区切り文字や大文字小文字の違いは同じファイルとして扱う。
+    """
+
+    def __init__(self, paths=()):
+        self._paths = []
+        self._positions = {}
+        self._holes = 0
+        self.extend(paths)
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(os.path.normpath(path))
+
+    def _compact(self):
+        if self._holes:
+            self._paths = [path for path in self._paths if path is not None]
+            self._positions = {self._key(path): i for i, path in enumerate(self._paths)}
+            self._holes = 0
+
+    def add(self, path):
+        """追加した場合は True、既に含まれていた場合は False"""
+        key = self._key(path)
+        if key in self._positions:
+            return False
+        self._positions[key] = len(self._paths)
+        self._paths.append(path)
+        return True
+
+    def extend(self, paths):
+        """追加した件数を返す"""
+        return sum(1 for path in paths if self.add(path))
+
+    def remove(self, path):
+        position = self._positions.pop(self._key(path), None)
+        if position is None:
+            return False
+        self._paths[position] = None
+        self._holes += 1
+        return True
+
+    def remove_indices(self, indices):
+        """表示上の位置で指定したファイルを削除する"""
+        self._compact()
+        for index in indices:
+            self.remove(self._paths[index])
+        self._compact()
+
+    def clear(self):
+        self._paths = []
+        self._positions = {}
+        self._holes = 0
+
+    def index(self, path):
+        self._compact()
+        return self._positions[self._key(path)]
+
+    def __contains__(self, path):
+        return self._key(path) in self._positions
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __iter__(self):
+        return (path for path in self._paths if path is not None)
+
+    def __getitem__(self, index):
+        self._compact()
+        return self._paths[index]
+
+    def __setitem__(self, index, path):
+        """
+        位置 index のファイルを新しいパス（移動後のパスなど）に置き換える
+
+        別の位置のファイルと同じパスになる場合は、一覧に同じファイルが2つ並ばないよう ValueError にする。
+        """
+        self._compact()
+        index = range(len(self._paths))[index]
+        key = self._key(path)
+        other = self._positions.get(key)
+        if other is not None and other != index:
+            raise ValueError(f"一覧の {other} 番目のファイルと同じパスです: {path}")
+        del self._positions[self._key(self._paths[index])]
+        self._paths[index] = path
+        self._positions[key] = index
+
+
+class PlanEntry:
+    """実行計画の1ファイル分（移動元・移動先・新しいファイル名）"""
+    __slots__ = ("index", "source", "destination", "filename", "overwrite", "staged_source")
+
+    def __init__(self, index, source, destination, filename):
+        self.index = index
+        self.source = source
+        self.destination = destination
+        self.filename = filename
+        self.overwrite = False  # 既存ファイルの上書きを許可済みか
+        self.staged_source = None  # 循環を崩すために一時的な名前へ移した場合、そのパス
+
+    @property
+    def current_source(self):
+        """実行時に移動するファイルの場所（一時的な名前へ移した場合はそのパス）"""
+        return self.staged_source or self.source
+
+    def __repr__(self):
+        return f"PlanEntry({self.index}, {self.source!r} -> {self.destination!r})"
+
+
+class RenamePlan:
+    """
+    一括処理の実行計画
+
+    dest_dir が None の場合は元ファイルと同じフォルダ内で名前変更、
+    rename が False の場合は元のファイル名のまま dest_dir へ移動する。
+    連番は一覧の位置に合わせて start_seq + i を割り当てる。
+    ファイル名は計画全体で共通の FilenameFormatter で生成する。
+    連番を使わない計画（移動のみ・連番のないパターン）では start_seq を解釈しない（None になる）。
+    """
+
+    def __init__(self, sources, pattern="", date_format="%Y%m%d", sequence_digits=4,
+                 custom_text="", start_seq=1, dest_dir=None, rename=True, now=None):
+        self.dest_dir = dest_dir
+        self.rename = rename
+        self.formatter = FilenameFormatter(pattern, date_format, sequence_digits, custom_text, now) if rename else None
+        self.start_seq = int(start_seq) if self.formatter is not None and self.formatter.has_seq else None
+        self.entries = self._build(sources)
+
+    def _build(self, sources):
+        entries = []
+        for i, source_path in enumerate(sources):
+            if self.rename:
+                _, file_extension = os.path.splitext(source_path)
+                seq = self.start_seq + i if self.start_seq is not None else None
+                new_filename = self.formatter.format(seq) + file_extension
+            else:
+                new_filename = os.path.basename(source_path)
+
+            target_dir = self.dest_dir if self.dest_dir is not None else os.path.dirname(source_path)
+            destination_path = os.path.join(target_dir, new_filename)
+
+            # 絶対パスに変換して正規化
+            entries.append(PlanEntry(
+                i,
+                os.path.abspath(os.path.normpath(source_path)),
+                os.path.abspath(os.path.normpath(destination_path)),
+                new_filename,
+            ))
+        return entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def mapping(self):
+        """移動元→移動先の辞書を返す"""
+        return {entry.source: entry.destination for entry in self.entries}
+
+
+class PreflightScan:
+    """
+    実行前の存在確認を親フォルダ単位で行う
+
+    ファイルごとに os.path.exists を呼ぶ代わりに、親フォルダごとに1回だけ
+    os.scandir して名前の集合を作る（ネットワークドライブではフォルダ数 D 回の往復で済む）。
+    Windowsでは大文字小文字を区別しないので、名前は os.path.normcase で比較する。
+    """
+
+    def __init__(self, paths=()):
+        self._listings = {}
+        self.scandir_count = 0
+        for path in paths:
+            self.listing(os.path.dirname(os.path.abspath(path)))
+
+    def listing(self, directory):
+        """フォルダ内の {正規化した名前: DirEntry} を返す（フォルダがなければ空）"""
+        key = os.path.normcase(directory)
+        entries = self._listings.get(key)
+        if entries is None:
+            entries = {}
+            self.scandir_count += 1
+            try:
+                with os.scandir(directory) as it:
+                    for dir_entry in it:
+                        entries[os.path.normcase(dir_entry.name)] = dir_entry
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+            self._listings[key] = entries
+        return entries
+
+    def _lookup(self, path):
+        directory, name = os.path.split(os.path.abspath(path))
+        return self.listing(directory).get(os.path.normcase(name))
+
+    def exists(self, path):
+        return self._lookup(path) is not None
+
+    def getmtime(self, path):
+        dir_entry = self._lookup(path)
+        if dir_entry is None:
+            raise FileNotFoundError(path)
+        return dir_entry.stat().st_mtime
+
+    def getsize(self, path):
+        dir_entry = self._lookup(path)
+        if dir_entry is None:
+            raise FileNotFoundError(path)
+        return dir_entry.stat().st_size
+
+    def missing(self, paths):
+        """存在しないパスのリストを返す"""
+        return [path for path in paths if not self.exists(path)]
+
+
+def make_unique_filename(filename, is_taken):
+    """is_taken(名前) が False になるまで _1, _2 ... を付けたファイル名を返す"""
+    base, extension = os.path.splitext(filename)
+    counter = 1
+    while True:
+        candidate = f"{base}_{counter}{extension}"
+        if not is_taken(candidate):
+            return candidate
+        counter += 1
+
+
+class DestinationIndex:
+    """
+    保存先フォルダのファイル名の索引
+
+    一括処理ごとに PreflightScan の一覧から1回だけ作成し（再スキャンはしない）、
+    計画時の割り当て（claim）と、実行中の移動の成功（commit）に合わせて更新する。
+    衝突の判定と別名（_1, _2 ...）の生成はこの索引だけで行う。
+    """
+
+    def __init__(self, preflight=None):
+        self.preflight = preflight or PreflightScan()
+        self._added = {}     # フォルダ -> 移動で増えた名前の集合
+        self._removed = {}   # フォルダ -> 移動で無くなった名前の集合
+        self._claims = {}    # フォルダ -> {計画で割り当てた名前: 元ファイルパス}
+        self._devices = {}   # フォルダ -> デバイス番号（st_dev）
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _split(path):
+        directory, name = os.path.split(os.path.abspath(path))
+        return os.path.normcase(directory), os.path.normcase(name)
+
+    def _on_disk(self, directory, name):
+        if name in self._added.get(directory, ()):
+            return True
+        if name in self._removed.get(directory, ()):
+            return False
+        return name in self.preflight.listing(directory)
+
+    def exists_on_disk(self, path):
+        """実行中の移動を反映した上で、ファイルが存在するか"""
+        directory, name = self._split(path)
+        with self._lock:
+            return self._on_disk(directory, name)
+
+    def is_taken(self, path):
+        """既存ファイルがあるか、この一括処理で既に割り当て済みか"""
+        directory, name = self._split(path)
+        with self._lock:
+            return name in self._claims.get(directory, ()) or self._on_disk(directory, name)
+
+    def claimed_by(self, path):
+        """path を割り当て済みの元ファイル（なければ None）"""
+        directory, name = self._split(path)
+        return self._claims.get(directory, {}).get(name)
+
+    def claim(self, entry):
+        directory, name = self._split(entry.destination)
+        with self._lock:
+            self._claims.setdefault(directory, {})[name] = entry.source
+
+    def commit(self, entry):
+        """移動が成功したエントリを索引に反映する"""
+        self.commit_move(entry.current_source, entry.destination)
+
+    def commit_move(self, source, destination):
+        src_dir, src_name = self._split(source)
+        dst_dir, dst_name = self._split(destination)
+        with self._lock:
+            self._added.get(src_dir, set()).discard(src_name)
+            self._removed.setdefault(src_dir, set()).add(src_name)
+            self._removed.get(dst_dir, set()).discard(dst_name)
+            self._added.setdefault(dst_dir, set()).add(dst_name)
+
+    def unique_filename(self, directory, filename):
+        """directory 内で使われていない別名（_1, _2 ...）を返す"""
+        return make_unique_filename(filename, lambda name: self.is_taken(os.path.join(directory, name)))
+
+    def device_of(self, directory):
+        """フォルダのあるデバイス番号（st_dev）。フォルダごとに一度だけ調べ、調べられない場合は None"""
+        key = os.path.normcase(directory)
+        with self._lock:
+            if key in self._devices:
+                return self._devices[key]
+        try:
+            device = os.stat(directory).st_dev
+        except OSError:
+            device = None
+        with self._lock:
+            self._devices[key] = device
+        return device
+
+
+def find_duplicate_targets(entries, preflight=None):
+    """
+    生成されるファイル名の重複をハッシュで一度に数える
+
+    (一括処理内で重複する保存先のファイル名リスト, 既存ファイルと衝突するエントリのリスト) を返す。
+    """
+    counts = Counter(os.path.normcase(entry.destination) for entry in entries)
+    duplicates = []
+    seen = set()
+    for entry in entries:
+        key = os.path.normcase(entry.destination)
+        if counts[key] > 1 and key not in seen:
+            seen.add(key)
+            duplicates.append(entry.filename)
+
+    existing = []
+    if preflight is not None:
+        # 別のエントリの移動元は、その移動で空くので衝突として数えない
+        vacated = vacated_sources(entries, preflight)
+        existing = [entry for entry in entries
+                    if os.path.normcase(entry.current_source) != os.path.normcase(entry.destination)
+                    and os.path.normcase(entry.destination) not in vacated
+                    and preflight.exists(entry.destination)]
+    return duplicates, existing
+
+
+def vacated_sources(entries, preflight):
+    """この一括処理の移動で空く（移動元が存在する）パスの集合（normcase 済み）"""
+    return {os.path.normcase(entry.current_source) for entry in entries if preflight.exists(entry.current_source)}
+
+
+class ConflictResolution:
+    """resolve_conflicts の結果"""
+
+    def __init__(self, index):
+        self.index = index
+        self.entries = []      # 実行するエントリ
+        self.missing = []      # 元ファイルが見つからないエントリ
+        self.skipped = []      # 方針によりスキップしたエントリ
+        self.unresolved = []   # 確認が必要なエントリ（CONFLICT_ASK の場合）
+        self.renamed = []      # 別名にしたエントリ
+
+    def approve_unresolved(self):
+        """
+        確認待ちのエントリを上書きで実行する（元の順序を保つ）
+
+        同じ一括処理内で保存先が重なる場合は、順番に上書きした結果と同じになるよう
+        後のエントリだけを実行し、先のエントリはスキップする。
+        """
+        claimants = {os.path.normcase(entry.destination): entry for entry in self.entries}
+        superseded = set()
+        for entry in sorted(self.unresolved, key=lambda entry: entry.index):
+            entry.overwrite = True
+            key = os.path.normcase(entry.destination)
+            previous = claimants.get(key)
+            if previous is not None:
+                superseded.add(id(previous))
+                self.skipped.append(previous)
+            claimants[key] = entry
+            self.index.claim(entry)
+        self.entries = sorted((entry for entry in self.entries + self.unresolved if id(entry) not in superseded),
+                              key=lambda entry: entry.index)
+        self.unresolved = []
+
+    def skip_unresolved(self):
+        self.skipped.extend(self.unresolved)
+        self.unresolved = []
+
+
+def resolve_conflicts(entries, policy, index=None):
+    """
+    実行前に保存先の衝突を方針に従って解決する（ダイアログは出さない）
+
+    既存ファイルだけでなく、同じ一括処理内で先に割り当てた名前との重複も衝突として扱う。
+    一括処理内の重複を上書き・新しい方を残す方針で解決した場合は、残すエントリだけを実行し、
+    負けたエントリはスキップする（同じ保存先への移動が並列に走らないように）。
+    保存先が別のエントリの移動元の場合（番号の付け直しなどの連鎖・循環）は、
+    その移動で空くので衝突にしない（実行順は order_moves で決める）。
+    unresolved に残ったエントリは呼び出し側でまとめて確認し、
+    approve_unresolved / skip_unresolved のどちらかを呼ぶ。
+    """
+    if policy not in CONFLICT_POLICIES:
+        raise ValueError(f"不明な衝突時の方針です: {policy}")
+
+    index = index or DestinationIndex()
+    preflight = index.preflight
+    result = ConflictResolution(index)
+    vacated = vacated_sources(entries, preflight)
+    claimants = {}      # 保存先（normcase）-> 割り当て済みのエントリ
+    superseded = set()  # 後のエントリに保存先を譲ったエントリ
+    for entry in entries:
+        if not preflight.exists(entry.current_source):
+            result.missing.append(entry)
+            continue
+
+        same_path = os.path.normcase(entry.current_source) == os.path.normcase(entry.destination)
+        if same_path:
+            conflict = False
+        elif os.path.normcase(entry.destination) in vacated:
+            conflict = index.claimed_by(entry.destination) is not None
+        else:
+            conflict = index.is_taken(entry.destination)
+
+        key = os.path.normcase(entry.destination)
+        previous = claimants.get(key)
+        if conflict:
+            if policy == CONFLICT_RENAME:
+                target_dir = os.path.dirname(entry.destination)
+                entry.filename = index.unique_filename(target_dir, entry.filename)
+                entry.destination = os.path.join(target_dir, entry.filename)
+                key = os.path.normcase(entry.destination)
+                previous = None
+                result.renamed.append(entry)
+            elif policy == CONFLICT_SKIP:
+                result.skipped.append(entry)
+                continue
+            elif policy == CONFLICT_ASK:
+                result.unresolved.append(entry)
+                continue
+            elif policy == CONFLICT_NEWER:
+                # 同じ一括処理内の重複なら、先に割り当てた元ファイルと比べる
+                other = previous.current_source if previous is not None else entry.destination
+                if preflight.getmtime(entry.current_source) <= preflight.getmtime(other):
+                    result.skipped.append(entry)
+                    continue
+                entry.overwrite = True
+            else:
+                entry.overwrite = True
+            if previous is not None:
+                superseded.add(id(previous))
+                result.skipped.append(previous)
+
+        claimants[key] = entry
+        index.claim(entry)
+        result.entries.append(entry)
+
+    if superseded:
+        result.entries = [entry for entry in result.entries if id(entry) not in superseded]
+    skip_blocked_entries(result, vacated)
+    return result
+
+
+def skip_blocked_entries(result, vacated):
+    """
+    保存先にしていた移動元がスキップされて空かないエントリを、連鎖をたどってスキップする
+
+    確認待ち（unresolved）の移動元は、上書きの確認で実行されることがあるので待つ。
+    確認後にスキップされた場合は、実行時に保存先が埋まっているため失敗になる（上書きはしない）。
+    """
+    moving = {os.path.normcase(entry.current_source) for entry in result.entries + result.unresolved}
+    waiting = {}
+    for entry in result.entries:
+        key = os.path.normcase(entry.destination)
+        if key in vacated and key != os.path.normcase(entry.current_source):
+            waiting[key] = entry
+    stack = [key for key in waiting if key not in moving]
+    blocked = set()
+    while stack:
+        entry = waiting.pop(stack.pop(), None)
+        if entry is None:
+            continue
+        blocked.add(id(entry))
+        result.skipped.append(entry)
+        stack.append(os.path.normcase(entry.current_source))
+    if blocked:
+        result.entries = [entry for entry in result.entries if id(entry) not in blocked]
+
+
+def execute_entry(entry, index=None):
+    """
+    計画エントリ1件を実行し、{"bytes", "source_device", "dest_device", "strategy"} を返す
+
+    index があれば、上書きを許可していないのに保存先が埋まっている場合は中止し、
+    成功したら索引を更新する。サイズとデバイスは index の一覧・キャッシュから求め、
+    移動の方法はフォルダの組み合わせごとに一度だけ決める。
+    """
+    source = entry.current_source
+    if index is not None and not entry.overwrite \
+            and os.path.normcase(source) != os.path.normcase(entry.destination) \
+            and index.exists_on_disk(entry.destination):
+        raise FileExistsError(f"保存先に同じ名前のファイルが既に存在します: {entry.filename}")
+    info = {"bytes": None, "source_device": None, "dest_device": None, "strategy": None}
+    strategy = None
+    if index is not None:
+        try:
+            if entry.staged_source is None:
+                info["bytes"] = index.preflight.getsize(source)
+            else:
+                info["bytes"] = os.path.getsize(source)
+        except OSError:
+            pass
+        info["source_device"] = index.device_of(os.path.dirname(source))
+        info["dest_device"] = index.device_of(os.path.dirname(entry.destination))
+        strategy = move_strategy(info["source_device"], info["dest_device"])
+    if METRICS.enabled:
+        with METRICS.timer("move", METRICS.device_of(os.path.dirname(entry.destination))):
+            info["strategy"] = move_file(source, entry.destination, strategy)
+        METRICS.count(f"move_{info['strategy']}")
+    else:
+        info["strategy"] = move_file(source, entry.destination, strategy)
+    if index is not None:
+        index.commit(entry)
+    return info
+
+
+def move_strategy(source_device, dest_device):
+    """デバイス番号から移動の方法を決める（分からない場合は名前の変更を試す）"""
+    if source_device is not None and dest_device is not None and source_device != dest_device:
+        return MOVE_COPY
+    return MOVE_RENAME
+
+
+def move_file(source, destination, strategy=None):
+    """
+    ファイルを移動して、使った方法（MOVE_RENAME / MOVE_COPY）を返す
+
+    strategy を省略した場合はフォルダのデバイス番号を比べて決める。保存先に同じ名前の
+    ファイルがあれば上書きする（確認は呼び出し側で行う）。同じデバイスのはずでも
+    名前の変更ができなかった場合（EXDEV）はコピーに切り替える。
+    """
+    if strategy is None:
+        try:
+            strategy = move_strategy(os.stat(os.path.dirname(os.path.abspath(source))).st_dev,
+                                     os.stat(os.path.dirname(os.path.abspath(destination))).st_dev)
+        except OSError:
+            strategy = MOVE_RENAME
+    if strategy == MOVE_RENAME:
+        try:
+            os.replace(source, destination)
+            return MOVE_RENAME
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    if os.path.islink(source) or not os.path.isfile(source):
+        # シンボリックリンクやフォルダは shutil.move に任せる
+        import shutil
+        shutil.move(source, destination)
+    else:
+        copy_across_devices(source, destination)
+    return MOVE_COPY
+
+
+def copy_across_devices(source, destination):
+    """
+    別のデバイスへファイルをコピーしてから移動元を削除する
+
+    保存先と同じフォルダの一時ファイルへコピーし、日時と属性をコピーしてから
+    保存先の名前に置き換える。途中で失敗した場合は一時ファイルを削除し、移動元は残す。
+    """
+    import shutil
+    directory, name = os.path.split(os.path.abspath(destination))
+    tmp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}.fmpart")
+    try:
+        with open(source, "rb") as src, open(tmp_path, "wb") as dst:
+            _advise(src.fileno(), "POSIX_FADV_SEQUENTIAL")
+            copy_file_data(src, dst)
+            if os.fstat(dst.fileno()).st_size != os.fstat(src.fileno()).st_size:
+                raise OSError(errno.EIO, "コピーしたファイルの大きさが移動元と一致しません", source)
+            # 一度しか読まないので、移動元のページキャッシュを残さない
+            _advise(src.fileno(), "POSIX_FADV_DONTNEED")
+        shutil.copystat(source, tmp_path)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    os.remove(source)
+
+
+def copy_file_data(src, dst):
+    """
+    開いたファイルの中身をコピーする
+
+    カーネル内でコピーする os.copy_file_range（Linux）、os.sendfile の順に試し、
+    どちらも使えない場合は大きなバッファで読み書きする。
+    """
+    infd, outfd = src.fileno(), dst.fileno()
+    size = os.fstat(infd).st_size
+    copied = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while True:
+                sent = os.copy_file_range(infd, outfd, COPY_CHUNK_SIZE, copied, copied)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError as e:
+            if copied or e.errno not in _COPY_FALLBACK_ERRNOS:
+                raise
+        # 中身があるのに何もコピーされない場合（一部のファイルシステム）は次の方法を試す
+        if copied or not size:
+            os.lseek(outfd, copied, os.SEEK_SET)
+            return
+    if hasattr(os, "sendfile") and sys.platform.startswith("linux"):
+        try:
+            while True:
+                sent = os.sendfile(outfd, infd, copied, COPY_CHUNK_SIZE)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError as e:
+            if copied or e.errno not in _COPY_FALLBACK_ERRNOS:
+                raise
+        if copied or not size:
+            return
+    import shutil
+    shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+
+
+def _advise(fd, advice):
+    """posix_fadvise でアクセスの仕方を伝える（使えない環境では何もしない）"""
+    if hasattr(os, "posix_fadvise") and hasattr(os, advice):
+        try:
+            os.posix_fadvise(fd, 0, 0, getattr(os, advice))
+        except OSError:
+            pass
+
+
+def staging_path(path):
+    """循環を崩すときに一時的に使う、同じフォルダ内の隠しファイル名"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}.fmtmp")
+
+
+class MoveChain:
+    """
+    順番に実行しなければならないエントリの列（order_moves が作る）
+
+    a→b, b→c のような連鎖は、保存先が空いている末尾（b→c）から実行する。
+    a→b, b→a のような循環は、parked の移動元を先に一時的な名前へ移して連鎖にし、
+    最後に一時的な名前から保存先へ移す。途中で失敗した場合、残りのエントリは実行しない。
+    """
+
+    def __init__(self, entries, parked=None, index=None):
+        self.entries = entries
+        self.parked = parked
+        self.index = index
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def execute(self, operation):
+        """operation で順番に実行し、OperationResult を1件ずつ返す"""
+        if self.parked is not None:
+            try:
+                self._park()
+            except OSError as e:
+                for entry in self.entries:
+                    yield OperationResult(entry, STATUS_FAILED, e)
+                return
+        error = None
+        for entry in self.entries:
+            if error is not None:
+                yield OperationResult(entry, STATUS_FAILED, RuntimeError(f"先に実行する移動が失敗したため中止しました: {error}"))
+                continue
+            started = time.perf_counter()
+            try:
+                info = operation(entry)
+            except Exception as e:
+                error = e
+                if entry is self.parked:
+                    e = OSError(f"{e}（ファイルは一時的な名前 {entry.staged_source} のままです）")
+                yield OperationResult(entry, STATUS_FAILED, e, time.perf_counter() - started)
+            else:
+                yield OperationResult(entry, STATUS_SUCCESS, None, time.perf_counter() - started, info)
+        if error is not None and self.parked is not None:
+            self._unpark()
+
+    def _park(self):
+        entry = self.parked
+        if os.path.lexists(entry.staged_source):
+            raise FileExistsError(f"一時的な名前のファイルが既に存在します: {entry.staged_source}")
+        os.rename(entry.source, entry.staged_source)
+        if self.index is not None:
+            self.index.commit_move(entry.source, entry.staged_source)
+
+    def _unpark(self):
+        """一時的な名前に移したファイルを、元の場所が空いていれば戻す"""
+        entry = self.parked
+        if not os.path.exists(entry.staged_source) or os.path.exists(entry.source):
+            return
+        try:
+            os.rename(entry.staged_source, entry.source)
+        except OSError:
+            return
+        if self.index is not None:
+            self.index.commit_move(entry.staged_source, entry.source)
+
+
+def order_moves(entries, index=None):
+    """
+    保存先が別のエントリの移動元になっている連鎖・循環を見つけて実行単位に分ける（O(n)）
+
+    同じ保存先へ移動するエントリが複数ある場合も、並列に実行しないよう同じ連鎖にまとめる。
+    独立したエントリはそのまま、連鎖・循環は MoveChain にまとめたリストを返す。
+    循環では最初に見つかったエントリに一時的な名前（staged_source）を割り当てるので、
+    先行書き込みログを作る前に呼ぶ。
+    """
+    by_source = {os.path.normcase(entry.current_source): entry for entry in entries}
+    last_for_destination = {}  # 保存先 -> 最後にその保存先へ移動するエントリ
+    blocker = {}     # id(エントリ) -> 先に実行するエントリ
+    blocked_by = {}  # id(エントリ) -> 後で実行するエントリ
+    for entry in entries:
+        key = os.path.normcase(entry.destination)
+        if key == os.path.normcase(entry.current_source):
+            continue
+        # 同じ保存先へ移動するエントリが複数ある場合は、計画の順に1つずつ実行する
+        other = last_for_destination.get(key) or by_source.get(key)
+        last_for_destination[key] = entry
+        if other is None or other is entry:
+            continue
+        # 待っているエントリが既にあれば、その後ろにつなぐ
+        seen = {id(other)}
+        while id(other) in blocked_by:
+            other = blocked_by[id(other)]
+            if id(other) in seen:
+                break
+            seen.add(id(other))
+        if other is entry or id(other) in blocked_by:
+            continue
+        blocker[id(entry)] = other
+        blocked_by[id(other)] = entry
+
+    units = []
+    visited = set()
+    for entry in entries:
+        if id(entry) in visited:
+            continue
+        if id(entry) not in blocker and id(entry) not in blocked_by:
+            visited.add(id(entry))
+            units.append(entry)
+            continue
+        # 保存先が空いている末尾までたどる（entry に戻ってきたら循環）
+        tail = entry
+        cycle = False
+        while id(tail) in blocker:
+            tail = blocker[id(tail)]
+            if tail is entry:
+                cycle = True
+                break
+        chain = [tail]
+        current = tail
+        while id(current) in blocked_by and blocked_by[id(current)] is not tail:
+            current = blocked_by[id(current)]
+            chain.append(current)
+        visited.update(id(item) for item in chain)
+        parked = None
+        if cycle:
+            parked = tail
+            parked.staged_source = staging_path(parked.source)
+            chain = chain[1:] + [parked]
+        units.append(MoveChain(chain, parked, index))
+    return units
+
+
+class OperationResult:
+    """1ファイル分の処理結果（状態・例外・所要時間・処理が返した情報）"""
+    __slots__ = ("entry", "status", "error", "elapsed", "info")
+
+    def __init__(self, entry, status, error=None, elapsed=0.0, info=None):
+        self.entry = entry
+        self.status = status
+        self.error = error
+        self.elapsed = elapsed
+        self.info = info
+
+    def as_dict(self):
+        return {
+            "index": self.entry.index,
+            "status": self.status,
+            "source": self.entry.source,
+            "destination": self.entry.destination,
+            "elapsed_ms": round(self.elapsed * 1000, 3),
+            "error_type": type(self.error).__name__ if self.error is not None else "",
+            "error": str(self.error) if self.error is not None else "",
+        }
+
+
+class BatchReport:
+    """一括処理全体の結果。終了後に1回だけ表示し、CSV/JSONに出力できる"""
+
+    FIELDS = ("index", "status", "source", "destination", "elapsed_ms", "error_type", "error")
+
+    def __init__(self, action_name):
+        self.action_name = action_name
+        self.started_at = datetime.now()
+        # ジャーナルで同じ一括処理の記録をまとめるためのID（名前順で開始した順に並ぶ）
+        self.batch_id = f"{self.started_at:%Y%m%d-%H%M%S-%f}-{uuid.uuid4().hex[:8]}"
+        self._started = time.perf_counter()
+        self.elapsed = 0.0
+        self.results = []
+        self.groups = []  # デバイスのグループごとの進捗（DeviceScheduler.progress）
+
+    def add(self, result):
+        self.results.append(result)
+
+    def add_entries(self, entries, status):
+        for entry in entries:
+            self.results.append(OperationResult(entry, status))
+
+    def finish(self, scheduler=None):
+        self.elapsed = time.perf_counter() - self._started
+        if scheduler is not None:
+            self.groups = scheduler.progress()
+
+    def count(self, status):
+        return sum(1 for result in self.results if result.status == status)
+
+    def counts(self):
+        counts = {status: 0 for status in (STATUS_SUCCESS, STATUS_FAILED, STATUS_SKIPPED,
+                                           STATUS_MISSING, STATUS_CANCELLED)}
+        for result in self.results:
+            counts[result.status] += 1
+        return counts
+
+    @property
+    def failures(self):
+        return [result for result in self.results if result.status == STATUS_FAILED]
+
+    def summary(self):
+        counts = self.counts()
+        return (f"{self.action_name}: 成功 {counts[STATUS_SUCCESS]} / 失敗 {counts[STATUS_FAILED]} / "
+                f"スキップ {counts[STATUS_SKIPPED]} / 見つからない {counts[STATUS_MISSING]} / "
+                f"キャンセル {counts[STATUS_CANCELLED]}（{self.elapsed:.1f}秒）")
+
+    def export_csv(self, path):
+        import csv
+        # Excelで文字化けしないようBOM付きUTF-8で出力
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+            writer.writeheader()
+            for result in self.results:
+                writer.writerow(result.as_dict())
+
+    def export_json(self, path):
+        data = {
+            "batch_id": self.batch_id,
+            "action": self.action_name,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "elapsed": round(self.elapsed, 3),
+            "counts": self.counts(),
+            "groups": self.groups,
+            "results": [result.as_dict() for result in self.results],
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+class BatchJob:
+    """
+    実行計画をスレッドプールで実行する一括処理ジョブ
+
+    進捗は events キューに (種類, OperationResult) のタプルで送る。
+      ("result", OperationResult) : 1ファイル終了（成功・失敗）
+      ("finished", None)          : すべて終了（キャンセル時も送る）
+    UI側は root.after で events を取り出す。キャンセルはファイルとファイルの間で止まる。
+    scheduler（DeviceScheduler）を渡すと、max_workers の代わりにデバイスごとの上限で並列に実行する。
+    """
+
+    def __init__(self, entries, operation, max_workers=1, scheduler=None):
+        # MoveChain（order_moves の結果）は1つのワーカーが順番に実行する
+        self.entries = list(entries)
+        self.operation = operation
+        self.max_workers = max(1, int(max_workers))
+        self.scheduler = scheduler
+        if scheduler is not None:
+            scheduler.add(self.entries)
+        self.events = queue.Queue()
+        self.total = sum(len(unit) if isinstance(unit, MoveChain) else 1 for unit in self.entries)
+        self.cancelled_entries = []
+        self._pending = iter(self.entries)
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self._active = 0
+        self._finished = threading.Event()
+
+    def start(self):
+        # 起動を速くするため、実際に一括処理を行うときに読み込む
+        from concurrent.futures import ThreadPoolExecutor
+
+        max_workers = self.max_workers if self.scheduler is None else self.scheduler.worker_count()
+        workers = min(max_workers, len(self.entries)) or 1
+        self._active = workers
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-job")
+        for _ in range(workers):
+            executor.submit(self._worker)
+        # 実行中のワーカーはそのまま走らせ、終わったらスレッドを片付ける
+        executor.shutdown(wait=False)
+        return self
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    @property
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def is_running(self):
+        return not self._finished.is_set()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def _next_entry(self):
+        if self.scheduler is not None:
+            return self.scheduler.acquire(self._cancel_event)
+        with self._lock:
+            return next(self._pending, None)
+
+    def _execute(self, entry):
+        if isinstance(entry, MoveChain):
+            # 連鎖の途中では止めない（循環の一時的な名前が残らないように）
+            for result in entry.execute(self.operation):
+                self.events.put(("result", result))
+            return
+        started = time.perf_counter()
+        try:
+            info = self.operation(entry)
+        except Exception as e:
+            result = OperationResult(entry, STATUS_FAILED, e, time.perf_counter() - started)
+        else:
+            result = OperationResult(entry, STATUS_SUCCESS, None, time.perf_counter() - started, info)
+        self.events.put(("result", result))
+
+    def _worker(self):
+        try:
+            while not self._cancel_event.is_set():
+                entry = self._next_entry()
+                if entry is None:
+                    break
+                try:
+                    self._execute(entry)
+                finally:
+                    if self.scheduler is not None:
+                        self.scheduler.release(entry)
+        finally:
+            with self._lock:
+                self._active -= 1
+                last = self._active == 0
+                if last:
+                    # キャンセルで実行されなかった分
+                    self.cancelled_entries = []
+                    pending = self._pending if self.scheduler is None else self.scheduler.remaining()
+                    for unit in pending:
+                        if isinstance(unit, MoveChain):
+                            self.cancelled_entries.extend(unit)
+                        else:
+                            self.cancelled_entries.append(unit)
+            if last:
+                self._finished.set()
+                self.events.put(("finished", None))
+
+
+def parse_device_limits(text):
+    """
+    「フォルダ=数」を ; または改行で区切った文字列を {フォルダ: 数} にする
+
+    例: "E:\\=1; \\\\nas\\share=2"。数が正の整数でない場合は ValueError。
+    """
+    limits = {}
+    for item in re.split(r"[;\n]", text or ""):
+        item = item.strip()
+        if not item:
+            continue
+        folder, separator, limit = item.rpartition("=")
+        if not separator or not folder.strip() or not limit.strip().isdigit() or int(limit) < 1:
+            raise ValueError(f"デバイスごとの上限は「フォルダ=数」で指定してください: {item}")
+        limits[folder.strip()] = int(limit)
+    return limits
+
+
+class DeviceGroup:
+    """DeviceScheduler の1グループ（同じ移動元デバイス・移動先デバイスの実行単位）"""
+
+    def __init__(self, key, unit):
+        entry = unit.entries[0] if isinstance(unit, MoveChain) else unit
+        self.key = key
+        self.devices = set(key)  # 同じデバイス内の移動は1つと数える
+        self.source_dir = os.path.dirname(entry.current_source)
+        self.dest_dir = os.path.dirname(entry.destination)
+        self.pending = deque()
+        self.total = 0
+        self.done = 0
+        self.running = 0
+        self.started = None
+        self.finished = None
+
+    def as_dict(self):
+        elapsed = None
+        if self.started is not None:
+            elapsed = round((self.finished or time.perf_counter()) - self.started, 3)
+        return {
+            "source": self.source_dir,
+            "destination": self.dest_dir,
+            "source_device": self.key[0],
+            "dest_device": self.key[1],
+            "done": self.done,
+            "total": self.total,
+            "elapsed": elapsed,
+        }
+
+
+class DeviceScheduler:
+    """
+    実行単位を (移動元のデバイス, 移動先のデバイス) のグループに分けて、グループ同士を並列に実行する
+
+    デバイスごとに同時に実行する数の上限（limits、指定のないデバイスは default_limit）を守り、
+    上限に空きのあるグループから順番に取り出す。カードリーダー4台から同じSSDへ取り込む場合、
+    SSD の上限が4以上なら4つのグループが同時に進み、回転するディスクは上限1にすれば1件ずつ読み書きする。
+    """
+
+    def __init__(self, key_of, default_limit=1, limits=None):
+        self.key_of = key_of
+        self.default_limit = max(1, int(default_limit))
+        self.limits = dict(limits or {})  # デバイス番号 -> 上限
+        self.groups = []
+        self._groups = {}         # キー -> DeviceGroup
+        self._running = {}        # id(実行単位) -> DeviceGroup
+        self._active = Counter()  # デバイス番号 -> 実行中の数
+        self._next = 0
+        self._cond = threading.Condition()
+
+    @classmethod
+    def for_index(cls, index, default_limit=1, folder_limits=None):
+        """index のデバイス番号のキャッシュでグループを決め、{フォルダ: 上限} をデバイス番号に直して作る"""
+        def key_of(unit):
+            entry = unit.entries[0] if isinstance(unit, MoveChain) else unit
+            return (index.device_of(os.path.dirname(entry.current_source)),
+                    index.device_of(os.path.dirname(entry.destination)))
+
+        limits = {}
+        for folder, limit in (folder_limits or {}).items():
+            device = index.device_of(folder)
+            if device is not None:
+                limits[device] = min(limit, limits.get(device, limit))
+        return cls(key_of, default_limit, limits)
+
+    def limit(self, device):
+        return self.limits.get(device, self.default_limit)
+
+    def add(self, units):
+        with self._cond:
+            for unit in units:
+                key = self.key_of(unit)
+                group = self._groups.get(key)
+                if group is None:
+                    group = self._groups[key] = DeviceGroup(key, unit)
+                    self.groups.append(group)
+                group.pending.append(unit)
+                group.total += len(unit) if isinstance(unit, MoveChain) else 1
+
+    def worker_count(self):
+        """同時に実行できる最大の数（これより多くのワーカーを起動しても待つだけになる）"""
+        devices = set()
+        for group in self.groups:
+            devices.update(group.devices)
+        return min(MAX_SCHEDULER_WORKERS, sum(self.limit(device) for device in devices)) or 1
+
+    def acquire(self, cancel_event=None):
+        """次に実行する単位を取り出す。上限に空きがなければ待ち、残っていなければ None"""
+        with self._cond:
+            while cancel_event is None or not cancel_event.is_set():
+                waiting = False
+                for offset in range(len(self.groups)):
+                    group = self.groups[(self._next + offset) % len(self.groups)]
+                    if not group.pending:
+                        continue
+                    waiting = True
+                    if any(self._active[device] >= self.limit(device) for device in group.devices):
+                        continue
+                    for device in group.devices:
+                        self._active[device] += 1
+                    # 次は別のグループから探す
+                    self._next = (self._next + offset + 1) % len(self.groups)
+                    unit = group.pending.popleft()
+                    group.running += 1
+                    if group.started is None:
+                        group.started = time.perf_counter()
+                    self._running[id(unit)] = group
+                    return unit
+                if not waiting:
+                    return None
+                # キャンセルに気づけるよう、短い間隔で待つ
+                self._cond.wait(0.1)
+            return None
+
+    def release(self, unit):
+        """実行し終えた単位の分だけデバイスの空きを戻す"""
+        with self._cond:
+            group = self._running.pop(id(unit))
+            for device in group.devices:
+                self._active[device] -= 1
+            group.running -= 1
+            group.done += len(unit) if isinstance(unit, MoveChain) else 1
+            if not group.pending and not group.running:
+                group.finished = time.perf_counter()
+            self._cond.notify_all()
+
+    def remaining(self):
+        """まだ取り出していない実行単位（キャンセルした場合の残り）"""
+        with self._cond:
+            return [unit for group in self.groups for unit in group.pending]
+
+    def progress(self):
+        """グループごとの進捗（DeviceGroup.as_dict のリスト）"""
+        with self._cond:
+            return [group.as_dict() for group in self.groups]
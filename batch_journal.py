@@ -0,0 +1,636 @@
+"""
+操作ジャーナル（file_manager_journal.jsonl）、中断した一括処理の記録（file_manager_pending/）、
+元に戻す履歴（file_manager_undo/）
+
+実行したファイル操作を1行1件のJSONで追記する。書き込みはバックグラウンドのスレッドで
+まとめて行うので、一括処理やUIは待たされない。ファイルが一定のサイズを超えたら
+file_manager_journal.jsonl.1, .2 ... にずらして新しいファイルに書く。
+
+    {"type": "operation", "time": ..., "batch": ..., "action": ..., "status": ...,
+     "source": ..., "destination": ..., "bytes": ..., "duration": ...,
+     "source_device": ..., "dest_device": ..., "strategy": "rename" | "copy", "error": ...}
+    {"type": "batch", "time": ..., "batch": ..., "action": ..., "counts": {...},
+     "elapsed": ..., "files": ..., "bytes": ..., "files_per_second": ..., "mb_per_second": ...}
+
+一括処理の実行前には、実行計画を file_manager_pending/<batch_id>.wal に書いて fsync し、
+移動が終わるたびにその番号を追記する（先行書き込みログ）。正常に終わればファイルを削除する。
+次回の起動時に残っていれば、中断された一括処理として再開または元に戻すことができる。
+
+終わった一括処理は、実際に移動したファイルの対応表を file_manager_undo/<batch_id>.json に
+保存する（新しいものから UNDO_HISTORY_LIMIT 件）。元に戻すときは逆向きの計画を作り、
+通常の一括処理と同じ方法で実行する。
+"""
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from batch_engine import (
+    STATUS_CANCELLED, STATUS_FAILED, STATUS_SUCCESS, MoveChain, PlanEntry, PreflightScan, move_file, order_moves
+)
+from settings_store import get_application_path, write_json_atomic
+
+JOURNAL_FILENAME = 'file_manager_journal.jsonl'
+JOURNAL_MAX_BYTES = 10 * 1024 * 1024
+JOURNAL_BACKUP_COUNT = 5
+
+PENDING_DIRNAME = 'file_manager_pending'
+WAL_SUFFIX = '.wal'
+# 完了の記録を fsync する間隔（件数か秒数のどちらかに達したとき）
+WAL_SYNC_EVERY = 256
+WAL_SYNC_INTERVAL = 0.5
+# Windows でロックする位置（ファイルの終わりより先の1バイト。読み書きする範囲と重ならないように）
+_WINDOWS_LOCK_OFFSET = 0x7fffffff
+
+UNDO_DIRNAME = 'file_manager_undo'
+UNDO_HISTORY_LIMIT = 10
+
+
+def get_journal_path():
+    return os.path.join(get_application_path(), JOURNAL_FILENAME)
+
+
+def get_pending_dir():
+    return os.path.join(get_application_path(), PENDING_DIRNAME)
+
+
+def get_undo_dir():
+    return os.path.join(get_application_path(), UNDO_DIRNAME)
+
+
+def operation_record(report, result, when):
+    info = result.info or {}
+    return {
+        "type": "operation",
+        "time": when.isoformat(timespec="milliseconds"),
+        "batch": report.batch_id,
+        "action": report.action_name,
+        "status": result.status,
+        "source": result.entry.source,
+        "destination": result.entry.destination,
+        "bytes": info.get("bytes"),
+        "duration": round(result.elapsed, 6),
+        "source_device": info.get("source_device"),
+        "dest_device": info.get("dest_device"),
+        "strategy": info.get("strategy"),
+        "error": str(result.error) if result.error is not None else None,
+    }
+
+
+def batch_record(report, when):
+    """一括処理全体の件数とスループット（成功したファイルのみで計算）"""
+    succeeded = [result for result in report.results if result.status == STATUS_SUCCESS]
+    total_bytes = sum((result.info or {}).get("bytes") or 0 for result in succeeded)
+    elapsed = report.elapsed
+    return {
+        "type": "batch",
+        "time": when.isoformat(timespec="milliseconds"),
+        "batch": report.batch_id,
+        "action": report.action_name,
+        "started": report.started_at.isoformat(timespec="seconds"),
+        "counts": report.counts(),
+        "elapsed": round(elapsed, 3),
+        "files": len(succeeded),
+        "bytes": total_bytes,
+        "files_per_second": round(len(succeeded) / elapsed, 1) if elapsed else None,
+        "mb_per_second": round(total_bytes / elapsed / (1024 * 1024), 3) if elapsed else None,
+    }
+
+
+class OperationJournal:
+    """
+    バッファ付きで追記するジャーナル
+
+    record_result / record_batch はキューに入れるだけで、JSONへの変換と書き込みは
+    書き込みスレッドが行う。最初の記録から flush_interval 秒たつか、buffer_lines 件溜まったら
+    まとめて1回で書き込む。書き込みに失敗しても一括処理は止めず、標準エラーに表示する。
+    """
+
+    def __init__(self, path=None, max_bytes=JOURNAL_MAX_BYTES, backup_count=JOURNAL_BACKUP_COUNT,
+                 flush_interval=0.5, buffer_lines=1000):
+        self.path = path or get_journal_path()
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.buffer_lines = buffer_lines
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="operation-journal", daemon=True)
+        self._thread.start()
+        return self
+
+    def record_result(self, report, result):
+        self._queue.put((operation_record, report, result, datetime.now()))
+
+    def record_results(self, report, results):
+        for result in results:
+            self.record_result(report, result)
+
+    def record_batch(self, report):
+        self._queue.put((batch_record, report, datetime.now()))
+
+    def close(self, timeout=5.0):
+        """未書き込みの記録を書き出してスレッドを終了する"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        lines = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+                timed_out = False
+            except queue.Empty:
+                item, timed_out = None, True
+            if item is not None:
+                lines.append(json.dumps(item[0](*item[1:]), ensure_ascii=False) + "\n")
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(lines) < self.buffer_lines:
+                    continue
+            if lines:
+                try:
+                    self._write(lines)
+                except OSError as e:
+                    print(f"ジャーナルを書き込めません: {self.path}: {e}", file=sys.stderr)
+                lines = []
+                deadline = None
+            if item is None and not timed_out:
+                return
+
+    def _write(self, lines):
+        data = "".join(lines).encode("utf-8")
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        if size and size + len(data) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def _rotate(self):
+        """journal.jsonl -> .1 -> .2 ...（backup_count を超えた古いものは削除）"""
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+def lock_file(file, wait=False):
+    """
+    開いているファイルに排他ロックをかける（ファイルを閉じると解除される）
+
+    wait が False の場合は待たずに、他のプロセスがロックしていれば False を返す。
+    """
+    fd = file.fileno()
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+            position = os.lseek(fd, 0, os.SEEK_CUR)
+            os.lseek(fd, _WINDOWS_LOCK_OFFSET, os.SEEK_SET)
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK if wait else msvcrt.LK_NBLCK, 1)
+            finally:
+                os.lseek(fd, position, os.SEEK_SET)
+        else:
+            import fcntl
+            fcntl.flock(fd, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        if wait:
+            raise
+        return False
+    return True
+
+
+def is_locked(path):
+    """他のプロセスが path をロックしているか（実行中の一括処理のログか）"""
+    try:
+        with open(path, "rb") as f:
+            return not lock_file(f)
+    except FileNotFoundError:
+        return False
+
+
+def _still_at(file, path):
+    """開いているファイルがまだ path にあるか（削除・置き換えされていないか）"""
+    try:
+        return os.path.samestat(os.fstat(file.fileno()), os.stat(path))
+    except OSError:
+        return False
+
+
+class BatchWriteAheadLog:
+    """
+    実行中の一括処理の先行書き込みログ
+
+    create() で実行計画を書いて fsync してから実行を始める。wrap() で包んだ処理が成功すると、
+    ワーカーがすぐにそのエントリの番号を追記する。追記はその場で OS に渡すのでプロセスが
+    落ちても残り、fsync は WAL_SYNC_EVERY 件か WAL_SYNC_INTERVAL 秒ごとにまとめて行う。
+    電源断などで最後の fsync 以降の記録が失われた分は、復旧時に判定する（UnfinishedBatch.inspect）。
+
+    実行中はログ（書いている途中の .tmp も）を排他ロックしておき、他のプロセス（2つ目のGUIや
+    cron の run）が中断した一括処理と間違えないようにする。
+    """
+
+    def __init__(self, path, file):
+        self.path = path
+        self.error = None  # 追記に失敗した場合の例外（復旧時は存在で判定するので処理は続ける）
+        self._file = file
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    @classmethod
+    def create(cls, report, entries, directory=None):
+        directory = directory or get_pending_dir()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, report.batch_id + WAL_SUFFIX)
+        header = {
+            "type": "plan",
+            "batch": report.batch_id,
+            "action": report.action_name,
+            "created": report.started_at.isoformat(timespec="seconds"),
+            "entries": [[entry.index, entry.source, entry.destination, entry.overwrite, entry.staged_source]
+                        for entry in entries],
+        }
+        # 途中で落ちても壊れた計画が残らないよう、一時ファイルに書いてから置き換える
+        tmp_path = path + ".tmp"
+        f = open(tmp_path, "w", encoding="utf-8")
+        try:
+            lock_file(f, wait=True)
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            if sys.platform == "win32":
+                # 開いているファイルは置き換えられないので、閉じてから開き直してロックする
+                f.close()
+                os.replace(tmp_path, path)
+                f = open(path, "a", encoding="utf-8")
+                lock_file(f, wait=True)
+            else:
+                # ロックしたまま置き換え、同じファイルに追記を続ける
+                os.replace(tmp_path, path)
+        except BaseException:
+            f.close()
+            raise
+        return cls(path, f)
+
+    def wrap(self, operation):
+        """成功したらすぐに完了を記録するよう、ワーカーで実行する処理を包む"""
+        def checkpointed_operation(entry):
+            info = operation(entry)
+            self.checkpoint(entry)
+            return info
+
+        return checkpointed_operation
+
+    def checkpoint(self, entry):
+        with self._lock:
+            try:
+                self._file.write(f"{entry.index}\n")
+                self._file.flush()
+                self._unsynced += 1
+                if self._unsynced >= WAL_SYNC_EVERY or time.monotonic() - self._synced_at >= WAL_SYNC_INTERVAL:
+                    self._sync()
+            except OSError as e:
+                self.error = e
+
+    def sync(self):
+        with self._lock:
+            try:
+                self._sync()
+            except OSError as e:
+                self.error = e
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def close(self):
+        """ログを残したまま閉じる（次回起動時に中断した一括処理として扱われる）"""
+        if not self._file.closed:
+            self._file.close()
+
+    def finish(self):
+        """一括処理が終わったのでログを削除する（ロックしたまま削除できる場合は先に削除する）"""
+        if sys.platform == "win32":
+            self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.close()
+
+
+class RecoveryState:
+    """中断した一括処理の各エントリの状態"""
+
+    def __init__(self):
+        self.done = []       # 移動済み
+        self.pending = []    # 未処理（移動元が残っている）
+        self.lost = []       # 移動元も移動先も見つからない
+        self.uncertain = []  # 要確認（計画内の別のエントリとパスが重なり、存在では判定できない）
+
+
+class UnfinishedBatch:
+    """
+    前回の起動で終わらなかった一括処理（.wal ファイル1つ分）
+
+    ログをロックした状態で読み込み、discard() か release() を呼ぶまでロックを保つ
+    （同じ一括処理を2つのプロセスで再開・元に戻すことがないように）。
+    """
+
+    def __init__(self, path, batch_id, action_name, created, entries, completed, file=None):
+        self.path = path
+        self._file = file
+        self.batch_id = batch_id
+        self.action_name = action_name
+        self.created = created
+        self.entries = entries
+        self.completed = completed  # 完了を記録済みのエントリ番号
+
+    @classmethod
+    def load(cls, path, file):
+        """ロック済みの file から読み込む。読み込めない（計画を書き終える前に落ちた）場合は None"""
+        try:
+            header = json.loads(file.readline())
+        except ValueError:
+            return None
+        completed = set()
+        for line in file:
+            # 最後の行は書きかけの場合があるので、改行まで書けた行だけを使う
+            if line.endswith("\n") and line[:-1].isdigit():
+                completed.add(int(line))
+        entries = []
+        for index, source, destination, overwrite, *staged in header["entries"]:
+            entry = PlanEntry(index, source, destination, os.path.basename(destination))
+            entry.overwrite = overwrite
+            entry.staged_source = staged[0] if staged else None
+            entries.append(entry)
+        return cls(path, header["batch"], header["action"], header.get("created", ""), entries, completed, file)
+
+    def inspect(self):
+        """
+        各エントリが移動済みか未処理かを判定する
+
+        完了を記録済みのエントリは調べない。記録が残っていないものだけ、
+        フォルダごとに1回 os.scandir して移動元・移動先の有無で判定する。
+        移動元か移動先が計画内の別のエントリのパスと重なる場合（連鎖・循環・同じ保存先）は、
+        存在では移動済みか未処理かを区別できないので uncertain に入れ、再開・元に戻す対象にしない。
+        """
+        state = RecoveryState()
+        sources = Counter()
+        destinations = Counter()
+        for entry in self.entries:
+            if os.path.normcase(entry.source) != os.path.normcase(entry.destination):
+                sources[os.path.normcase(entry.source)] += 1
+                destinations[os.path.normcase(entry.destination)] += 1
+        unchecked = []
+        for entry in self.entries:
+            if entry.index in self.completed:
+                state.done.append(entry)
+            else:
+                unchecked.append(entry)
+        preflight = PreflightScan()
+        for entry in unchecked:
+            if entry.staged_source is not None:
+                if preflight.exists(entry.staged_source):
+                    # 循環を崩すために一時的な名前へ移したところで止まった
+                    state.pending.append(entry)
+                    continue
+                # まだ一時的な名前へ移していないか、既に保存先へ移した
+                entry.staged_source = None
+            source_key = os.path.normcase(entry.source)
+            destination_key = os.path.normcase(entry.destination)
+            if source_key != destination_key and (
+                    destinations[source_key] or sources[destination_key] or destinations[destination_key] > 1):
+                state.uncertain.append(entry)
+            elif preflight.exists(entry.source):
+                state.pending.append(entry)
+            elif preflight.exists(entry.destination):
+                state.done.append(entry)
+            else:
+                state.lost.append(entry)
+        state.done.sort(key=lambda entry: entry.index)
+        return state
+
+    def rollback(self, state):
+        """
+        移動済みのエントリを元の場所に戻し、戻せなかった (エントリ, 例外) の一覧を返す
+
+        上書きした保存先の既存ファイルは元に戻らない。連鎖・循環した移動は order_moves で
+        戻す順番を決める。
+        """
+        def restore(back):
+            if os.path.exists(back.destination):
+                raise FileExistsError(f"元の場所に同じ名前のファイルが既に存在します: {back.destination}")
+            move_file(back.current_source, back.destination)
+
+        originals = {}
+        reverse = []
+        for entry in reversed(state.done):
+            if os.path.normcase(entry.source) == os.path.normcase(entry.destination):
+                continue
+            back = PlanEntry(entry.index, entry.destination, entry.source, os.path.basename(entry.source))
+            originals[id(back)] = entry
+            reverse.append(back)
+        failures = []
+        for unit in order_moves(reverse):
+            chain = unit if isinstance(unit, MoveChain) else MoveChain([unit])
+            for result in chain.execute(restore):
+                if result.error is not None:
+                    failures.append((originals[id(result.entry)], result.error))
+        # 一時的な名前へ移したままのファイルを戻す（循環の他のエントリを戻して元の場所が空いてから）
+        for entry in state.pending:
+            if entry.staged_source is None:
+                continue
+            try:
+                if os.path.exists(entry.source):
+                    raise FileExistsError(f"元の場所に同じ名前のファイルが既に存在します: {entry.source}")
+                os.rename(entry.staged_source, entry.source)
+            except OSError as e:
+                failures.append((entry, e))
+        return failures
+
+    def release(self):
+        """ロックを解除する（ログは残るので、次回の起動時にまた確認する）"""
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+
+    def discard(self):
+        if sys.platform == "win32":
+            self.release()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.release()
+
+
+def find_unfinished_batches(directory=None):
+    """
+    file_manager_pending/ に残っている一括処理を古い順に返す
+
+    他のプロセスがロックしているログ（実行中の一括処理）は含めない。
+    返した一括処理はロックしたままなので、discard() か release() を呼ぶこと。
+    """
+    directory = directory or get_pending_dir()
+    batches = []
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return batches
+    for name in names:
+        path = os.path.join(directory, name)
+        if name.endswith(WAL_SUFFIX + ".tmp"):
+            # 計画を書き終える前に落ちた（まだ何も移動していない）。書いている途中なら残す
+            if not is_locked(path):
+                os.remove(path)
+        elif name.endswith(WAL_SUFFIX):
+            try:
+                f = open(path, "r", encoding="utf-8")
+            except FileNotFoundError:
+                # 一覧を取った後に終わった
+                continue
+            if not lock_file(f) or not _still_at(f, path):
+                # 実行中か、ロックを待つ間に終わって削除された
+                f.close()
+                continue
+            try:
+                batch = UnfinishedBatch.load(path, f)
+            except BaseException:
+                f.close()
+                raise
+            if batch is None:
+                f.close()
+                os.remove(path)
+            else:
+                batches.append(batch)
+    return batches
+
+
+class UndoRecord:
+    """元に戻せる一括処理1回分（moves は計画の順の [移動元, 移動先]）"""
+
+    def __init__(self, batch_id, action_name, finished, moves, path=None):
+        self.batch_id = batch_id
+        self.action_name = action_name
+        self.finished = finished
+        self.moves = moves
+        self.path = path
+
+    def as_dict(self):
+        return {"batch": self.batch_id, "action": self.action_name, "finished": self.finished, "moves": self.moves}
+
+    def reverse_entries(self):
+        """
+        逆向きの実行計画（後に移動したものから先に戻す）
+
+        戻し先が別のエントリの移動元になっている連鎖・循環は、実行時に order_moves で順番を決める。
+        """
+        return [PlanEntry(index, destination, source, os.path.basename(source))
+                for index, (source, destination) in enumerate(reversed(self.moves))]
+
+
+class UndoHistory:
+    """file_manager_undo/ に保存した、新しいものから limit 件の UndoRecord"""
+
+    def __init__(self, directory=None, limit=UNDO_HISTORY_LIMIT):
+        self.directory = directory or get_undo_dir()
+        self.limit = limit
+
+    def record(self, report):
+        """成功した移動を保存して UndoRecord を返す（移動がなければ None）"""
+        results = sorted((result for result in report.results if result.status == STATUS_SUCCESS),
+                         key=lambda result: result.entry.index)
+        moves = [[result.entry.source, result.entry.destination] for result in results
+                 if os.path.normcase(result.entry.source) != os.path.normcase(result.entry.destination)]
+        if not moves:
+            return None
+        record = UndoRecord(report.batch_id, report.action_name,
+                            datetime.now().isoformat(timespec="seconds"), moves)
+        self.save(record)
+        return record
+
+    def save(self, record):
+        os.makedirs(self.directory, exist_ok=True)
+        record.path = os.path.join(self.directory, record.batch_id + ".json")
+        write_json_atomic(record.path, record.as_dict())
+        # 古いものから削除して limit 件に保つ
+        for old in self._paths()[:-self.limit or None]:
+            os.remove(old)
+
+    def record_undo(self, record, report):
+        """元に戻す処理の結果を反映する（戻せなかった移動（失敗・キャンセル）だけを履歴に残す）"""
+        retry = {os.path.normcase(result.entry.source) for result in report.results
+                 if result.status in (STATUS_FAILED, STATUS_CANCELLED)}
+        record.moves = [move for move in record.moves if os.path.normcase(move[1]) in retry]
+        if record.moves:
+            self.save(record)
+        else:
+            self.remove(record)
+
+    def record_rollback(self, batch_id, state, failures):
+        """
+        中断した一括処理を recover で元に戻した結果を反映する（UnfinishedBatch.rollback の結果）
+
+        Ctrl+C で止めた一括処理は途中までの移動が履歴にも残るので、元に戻した移動を履歴から除き、
+        undo で同じファイルを二度戻さないようにする。戻せなかった移動は履歴に残す。
+        """
+        try:
+            record = self._load(os.path.join(self.directory, batch_id + ".json"))
+        except FileNotFoundError:
+            return
+        failed = {id(entry) for entry, _ in failures}
+        restored = {os.path.normcase(entry.destination) for entry in state.done if id(entry) not in failed}
+        record.moves = [move for move in record.moves if os.path.normcase(move[1]) not in restored]
+        if record.moves:
+            self.save(record)
+        else:
+            self.remove(record)
+
+    def remove(self, record):
+        try:
+            os.remove(record.path)
+        except FileNotFoundError:
+            pass
+
+    def _paths(self):
+        """保存済みの履歴のパス（batch_id は日時で始まるので名前順で古い順になる）"""
+        try:
+            names = sorted(name for name in os.listdir(self.directory) if name.endswith(".json"))
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, name) for name in names]
+
+    @staticmethod
+    def _load(path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return UndoRecord(data["batch"], data["action"], data["finished"], data["moves"], path)
+
+    def records(self):
+        """新しい順の UndoRecord"""
+        return [self._load(path) for path in reversed(self._paths())]
+
+    def latest(self):
+        paths = self._paths()
+        return self._load(paths[-1]) if paths else None
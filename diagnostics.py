@@ -0,0 +1,231 @@
+"""
+処理時間の計測とプロファイル（診断用、既定では無効）
+
+環境変数 FILEMANAGER_METRICS を設定すると有効になる。値が "1" 以外の場合は
+終了時にその名前のJSONファイルへ書き出す。
+
+    FILEMANAGER_METRICS=metrics.json python file_manager.py
+
+段階（計画・事前確認・同名ファイルの判定・移動・画面更新など）ごとに回数と所要時間を記録し、
+p50 / p95 / p99 とヒストグラムを計算する。移動は保存先のデバイスごとにも集計するので、
+遅いNASと遅い画面更新を区別できる。
+
+環境変数 FILEMANAGER_PROFILE=cpu|mem を設定すると、操作ごとに cProfile / tracemalloc で
+プロファイルを取り、設定ファイルと同じフォルダに日時付きのファイル（.prof / .snapshot）で保存する。
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+from settings_store import get_application_path
+
+METRICS_ENV = "FILEMANAGER_METRICS"
+PROFILE_ENV = "FILEMANAGER_PROFILE"
+
+PROFILE_CPU = "cpu"
+PROFILE_MEM = "mem"
+PROFILE_SUFFIXES = {PROFILE_CPU: ".prof", PROFILE_MEM: ".snapshot"}
+
+# ヒストグラムの区切り（ミリ秒、最後は上限なし）
+HISTOGRAM_BOUNDS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+def percentile(sorted_values, q):
+    """並べ替え済みの値から q パーセンタイル（最近傍順位法）を返す"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples):
+    """所要時間（秒）の一覧から回数・合計・パーセンタイル・ヒストグラムを求める"""
+    values = sorted(samples)
+    histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+    bound_index = 0
+    for value in values:
+        while bound_index < len(HISTOGRAM_BOUNDS_MS) and value * 1000 > HISTOGRAM_BOUNDS_MS[bound_index]:
+            bound_index += 1
+        histogram[bound_index] += 1
+    labels = [f"<={bound}ms" for bound in HISTOGRAM_BOUNDS_MS] + [f">{HISTOGRAM_BOUNDS_MS[-1]}ms"]
+    return {
+        "count": len(values),
+        "total": sum(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1] if values else None,
+        "histogram": dict(zip(labels, histogram)),
+    }
+
+
+class Metrics:
+    """
+    カウンタと段階ごとの所要時間
+
+    ワーカースレッドからも記録するので、記録はロックで保護する。
+    無効のときは timer / record / count は何もしない。
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.time()
+        self.counters = Counter()
+        self.samples = defaultdict(list)
+        self.device_samples = defaultdict(list)
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters.clear()
+            self.samples.clear()
+            self.device_samples.clear()
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += n
+
+    def record(self, phase, seconds, device=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.samples[phase].append(seconds)
+            if device is not None:
+                self.device_samples[(phase, device)].append(seconds)
+
+    @contextmanager
+    def timer(self, phase, device=None):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - started, device)
+
+    def device_of(self, directory):
+        """フォルダのあるデバイス（st_dev）。フォルダごとに一度だけ調べる"""
+        device = self._devices.get(directory)
+        if device is None:
+            try:
+                device = str(os.stat(directory).st_dev)
+            except OSError:
+                device = "unknown"
+            self._devices[directory] = device
+        return device
+
+    def snapshot(self):
+        with self._lock:
+            samples = {phase: list(values) for phase, values in self.samples.items()}
+            device_samples = {key: list(values) for key, values in self.device_samples.items()}
+            counters = dict(self.counters)
+        devices = defaultdict(dict)
+        for (phase, device), values in device_samples.items():
+            devices[phase][device] = summarize(values)
+        return {
+            "started": self.started,
+            "counters": counters,
+            "phases": {phase: summarize(values) for phase, values in samples.items()},
+            "devices": dict(devices),
+        }
+
+    def export_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+
+
+def metrics_export_path():
+    """終了時に書き出すパス（環境変数が "1" の場合や未設定の場合は None）"""
+    value = os.environ.get(METRICS_ENV, "")
+    return value if value not in ("", "0", "1") else None
+
+
+# アプリケーション全体で共有する計測
+METRICS = Metrics(enabled=os.environ.get(METRICS_ENV, "") not in ("", "0"))
+
+
+def profile_mode():
+    """FILEMANAGER_PROFILE の値（cpu / mem）。未設定や不明な値の場合は None"""
+    mode = os.environ.get(PROFILE_ENV, "").strip().lower()
+    return mode if mode in PROFILE_SUFFIXES else None
+
+
+class ProfileSession:
+    """
+    1つの操作のプロファイル
+
+    cpu: 呼び出したスレッドを cProfile で計測する。一括処理のワーカーで実行する処理は
+         wrap() で包むと、スレッドごとに計測して stop() のときにまとめる。
+    mem: tracemalloc で計測し、stop() のときのスナップショットを保存する（全スレッド分）。
+    """
+
+    def __init__(self, name, mode, directory=None):
+        self.name = name
+        self.mode = mode
+        self.directory = directory or get_application_path()
+        self.started = datetime.now()
+        self._profiles = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profile = None
+
+    def start(self):
+        if self.mode == PROFILE_CPU:
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profiles.append(self._profile)
+            self._profile.enable()
+        else:
+            import tracemalloc
+            tracemalloc.start()
+        return self
+
+    def wrap(self, operation):
+        """ワーカースレッドで実行する処理を計測対象にする"""
+        # Python 3.12 以降の cProfile は全スレッドを計測するので包む必要はない
+        if self.mode != PROFILE_CPU or sys.version_info >= (3, 12):
+            return operation
+
+        def profiled_operation(*args, **kwargs):
+            profile = getattr(self._local, "profile", None)
+            if profile is None:
+                import cProfile
+                profile = self._local.profile = cProfile.Profile()
+                with self._lock:
+                    self._profiles.append(profile)
+            profile.enable()
+            try:
+                return operation(*args, **kwargs)
+            finally:
+                profile.disable()
+
+        return profiled_operation
+
+    def output_path(self):
+        timestamp = self.started.strftime("%Y%m%d_%H%M%S_%f")
+        return os.path.join(self.directory, f"profile_{self.name}_{timestamp}{PROFILE_SUFFIXES[self.mode]}")
+
+    def stop(self):
+        """計測を終えてファイルに保存し、そのパスを返す"""
+        path = self.output_path()
+        if self.mode == PROFILE_CPU:
+            import pstats
+            self._profile.disable()
+            with self._lock:
+                profiles = list(self._profiles)
+            pstats.Stats(*profiles).dump_stats(path)
+        else:
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            snapshot.dump(path)
+        return path
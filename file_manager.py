@@ -1,16 +1,200 @@
 import os
+import queue
 import sys
-import tkinterdnd2 as tkdnd
-import shutil
+import time
+
+# 起動時間計測用（--measure-startup）
+STARTUP_STARTED = time.perf_counter()
+
+# コマンドライン実行（python file_manager.py run / recover / undo ...）ではTk関連のモジュールを読み込まない
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] in ("run", "recover", "undo"):
+    from file_manager_cli import main as cli_main
+    sys.exit(cli_main(sys.argv[1:]))
+
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import pyperclip
-from datetime import datetime
-import json
-import re
-from functools import partial
+from functools import partial, wraps
+from itertools import chain, islice
+from batch_engine import (
+    CONFLICT_ASK, CONFLICT_NEWER, CONFLICT_OVERWRITE, CONFLICT_RENAME, CONFLICT_SKIP,
+    STATUS_CANCELLED, STATUS_FAILED, STATUS_MISSING, STATUS_SKIPPED, STATUS_SUCCESS,
+    BatchJob, BatchReport, ConflictResolution, DestinationIndex, DeviceScheduler, FileSelection, FilenameFormatter,
+    PlanEntry, PreflightScan, RenamePlan,
+    execute_entry, find_duplicate_targets, iter_ingest_paths, move_file, order_moves, parse_device_limits,
+    parse_glob_patterns, resolve_conflicts
+)
+from batch_journal import (
+    BatchWriteAheadLog, OperationJournal, UndoHistory, find_unfinished_batches, get_journal_path
+)
+from diagnostics import METRICS, ProfileSession, metrics_export_path, profile_mode
+from settings_store import SettingsPersistence, get_settings_path, load_settings_file
+from template_store import KIND_DESTINATION, KIND_FILENAME, TemplateStore, get_templates_path
+
+# 一括処理で保存先に同名ファイルがある場合の方針（表示名）
+CONFLICT_POLICY_LABELS = {
+    CONFLICT_ASK: "まとめて確認",
+    CONFLICT_SKIP: "スキップ",
+    CONFLICT_OVERWRITE: "上書き",
+    CONFLICT_RENAME: "別名 (_1, _2...)",
+    CONFLICT_NEWER: "新しい方を残す",
+}
+
+# 一覧に表示する処理結果の表示名
+FILE_STATUS_LABELS = {
+    STATUS_SUCCESS: "完了",
+    STATUS_FAILED: "失敗",
+    STATUS_SKIPPED: "スキップ",
+    STATUS_MISSING: "見つからない",
+    STATUS_CANCELLED: "キャンセル",
+}
+
+class VirtualFileList(ttk.Frame):
+    """
+    表示されている行だけを描画するファイル一覧
+
+    Treeviewには表示行数分の行しか作らず、スクロールや更新のたびに
+    row_values(index) から必要な行の値だけを取得して書き換える。
+    選択状態もPython側（インデックスの集合）で管理する。
+    """
+
+    def __init__(self, master, row_values, columns, height=6):
+        super().__init__(master)
+        self.row_values = row_values
+        self.count = 0
+        self.offset = 0
+        self.height = height
+        self.selection = set()
+        self._anchor = None
+
+        self.tree = ttk.Treeview(self, columns=[key for key, _, _ in columns], show="headings",
+                                 height=height, selectmode="none")
+        for key, text, width in columns:
+            self.tree.heading(key, text=text)
+            self.tree.column(key, width=width, stretch=True)
+        self.tree.tag_configure("selected", background="#cce5ff")
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self._on_scroll)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        blank = tuple("" for _ in columns)
+        self._blank = blank
+        self._iids = [self.tree.insert("", tk.END, values=blank) for _ in range(height)]
+
+        self.tree.bind("<Button-1>", self._on_click)
+        self.tree.bind("<Shift-Button-1>", lambda event: self._on_click(event, extend=True))
+        self.tree.bind("<Control-Button-1>", lambda event: self._on_click(event, toggle=True))
+        self.tree.bind("<MouseWheel>", lambda event: self._scroll_units(int(-1 * (event.delta / 120))))
+        self.tree.bind("<Button-4>", lambda event: self._scroll_units(-1))
+        self.tree.bind("<Button-5>", lambda event: self._scroll_units(1))
+
+    def set_count(self, count):
+        """行数を設定して表示を更新する"""
+        self.count = count
+        self.selection = {i for i in self.selection if i < count}
+        self._clamp_offset()
+        self.refresh()
+
+    def refresh(self):
+        """表示されている行だけを書き換える"""
+        for row, iid in enumerate(self._iids):
+            index = self.offset + row
+            if index < self.count:
+                tags = ("selected",) if index in self.selection else ()
+                self.tree.item(iid, values=self.row_values(index), tags=tags)
+            else:
+                self.tree.item(iid, values=self._blank, tags=())
+        self._update_scrollbar()
+
+    def refresh_row(self, index):
+        """index の行が表示中なら、その行だけを書き換える"""
+        row = index - self.offset
+        if 0 <= row < self.height and index < self.count:
+            tags = ("selected",) if index in self.selection else ()
+            self.tree.item(self._iids[row], values=self.row_values(index), tags=tags)
+
+    def curselection(self):
+        return tuple(sorted(self.selection))
+
+    def clear_selection(self):
+        self.selection.clear()
+        self._anchor = None
+        self.refresh()
+
+    def see(self, index):
+        if index < self.offset:
+            self.offset = index
+        elif index >= self.offset + self.height:
+            self.offset = index - self.height + 1
+        self._clamp_offset()
+        self.refresh()
+
+    def _clamp_offset(self):
+        self.offset = max(0, min(self.offset, self.count - self.height))
+
+    def _update_scrollbar(self):
+        if self.count <= self.height:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self.offset / self.count, (self.offset + self.height) / self.count)
+
+    def _on_scroll(self, *args):
+        if args[0] == "moveto":
+            self.offset = int(float(args[1]) * self.count)
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            self.offset += amount * (self.height if args[2] == "pages" else 1)
+        self._clamp_offset()
+        self.refresh()
+
+    def _scroll_units(self, amount):
+        self.offset += amount
+        self._clamp_offset()
+        self.refresh()
+        return "break"
+
+    def _on_click(self, event, extend=False, toggle=False):
+        iid = self.tree.identify_row(event.y)
+        if not iid:
+            return "break"
+        index = self.offset + self._iids.index(iid)
+        if index >= self.count:
+            return "break"
+        if extend and self._anchor is not None:
+            low, high = sorted((self._anchor, index))
+            self.selection = set(range(low, high + 1))
+        elif toggle:
+            self.selection ^= {index}
+            self._anchor = index
+        else:
+            self.selection = {index}
+            self._anchor = index
+        self.refresh()
+        return "break"
+
+def profiled(name):
+    """FILEMANAGER_PROFILE が設定されている場合、操作をプロファイルする"""
+    def decorate(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            return self.run_profiled(name, method, self, *args, **kwargs)
+        return wrapper
+    return decorate
+
 
 class FileManagerApp:
+    # 一括処理の進捗を取り出す間隔(ms)と、1回に使う時間(秒)
+    BATCH_POLL_MS = 100
+    BATCH_POLL_BUDGET = 0.05
+    # まとめて確認ダイアログに表示するファイル名の最大数
+    CONFLICT_REVIEW_LIMIT = 20
+    # 状態表示に進捗を出すデバイスのグループの最大数
+    GROUP_PROGRESS_LIMIT = 4
+    # テンプレート選択欄に一度に表示する名前の数
+    TEMPLATE_PICKER_LIMIT = 50
+    # フォルダ取り込み: 1回の after で使う時間(秒)と、一度に追加する件数
+    INGEST_SLICE_SECONDS = 0.05
+    INGEST_CHUNK_SIZE = 200
+
     def __init__(self, root):
         self.root = root
         self.root.title("ファイル管理ユーティリティ")
@@ -26,7 +210,22 @@ class FileManagerApp:
         self.destination_path = tk.StringVar()
         self.selected_file_path = tk.StringVar()
         self.batch_mode = tk.BooleanVar(value=False)
-        self.selected_files = []
+        self.selected_files = FileSelection()  # 一括処理用のファイル一覧（重複判定はO(1)）
+        self.worker_count = tk.StringVar(value="1")  # 一括処理のデバイスごとの同時実行数
+        self.device_limits = tk.StringVar()  # デバイスごとの上限（「フォルダ=数」を ; で区切る）
+        self.conflict_policy = tk.StringVar(value=CONFLICT_POLICY_LABELS[CONFLICT_ASK])  # 同名ファイルがある場合の方針
+        self.batch_job = None
+        self.batch_context = None
+        self.file_status = {}  # パス -> 直前の一括処理の結果
+        self.batch_names = {}  # パス -> 直前の一括処理で決まったファイル名（衝突を解決した後の名前）
+        self.ingest_state = None  # フォルダ取り込み中の状態
+        self.profile_mode = profile_mode()
+        self.profile_session = None
+        self.ingest_max_depth = tk.StringVar()  # 空欄なら制限なし
+        self.ingest_include = tk.StringVar()
+        self.ingest_exclude = tk.StringVar()
+        self.preview_formatter = None
+        self.last_batch_report = None
         self.simple_mode = tk.BooleanVar(value=True)  # 詳細モードON
         self.component_window = None
 
@@ -37,14 +236,35 @@ class FileManagerApp:
         self.show_component_frame = tk.BooleanVar(value=True)
         self.show_profile_frame = tk.BooleanVar(value=True)
 
-        # 変数変更時にプレビューと設定保存を自動実行
+        # テンプレート（1件ずつSQLiteに保存する）
+        self.template_store = TemplateStore(get_templates_path())
+
+        # 実行した操作の記録（バックグラウンドで追記する）
+        self.journal = OperationJournal(get_journal_path()).start()
+        # 元に戻せる一括処理の履歴（再起動後も残る）
+        self.undo_history = UndoHistory()
+
+        # 設定保存（変更をまとめて遅延保存する）
+        self.settings_persistence = SettingsPersistence(
+            self.collect_settings, self.root.after, self.root.after_cancel,
+            path=get_settings_path(), on_error=self.on_settings_save_error)
+
+        # プレビューはファイル名の材料（連番・桁数・テキスト・日付形式）が変わったときだけ更新する
+        # （パターンの入力欄は挿入・テンプレート読込・F5 で更新する。filename_pattern はプレビューの結果なので含めない）
+        preview_vars = [self.sequence_number, self.sequence_digits, self.custom_text, self.date_format]
+        for var in preview_vars:
+            var.trace_add("write", lambda *args: self.update_filename_preview())
+
+        # 変数変更時に設定を変更済みにする
         vars_to_trace = [
             self.sequence_number, self.sequence_digits, self.auto_increment,
             self.custom_text, self.date_format, self.filename_pattern,
-            self.destination_path, self.selected_file_path, self.batch_mode
+            self.destination_path, self.selected_file_path, self.batch_mode,
+            self.worker_count, self.device_limits, self.conflict_policy,
+            self.ingest_max_depth, self.ingest_include, self.ingest_exclude
         ]
         for var in vars_to_trace:
-            var.trace_add("write", lambda *args: (self.update_filename_preview(), self.save_settings()))
+            var.trace_add("write", lambda *args: self.settings_persistence.mark_dirty())
         
         # モード切替と表示切替ボタン
         mode_frame = ttk.Frame(self.root)
@@ -64,9 +284,62 @@ class FileManagerApp:
         self.notebook.add(self.basic_tab, text="基本操作")
 
 
-        # ファイル名コンポーネントタブ（空）
+        # ファイル名コンポーネントタブとテンプレート管理タブは、最初に選択されたときに中身を作成する
         self.component_tab = ttk.Frame(self.notebook)
-        # ファイル名コンポーネントタブの中身を復活
+        self.notebook.add(self.component_tab, text="ファイル名コンポーネント")
+
+        # 基本操作タブの内容作成
+        self.create_basic_tab()
+
+        self.template_tab = ttk.Frame(self.notebook)
+        self.notebook.add(self.template_tab, text="テンプレート管理")
+        self.template_name_var = tk.StringVar()
+        self.template_choice = tk.StringVar()
+        self.template_combo = None
+        self.dest_template_combo = None  # 詳細設定タブ（現在は表示しない）を作成した場合のみ
+
+        self.deferred_tabs = {
+            str(self.component_tab): self.create_component_tab,
+            str(self.template_tab): self.create_template_tab,
+        }
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+
+        # ステータスバー
+        self.status_var = tk.StringVar()
+        self.status_bar = ttk.Label(self.root, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
+        self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.status_var.set("準備完了")
+        
+        # ショートカットキーの設定
+        self.setup_shortcuts()
+        
+        # 保存されたテンプレートがあれば読み込む
+        self.load_settings()
+        # 前回中断した一括処理があれば、画面が表示されてから確認する
+        self.root.after_idle(self.check_unfinished_batches)
+        
+        # 初期モード設定
+        self.toggle_mode()
+
+        # プレースホルダー用ボタンのカスタムスタイル
+        style = ttk.Style()
+        style.configure("Placeholder.TButton", foreground="blue", font=("Meiryo", 10, "bold"))
+        # ドラッグ＆ドロップ対応（tkinterdnd2 がない場合はドロップなしで起動）
+        tkdnd = load_tkdnd()
+        if tkdnd is not None and hasattr(self.root, "drop_target_register"):
+            self.root.drop_target_register(tkdnd.DND_FILES)
+            self.root.dnd_bind('<<Drop>>', self.on_drop_files)
+
+        # 終了時に未保存の設定を保存
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_tab_changed(self, event):
+        """まだ作成していないタブが選択されたら中身を作成する"""
+        create = self.deferred_tabs.pop(self.notebook.select(), None)
+        if create is not None:
+            create()
+
+    def create_component_tab(self):
         self.components_frame = ttk.LabelFrame(self.component_tab, text="ファイル名コンポーネント")
         self.components_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
@@ -106,30 +379,12 @@ class FileManagerApp:
         self.custom_separator = ttk.Entry(separator_frame, width=5)
         self.custom_separator.pack(side=tk.LEFT, padx=5)
         ttk.Button(separator_frame, text="挿入", command=lambda: self.insert_text(self.custom_separator.get())).pack(side=tk.LEFT, padx=2)
-        self.notebook.add(self.component_tab, text="ファイル名コンポーネント")
-
-
-
-
-
-
-        # 基本操作タブの内容作成
-        self.create_basic_tab()
-
-        # 既存のファイル名コンポーネントフレームをcomponent_tabに移動
-
-        # 既存のプロファイル管理フレームをprofile_tabに移動
-        # 新しいテンプレート管理タブを作成
-        self.template_tab = ttk.Frame(self.notebook)
-        self.notebook.add(self.template_tab, text="テンプレート管理")
 
+    def create_template_tab(self):
         # テンプレート管理フレームをテンプレート管理タブに配置
         self.template_frame = ttk.LabelFrame(self.template_tab, text="テンプレート管理")
         self.template_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
-        self.filename_templates = {}
-        self.template_name_var = tk.StringVar()
-
         template_entry_frame = ttk.Frame(self.template_frame)
         template_entry_frame.pack(fill=tk.X, pady=5)
         ttk.Label(template_entry_frame, text="テンプレート名:").pack(side=tk.LEFT, padx=5)
@@ -138,33 +393,15 @@ class FileManagerApp:
         template_button_frame = ttk.Frame(self.template_frame)
         template_button_frame.pack(fill=tk.X, pady=5)
         ttk.Button(template_button_frame, text="保存 (Ctrl+S)", command=self.save_filename_template).pack(side=tk.LEFT, padx=5)
-        self.template_combo = ttk.Combobox(template_button_frame, width=25)
+        self.template_combo = ttk.Combobox(template_button_frame, textvariable=self.template_choice, width=25,
+                                           postcommand=self.update_filename_templates_combo)
         self.template_combo.pack(side=tk.LEFT, padx=5)
+        # 入力した文字に一致するテンプレートだけを候補に出す
+        self.template_combo.bind("<KeyRelease>", self.on_template_combo_key)
+        self.update_filename_templates_combo()
         ttk.Button(template_button_frame, text="読込 (Ctrl+L)", command=self.load_filename_template).pack(side=tk.LEFT, padx=5)
         ttk.Button(template_button_frame, text="削除", command=self.delete_filename_template).pack(side=tk.LEFT, padx=5)
 
-        # ステータスバー
-        self.status_var = tk.StringVar()
-        self.status_bar = ttk.Label(self.root, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
-        self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
-        self.status_var.set("準備完了")
-        
-        # ショートカットキーの設定
-        self.setup_shortcuts()
-        
-        # 保存されたテンプレートがあれば読み込む
-        self.load_settings()
-        
-        # 初期モード設定
-        self.toggle_mode()
-
-        # プレースホルダー用ボタンのカスタムスタイル
-        style = ttk.Style()
-        style.configure("Placeholder.TButton", foreground="blue", font=("Meiryo", 10, "bold"))
-        # ドラッグ＆ドロップ対応
-        self.root.drop_target_register(tkdnd.DND_FILES)
-        self.root.dnd_bind('<<Drop>>', self.on_drop_files)
-
     def setup_shortcuts(self):
         # コピー: Ctrl+C
         self.root.bind("<Control-c>", lambda event: self.copy_to_clipboard())
@@ -256,16 +493,45 @@ class FileManagerApp:
         self.file_label.pack(pady=10, fill=tk.X)
         ttk.Button(self.single_file_frame, text="ファイル参照... (Ctrl+O)", command=self.browse_file, width=12).pack(pady=5)
         self.batch_file_frame = ttk.Frame(file_frame)
-        self.files_listbox = tk.Listbox(self.batch_file_frame, height=6)
-        scrollbar2 = ttk.Scrollbar(self.batch_file_frame, orient="vertical", command=self.files_listbox.yview)
-        self.files_listbox.configure(yscrollcommand=scrollbar2.set)
-        self.files_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5, pady=5)
-        scrollbar2.pack(side=tk.RIGHT, fill=tk.Y, padx=2, pady=5)
+        self.files_list = VirtualFileList(
+            self.batch_file_frame, self.get_file_row,
+            columns=[("source", "元ファイル", 150), ("planned", "変更後の名前", 150), ("status", "状態", 70)])
+        self.files_list.pack(fill=tk.X, padx=5, pady=5)
         batch_button_frame = ttk.Frame(self.batch_file_frame)
         batch_button_frame.pack(fill=tk.X, padx=5, pady=5)
         ttk.Button(batch_button_frame, text="ファイル追加", command=self.add_files, width=12).pack(side=tk.LEFT, padx=5)
+        ttk.Button(batch_button_frame, text="フォルダ追加", command=self.add_folder, width=12).pack(side=tk.LEFT, padx=5)
         ttk.Button(batch_button_frame, text="選択削除", command=self.remove_selected_file, width=12).pack(side=tk.LEFT, padx=5)
         ttk.Button(batch_button_frame, text="すべて削除", command=self.clear_files, width=12).pack(side=tk.LEFT, padx=5)
+        ingest_frame = ttk.Frame(self.batch_file_frame)
+        ingest_frame.pack(fill=tk.X, padx=5, pady=5)
+        ttk.Label(ingest_frame, text="階層:").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(ingest_frame, textvariable=self.ingest_max_depth, width=3).pack(side=tk.LEFT, padx=2)
+        ttk.Label(ingest_frame, text="対象:").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(ingest_frame, textvariable=self.ingest_include, width=12).pack(side=tk.LEFT, padx=2)
+        ttk.Label(ingest_frame, text="除外:").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(ingest_frame, textvariable=self.ingest_exclude, width=12).pack(side=tk.LEFT, padx=2)
+        job_frame = ttk.Frame(self.batch_file_frame)
+        job_frame.pack(fill=tk.X, padx=5, pady=5)
+        ttk.Label(job_frame, text="デバイスごとの同時実行数:").pack(side=tk.LEFT, padx=5)
+        ttk.Spinbox(job_frame, from_=1, to=16, textvariable=self.worker_count, width=3).pack(side=tk.LEFT, padx=5)
+        self.cancel_button = ttk.Button(job_frame, text="キャンセル", command=self.cancel_batch_job, width=12, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+        self.report_button = ttk.Button(job_frame, text="結果レポート", command=self.show_batch_report, width=12, state=tk.DISABLED)
+        self.report_button.pack(side=tk.LEFT, padx=5)
+        ttk.Button(job_frame, text="元に戻す", command=self.undo_last_batch, width=12).pack(side=tk.LEFT, padx=5)
+        # 計測が有効な場合のみ（環境変数 FILEMANAGER_METRICS）
+        if METRICS.enabled:
+            ttk.Button(job_frame, text="診断", command=self.show_diagnostics, width=12).pack(side=tk.LEFT, padx=5)
+        device_frame = ttk.Frame(self.batch_file_frame)
+        device_frame.pack(fill=tk.X, padx=5, pady=5)
+        ttk.Label(device_frame, text="デバイス別の上限（フォルダ=数; ...）:").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(device_frame, textvariable=self.device_limits, width=40).pack(side=tk.LEFT, padx=5)
+        conflict_frame = ttk.Frame(self.batch_file_frame)
+        conflict_frame.pack(fill=tk.X, padx=5, pady=5)
+        ttk.Label(conflict_frame, text="同名ファイルがある場合:").pack(side=tk.LEFT, padx=5)
+        ttk.Combobox(conflict_frame, textvariable=self.conflict_policy, values=list(CONFLICT_POLICY_LABELS.values()),
+                     state="readonly", width=18).pack(side=tk.LEFT, padx=5)
         # ファイルの送り先
         dest_frame = ttk.LabelFrame(scrollable_frame, text="ファイルの送り先")
         dest_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
@@ -310,7 +576,6 @@ class FileManagerApp:
         # 保存先テンプレート管理
         template_frame = ttk.LabelFrame(advanced_frame, text="保存先テンプレート")
         template_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
-        self.dest_templates = {}
         self.dest_template_name_var = tk.StringVar()
         template_entry_frame = ttk.Frame(template_frame)
         template_entry_frame.pack(fill=tk.X, pady=5)
@@ -321,6 +586,7 @@ class FileManagerApp:
         ttk.Button(template_button_frame, text="保存", command=self.save_destination_template).pack(side=tk.LEFT, padx=5)
         self.dest_template_combo = ttk.Combobox(template_button_frame, width=30)
         self.dest_template_combo.pack(side=tk.LEFT, padx=5, expand=True, fill=tk.X)
+        self.update_destination_templates_combo()
         ttk.Button(template_button_frame, text="読込", command=self.load_destination_template).pack(side=tk.LEFT, padx=5)
         ttk.Button(template_button_frame, text="削除", command=self.delete_destination_template).pack(side=tk.LEFT, padx=5)
 
@@ -350,12 +616,10 @@ class FileManagerApp:
         # 複数ファイル用リストボックス (初期状態では非表示)
         self.batch_file_frame = ttk.Frame(file_frame)
         
-        self.files_listbox = tk.Listbox(self.batch_file_frame, height=6)
-        scrollbar = ttk.Scrollbar(self.batch_file_frame, orient="vertical", command=self.files_listbox.yview)
-        self.files_listbox.configure(yscrollcommand=scrollbar.set)
-        
-        self.files_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5, pady=5)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y, padx=2, pady=5)
+        self.files_list = VirtualFileList(
+            self.batch_file_frame, self.get_file_row,
+            columns=[("source", "元ファイル", 150), ("planned", "変更後の名前", 150), ("status", "状態", 70)])
+        self.files_list.pack(fill=tk.X, padx=5, pady=5)
         
         batch_button_frame = ttk.Frame(self.batch_file_frame)
         batch_button_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -405,26 +669,93 @@ class FileManagerApp:
             self.single_file_frame.pack(fill=tk.X, pady=5)
 
     def add_files(self):
+        if self.is_batch_running():
+            return
         filenames = filedialog.askopenfilenames()
         if filenames:
-            for file in filenames:
-                if file not in self.selected_files:
-                    self.selected_files.append(file)
-                    self.files_listbox.insert(tk.END, os.path.basename(file))
+            self.selected_files.extend(filenames)
+            self.files_list.set_count(len(self.selected_files))
             self.status_var.set(f"{len(filenames)}個のファイルを追加しました")
 
+    def add_folder(self):
+        if self.is_batch_running():
+            return
+        directory = filedialog.askdirectory()
+        if directory:
+            self.ingest_paths([directory])
+
+    @profiled("ingest")
+    def ingest_paths(self, paths):
+        """
+        ファイル・フォルダを一括処理の一覧に取り込む（重複は追加しない）
+        フォルダは中のファイルを再帰的にたどり、root.after で少しずつ追加するのでUIは止まらない
+        """
+        try:
+            max_depth = int(self.ingest_max_depth.get()) if self.ingest_max_depth.get().strip() else None
+        except ValueError:
+            messagebox.showwarning("警告", "階層には数字を入力してください（空欄で制限なし）")
+            return
+        iterator = iter_ingest_paths(paths, max_depth,
+                                     parse_glob_patterns(self.ingest_include.get()),
+                                     parse_glob_patterns(self.ingest_exclude.get()))
+        # 取り込み中に追加でドロップされた場合は後ろにつなげる
+        if self.ingest_state is not None:
+            self.ingest_state["iterator"] = chain(self.ingest_state["iterator"], iterator)
+            return
+        self.ingest_state = {"iterator": iterator, "added": 0, "scanned": 0, "cancelled": False}
+        self.cancel_button.configure(state=tk.NORMAL)
+        self.status_var.set("ファイルを取り込み中...")
+        self.root.after(0, self.ingest_next_chunk)
+
+    def ingest_next_chunk(self):
+        state = self.ingest_state
+        if state is None:
+            return
+        deadline = time.perf_counter() + self.INGEST_SLICE_SECONDS
+        exhausted = False
+        while not state["cancelled"] and time.perf_counter() < deadline:
+            chunk = list(islice(state["iterator"], self.INGEST_CHUNK_SIZE))
+            if not chunk:
+                exhausted = True
+                break
+            state["scanned"] += len(chunk)
+            state["added"] += self.selected_files.extend(chunk)
+        self.files_list.set_count(len(self.selected_files))
+
+        if exhausted or state["cancelled"]:
+            self.ingest_state = None
+            self.cancel_button.configure(state=tk.DISABLED)
+            self.stop_profile()
+            message = f"{state['added']}個のファイルを追加しました（重複 {state['scanned'] - state['added']}個）"
+            if state["cancelled"]:
+                message += "（キャンセル）"
+            self.status_var.set(message)
+            return
+
+        self.status_var.set(f"ファイルを取り込み中... {state['added']}個追加")
+        self.root.after(1, self.ingest_next_chunk)
+
     def remove_selected_file(self):
-        selected_indices = self.files_listbox.curselection()
+        if self.is_batch_running():
+            return
+        selected_indices = self.files_list.curselection()
         if selected_indices:
-            # 選択項目を逆順で削除（インデックスが変わるのを防ぐため）
-            for index in sorted(selected_indices, reverse=True):
-                del self.selected_files[index]
-                self.files_listbox.delete(index)
+            for index in selected_indices:
+                self.file_status.pop(self.selected_files[index], None)
+                self.batch_names.pop(self.selected_files[index], None)
+            self.selected_files.remove_indices(selected_indices)
+            self.files_list.selection.clear()
+            self.files_list.set_count(len(self.selected_files))
             self.status_var.set("選択したファイルを削除しました")
 
     def clear_files(self):
+        if self.is_batch_running():
+            return
         self.selected_files.clear()
-        self.files_listbox.delete(0, tk.END)
+        self.file_status.clear()
+        self.batch_names.clear()
+        self.files_list.selection.clear()
+        self.files_list.set_count(0)
         self.status_var.set("すべてのファイルをリストから削除しました")
 
     def insert_text(self, text):
@@ -437,32 +768,51 @@ class FileManagerApp:
         self.update_filename_preview()
 
     def update_filename_preview(self):
+        # 設定を変えたら、直前の一括処理の結果ではなく新しいプレビューを表示する
+        self.batch_names = {}
         pattern = self.pattern_entry.get()
         if not pattern:
             self.filename_pattern.set("")
+            self.preview_formatter = None
+            if self.selected_files:
+                self.files_list.refresh()
             return
         
-        # プレースホルダーを実際の値に置き換え
-        filename = pattern
-        if "{date}" in pattern:
-            current_date = datetime.now().strftime(self.date_format.get())
-            filename = filename.replace("{date}", current_date)
-        
-        if "{seq}" in pattern:
-            # 連番の桁数に合わせてゼロ埋め
-            digits = int(self.sequence_digits.get())
-            if digits <= 1:
-                # 桁数が1以下の場合はゼロ埋めしない
-                seq_num = str(int(self.sequence_number.get()))
-            else:
-                seq_num = self.sequence_number.get().zfill(digits)
-            filename = filename.replace("{seq}", seq_num)
-        
-        if "{text}" in pattern:
-            custom = self.custom_text.get()
-            filename = filename.replace("{text}", custom)
-        
-        self.filename_pattern.set(filename)
+        # プレースホルダーを実際の値に置き換え（一括処理と同じフォーマッタを使用）
+        formatter = FilenameFormatter(pattern, self.date_format.get(), self.sequence_digits.get(), self.custom_text.get())
+        self.filename_pattern.set(formatter.format(self.sequence_number.get()))
+
+        # 一括処理の一覧の「変更後の名前」も表示中の行だけ更新
+        self.preview_formatter = formatter
+        if self.selected_files:
+            self.files_list.refresh()
+
+    def get_file_row(self, index):
+        """
+        一括処理の一覧の1行分（元ファイル、変更後の名前、状態）
+
+        変更後の名前は、直前の一括処理の対象なら衝突を解決した後の名前、それ以外は RenamePlan と同じ規則の
+        プレビュー（パターンが空なら元の名前のまま、連番は開始番号 + 位置で、パターンに連番がある場合だけ解釈する）。
+        """
+        path = self.selected_files[index]
+        planned = self.batch_names.get(path)
+        if planned is None:
+            planned = self.preview_file_name(path, index)
+        status = FILE_STATUS_LABELS.get(self.file_status.get(path), "")
+        return (os.path.basename(path), planned, status)
+
+    def preview_file_name(self, path, index):
+        formatter = self.preview_formatter
+        if formatter is None:
+            return os.path.basename(path)
+        seq = None
+        if formatter.has_seq:
+            try:
+                seq = int(self.sequence_number.get()) + index
+            except ValueError:
+                # 一括処理でもエラーになるので表示しない
+                return ""
+        return formatter.format(seq) + os.path.splitext(path)[1]
 
     def insert_placeholder(self, placeholder):
         current_pos = self.pattern_entry.index(tk.INSERT)
@@ -476,7 +826,13 @@ class FileManagerApp:
     def copy_to_clipboard(self):
         current_name = self.filename_pattern.get()
         if current_name:
-            pyperclip.copy(current_name)
+            try:
+                import pyperclip
+                pyperclip.copy(current_name)
+            except ImportError:
+                # pyperclip がない場合はTkのクリップボードを使う
+                self.root.clipboard_clear()
+                self.root.clipboard_append(current_name)
             self.status_var.set(f"クリップボードにコピーしました: {current_name}")
             
             # 自動増加が有効の場合、連番を増加
@@ -501,35 +857,43 @@ class FileManagerApp:
             messagebox.showwarning("警告", "保存するパターンがありません")
             return
         
-        self.filename_templates[template_name] = {
-            "pattern": pattern,
-            "date_format": self.date_format.get(),
-            "custom_text": self.custom_text.get(),
-            "sequence_digits": self.sequence_digits.get(),  # 連番桁数も保存
-            "destination_path": self.destination_path.get()  # 保存先も保存
-        }
-        
-        self.update_filename_templates_combo()
-        self.save_settings()
+        try:
+            self.template_store.put(KIND_FILENAME, template_name, {
+                "pattern": pattern,
+                "date_format": self.date_format.get(),
+                "custom_text": self.custom_text.get(),
+                "sequence_digits": self.sequence_digits.get(),  # 連番桁数も保存
+                "destination_path": self.destination_path.get()  # 保存先も保存
+            })
+        except Exception as e:
+            messagebox.showerror("エラー", f"テンプレート保存中にエラーが発生しました: {str(e)}")
+            return
+
+        self.template_choice.set(template_name)
         self.status_var.set(f"ファイル名テンプレートを保存しました: {template_name}")
 
     def update_filename_templates_combo(self):
-        template_names = list(self.filename_templates.keys())
-        self.template_combo['values'] = template_names
-        if template_names:
-            self.template_combo.current(0)
+        """選択欄の候補を、入力中の文字に一致するテンプレート名に絞り込む"""
+        if self.template_combo is not None:
+            self.template_combo['values'] = self.template_store.matching(
+                KIND_FILENAME, self.template_choice.get(), self.TEMPLATE_PICKER_LIMIT)
+
+    def on_template_combo_key(self, event):
+        if event.keysym in ("Up", "Down", "Return", "Escape", "Tab"):
+            return
+        self.update_filename_templates_combo()
 
     def load_filename_template(self):
-        template_name = self.template_combo.get()
-        if not template_name or template_name not in self.filename_templates:
+        template_name = self.template_choice.get()
+        template = self.template_store.get(KIND_FILENAME, template_name) if template_name else None
+        if template is None:
             messagebox.showwarning("警告", "テンプレートが選択されていないか存在しません")
             return
         
-        template = self.filename_templates[template_name]
         self.pattern_entry.delete(0, tk.END)
         self.pattern_entry.insert(0, template["pattern"])
-        self.date_format.set(template["date_format"])
-        self.custom_text.set(template["custom_text"])
+        self.date_format.set(template.get("date_format", ""))
+        self.custom_text.set(template.get("custom_text", ""))
         
         # 連番桁数があれば設定
         if "sequence_digits" in template:
@@ -543,14 +907,18 @@ class FileManagerApp:
         self.status_var.set(f"ファイル名テンプレートを読み込みました: {template_name}")
 
     def delete_filename_template(self):
-        template_name = self.template_combo.get()
-        if not template_name or template_name not in self.filename_templates:
+        template_name = self.template_choice.get()
+        try:
+            deleted = bool(template_name) and self.template_store.delete(KIND_FILENAME, template_name)
+        except Exception as e:
+            messagebox.showerror("エラー", f"テンプレート削除中にエラーが発生しました: {str(e)}")
+            return
+        if not deleted:
             messagebox.showwarning("警告", "テンプレートが選択されていないか存在しません")
             return
-        
-        del self.filename_templates[template_name]
+
+        self.template_choice.set("")
         self.update_filename_templates_combo()
-        self.save_settings()
         self.status_var.set(f"ファイル名テンプレートを削除しました: {template_name}")
 
     def browse_destination(self):
@@ -570,26 +938,43 @@ class FileManagerApp:
             messagebox.showwarning("警告", "保存する保存先がありません")
             return
         
-        self.dest_templates[template_name] = destination
-        
+        try:
+            self.template_store.put(KIND_DESTINATION, template_name, destination)
+        except Exception as e:
+            messagebox.showerror("エラー", f"テンプレート保存中にエラーが発生しました: {str(e)}")
+            return
+
         self.update_destination_templates_combo()
-        self.save_settings()
         self.status_var.set(f"保存先テンプレートを保存しました: {template_name}")
 
     def update_destination_templates_combo(self):
-        # 詳細設定タブ削除に伴い空関数化
-        pass
+        if self.dest_template_combo is not None:
+            self.dest_template_combo['values'] = self.template_store.names(KIND_DESTINATION,
+                                                                            self.TEMPLATE_PICKER_LIMIT)
 
     def load_destination_template(self):
-        # 詳細設定タブ削除に伴い空関数化
-        pass
+        template_name = self.dest_template_combo.get() if self.dest_template_combo is not None else ""
+        destination = self.template_store.get(KIND_DESTINATION, template_name) if template_name else None
+        if destination is None:
+            messagebox.showwarning("警告", "テンプレートが選択されていないか存在しません")
+            return
+
+        self.destination_path.set(destination)
+        self.status_var.set(f"保存先テンプレートを読み込みました: {template_name}")
 
     def delete_destination_template(self):
-        # 詳細設定タブ削除に伴い空関数化
-        pass
-        del self.dest_templates[template_name]
+        template_name = self.dest_template_combo.get() if self.dest_template_combo is not None else ""
+        try:
+            deleted = bool(template_name) and self.template_store.delete(KIND_DESTINATION, template_name)
+        except Exception as e:
+            messagebox.showerror("エラー", f"テンプレート削除中にエラーが発生しました: {str(e)}")
+            return
+        if not deleted:
+            messagebox.showwarning("警告", "テンプレートが選択されていないか存在しません")
+            return
+
+        self.dest_template_combo.set("")
         self.update_destination_templates_combo()
-        self.save_settings()
         self.status_var.set(f"保存先テンプレートを削除しました: {template_name}")
 
     def browse_file(self):
@@ -617,6 +1002,7 @@ class FileManagerApp:
         
         return new_filename
 
+    @profiled("rename_file")
     def rename_file(self):
         if self.batch_mode.get():
             self.batch_rename_files()
@@ -656,7 +1042,7 @@ class FileManagerApp:
                 return
         
         try:
-            shutil.move(source_path, destination_path)
+            move_file(source_path, destination_path)
             self.selected_file_path.set(destination_path)
             self.status_var.set(f"ファイル名を変更しました: {new_filename}")
             
@@ -675,7 +1061,38 @@ class FileManagerApp:
         except Exception as e:
             messagebox.showerror("エラー", f"ファイル名変更中にエラーが発生しました: {str(e)}")
 
+    def create_rename_plan(self, dest_dir=None, rename=True):
+        """
+        現在の設定から一括処理の実行計画を作成する（Tk変数は最初に一度だけ読む）
+
+        連番・桁数が数字でない場合はエラーを表示して None を返す（移動のみの場合は確認しない）。
+        """
+        try:
+            with METRICS.timer("plan"):
+                return RenamePlan(
+                    self.selected_files,
+                    pattern=self.pattern_entry.get(),
+                    date_format=self.date_format.get(),
+                    sequence_digits=self.sequence_digits.get(),
+                    custom_text=self.custom_text.get(),
+                    start_seq=self.sequence_number.get(),
+                    dest_dir=dest_dir,
+                    rename=rename,
+                )
+        except ValueError:
+            messagebox.showerror("エラー", "連番と桁数には数字を入力してください")
+            return None
+
+    def create_preflight_scan(self):
+        with METRICS.timer("preflight"):
+            preflight = PreflightScan(self.selected_files)
+        METRICS.count("scandir", preflight.scandir_count)
+        return preflight
+
     def batch_rename_files(self):
+        if self.is_batch_running():
+            return
+
         if not self.selected_files:
             messagebox.showwarning("警告", "ファイルが選択されていません")
             return
@@ -684,75 +1101,22 @@ class FileManagerApp:
             messagebox.showwarning("警告", "ファイル名パターンが指定されていません")
             return
         
-        # 現在の連番を保存
-        start_seq = int(self.sequence_number.get())
-        success_count = 0
-        
-        # 処理前にファイルの存在を確認
-        non_existent_files = []
-        for source_path in self.selected_files:
-            if not os.path.exists(source_path):
-                non_existent_files.append(source_path)
-        
-        if non_existent_files:
-            missing_files = "\n".join([os.path.basename(f) for f in non_existent_files])
-            result = messagebox.askyesno("警告", f"以下のファイルが見つかりません。これらをスキップして続行しますか？\n\n{missing_files}")
-            if not result:
-                return
-        
-        # 処理を開始
-        for i, source_path in enumerate(self.selected_files):
-            # ファイルが存在しない場合はスキップ
-            if not os.path.exists(source_path):
-                continue
-                
-            # 連番を設定
-            current_seq = start_seq + i
-            self.sequence_number.set(str(current_seq))
-            self.update_filename_preview()
-            
-            # 名前変更処理
-            source_dir = os.path.dirname(source_path)
-            _, file_extension = os.path.splitext(source_path)
-            
-            new_filename = self.filename_pattern.get() + file_extension
-            destination_path = os.path.join(source_dir, new_filename)
-            
-            # 絶対パスに変換して正規化
-            source_path = os.path.abspath(os.path.normpath(source_path))
-            destination_path = os.path.abspath(os.path.normpath(destination_path))
-            
-            # 既に同名のファイルが存在するかチェック（自分自身以外）
-            if os.path.exists(destination_path) and source_path != destination_path:
-                result = messagebox.askyesno("確認", f"既に同じ名前のファイルが存在します: {new_filename}\n上書きしますか？")
-                if not result:
-                    continue
-            
-            try:
-                shutil.move(source_path, destination_path)
-                # リストとリストボックスの更新
-                self.selected_files[i] = destination_path
-                self.files_listbox.delete(i)
-                self.files_listbox.insert(i, os.path.basename(destination_path))
-                success_count += 1
-            except PermissionError:
-                messagebox.showerror("エラー", f"ファイル '{os.path.basename(source_path)}' へのアクセス権限がありません。")
-            except FileNotFoundError:
-                messagebox.showerror("エラー", f"ファイルが見つかりません: {os.path.basename(source_path)}")
-            except Exception as e:
-                messagebox.showerror("エラー", f"ファイル '{os.path.basename(source_path)}' の名前変更中にエラーが発生しました: {str(e)}")
-        
-        # 最終連番 + 1 を設定
-        if self.auto_increment.get():
-            self.sequence_number.set(str(start_seq + len(self.selected_files)))
-            self.update_filename_preview()
-        else:
-            # 元の連番に戻す
-            self.sequence_number.set(str(start_seq))
-            self.update_filename_preview()
+        # 処理前にファイルの存在を確認（親フォルダごとに1回だけ一覧を取得）
+        preflight = self.create_preflight_scan()
+        if not self.confirm_missing_files(preflight):
+            return
         
-        self.status_var.set(f"{len(self.selected_files)}個中{success_count}個のファイル名を変更しました")
+        # 実行計画を一度に作成
+        plan = self.create_rename_plan()
+        if plan is None:
+            return
+        resolution = self.confirm_overwrites(plan, preflight)
+        if resolution is None:
+            return
 
+        self.start_batch_job(plan, resolution, "名前変更", "ファイル名を変更しました")
+
+    @profiled("move_file")
     def move_file(self):
         if self.batch_mode.get():
             self.batch_move_files()
@@ -798,7 +1162,7 @@ class FileManagerApp:
                 return
         
         try:
-            shutil.move(source_path, destination_path)
+            move_file(source_path, destination_path)
             self.selected_file_path.set(destination_path)
             self.status_var.set(f"ファイルを移動しました: {destination_path}")
         except PermissionError:
@@ -809,6 +1173,9 @@ class FileManagerApp:
             messagebox.showerror("エラー", f"ファイル移動中にエラーが発生しました: {str(e)}")
 
     def batch_move_files(self):
+        if self.is_batch_running():
+            return
+
         if not self.selected_files:
             messagebox.showwarning("警告", "ファイルが選択されていません")
             return
@@ -819,73 +1186,24 @@ class FileManagerApp:
         
         # 保存先ディレクトリの存在確認
         dest_dir = self.destination_path.get()
-        if not os.path.exists(dest_dir):
-            try:
-                os.makedirs(dest_dir)
-            except Exception as e:
-                messagebox.showerror("エラー", f"保存先ディレクトリを作成できません: {dest_dir}\n{str(e)}")
-                return
-                
-        # 処理前にファイルの存在を確認
-        non_existent_files = []
-        for source_path in self.selected_files:
-            if not os.path.exists(source_path):
-                non_existent_files.append(source_path)
-        
-        if non_existent_files:
-            missing_files = "\n".join([os.path.basename(f) for f in non_existent_files])
-            result = messagebox.askyesno("警告", f"以下のファイルが見つかりません。これらをスキップして続行しますか？\n\n{missing_files}")
-            if not result:
-                return
-                
-        success_count = 0
-        new_files = []
-        
-        for i, source_path in enumerate(self.selected_files):
-            # ファイルが存在しない場合はスキップ
-            if not os.path.exists(source_path):
-                new_files.append(source_path)  # 元のパスを保持
-                continue
+        if not self.ensure_destination_dir(dest_dir):
+            return
                 
-            filename = os.path.basename(source_path)
-            destination_path = os.path.join(dest_dir, filename)
-            
-            # 絶対パスに変換して正規化
-            source_path = os.path.abspath(os.path.normpath(source_path))
-            destination_path = os.path.abspath(os.path.normpath(destination_path))
-            
-            # 既に同名のファイルが存在するかチェック
-            if os.path.exists(destination_path) and source_path != destination_path:
-                result = messagebox.askyesno("確認", f"保存先に同じ名前のファイルが既に存在します: {filename}\n上書きしますか？")
-                if not result:
-                    new_files.append(source_path)  # 元のパスを保持
-                    continue
-            
-            try:
-                shutil.move(source_path, destination_path)
-                # 成功したら新しいパスをリストに追加
-                new_files.append(destination_path)
-                success_count += 1
-            except PermissionError:
-                messagebox.showerror("エラー", f"ファイル '{filename}' へのアクセス権限がありません。")
-                new_files.append(source_path)  # 元のパスを保持
-            except FileNotFoundError:
-                messagebox.showerror("エラー", f"ファイルが見つかりません: {filename}")
-                new_files.append(source_path)  # 元のパスを保持
-            except Exception as e:
-                messagebox.showerror("エラー", f"ファイル '{filename}' の移動中にエラーが発生しました: {str(e)}")
-                new_files.append(source_path)  # 元のパスを保持
-        
-        # 成功したファイルをリストに更新
-        self.selected_files = new_files
-        
-        # リストボックスを更新
-        self.files_listbox.delete(0, tk.END)
-        for file in self.selected_files:
-            self.files_listbox.insert(tk.END, os.path.basename(file))
-        
-        self.status_var.set(f"{len(self.selected_files)}個中{success_count}個のファイルを移動しました")
+        # 処理前にファイルの存在を確認（親フォルダごとに1回だけ一覧を取得）
+        preflight = self.create_preflight_scan()
+        if not self.confirm_missing_files(preflight):
+            return
+
+        plan = self.create_rename_plan(dest_dir=dest_dir, rename=False)
+        if plan is None:
+            return
+        resolution = self.confirm_overwrites(plan, preflight)
+        if resolution is None:
+            return
+
+        self.start_batch_job(plan, resolution, "移動", "ファイルを移動しました")
 
+    @profiled("rename_and_move_file")
     def rename_and_move_file(self):
         if self.batch_mode.get():
             self.batch_rename_and_move_files()
@@ -937,7 +1255,7 @@ class FileManagerApp:
                 return
         
         try:
-            shutil.move(source_path, destination_path)
+            move_file(source_path, destination_path)
             self.selected_file_path.set(destination_path)
             self.status_var.set(f"ファイル名を変更し移動しました: {destination_path}")
             
@@ -957,6 +1275,9 @@ class FileManagerApp:
             messagebox.showerror("エラー", f"ファイル名変更と移動中にエラーが発生しました: {str(e)}")
 
     def batch_rename_and_move_files(self):
+        if self.is_batch_running():
+            return
+
         if not self.selected_files:
             messagebox.showwarning("警告", "ファイルが選択されていません")
             return
@@ -971,181 +1292,658 @@ class FileManagerApp:
             
         # 保存先ディレクトリの存在確認
         dest_dir = self.destination_path.get()
+        if not self.ensure_destination_dir(dest_dir):
+            return
+        
+        # 処理前にファイルの存在を確認（親フォルダごとに1回だけ一覧を取得）
+        preflight = self.create_preflight_scan()
+        if not self.confirm_missing_files(preflight):
+            return
+                
+        # 実行計画を一度に作成
+        plan = self.create_rename_plan(dest_dir=dest_dir)
+        if plan is None:
+            return
+
+        # 保存先ファイル名の重複をチェック（計画は1回だけ作成し、実行時もそのまま使う）
+        with METRICS.timer("conflicts"):
+            entries = [entry for entry in plan if preflight.exists(entry.source)]
+            duplicate_files, existing = find_duplicate_targets(entries, preflight)
+        if duplicate_files and self.get_conflict_policy() != CONFLICT_RENAME:
+            names = duplicate_files[:self.CONFLICT_REVIEW_LIMIT]
+            if len(duplicate_files) > self.CONFLICT_REVIEW_LIMIT:
+                names.append(f"...他{len(duplicate_files) - self.CONFLICT_REVIEW_LIMIT}個")
+            message = (f"生成されるファイル名に重複があります。重複分は「同名ファイルがある場合」の設定"
+                       f"（{self.conflict_policy.get()}）に従って処理されます。\n\n重複ファイル: {', '.join(names)}")
+            if existing:
+                message += f"\n保存先の既存ファイルと同じ名前: {len(existing)}個"
+            result = messagebox.askyesno("警告", message + "\n\n続行しますか？")
+            if not result:
+                return
+        
+        resolution = self.confirm_overwrites(plan, preflight)
+        if resolution is None:
+            return
+
+        self.start_batch_job(plan, resolution, "名前変更と移動", "ファイル名を変更し移動しました")
+
+    def ensure_destination_dir(self, dest_dir):
+        """保存先ディレクトリがなければ作成する。作成できない場合は False"""
         if not os.path.exists(dest_dir):
             try:
                 os.makedirs(dest_dir)
             except Exception as e:
                 messagebox.showerror("エラー", f"保存先ディレクトリを作成できません: {dest_dir}\n{str(e)}")
-                return
-        
-        # 処理前にファイルの存在を確認
-        non_existent_files = []
-        for source_path in self.selected_files:
-            if not os.path.exists(source_path):
-                non_existent_files.append(source_path)
+                return False
+        return True
+
+    def confirm_missing_files(self, preflight):
+        """見つからないファイルがあれば、スキップして続行するか確認する"""
+        non_existent_files = preflight.missing(self.selected_files)
         
         if non_existent_files:
             missing_files = "\n".join([os.path.basename(f) for f in non_existent_files])
             result = messagebox.askyesno("警告", f"以下のファイルが見つかりません。これらをスキップして続行しますか？\n\n{missing_files}")
             if not result:
-                return
-                
-        # 現在の連番を保存
-        start_seq = int(self.sequence_number.get())
-        success_count = 0
-        new_files = []
-        
-        # 保存先ファイル名の重複をチェック
-        file_names_to_create = []
-        for i, source_path in enumerate(self.selected_files):
-            if not os.path.exists(source_path):
-                continue
-                
-            # 連番を設定
-            current_seq = start_seq + i
-            self.sequence_number.set(str(current_seq))
-            self.update_filename_preview()
-            
-            # ファイル名生成
-            _, file_extension = os.path.splitext(source_path)
-            new_filename = self.filename_pattern.get() + file_extension
-            file_names_to_create.append(new_filename)
-        
-        # 重複ファイル名の検出
-        duplicate_files = [item for item, count in 
-                          {file_name: file_names_to_create.count(file_name) 
-                           for file_name in file_names_to_create}.items() 
-                          if count > 1]
-        if duplicate_files:
-            result = messagebox.askyesno("警告", 
-                    f"生成されるファイル名に重複があります。このままでは一部のファイルが上書きされます。\n\n重複ファイル: {', '.join(duplicate_files)}\n\n続行しますか？")
-            if not result:
-                return
-        
-        # 本処理開始
-        for i, source_path in enumerate(self.selected_files):
-            # ファイルが存在しない場合はスキップ
-            if not os.path.exists(source_path):
-                new_files.append(source_path)  # 元のパスを保持
-                continue
-                
-            # 連番を設定
-            current_seq = start_seq + i
-            self.sequence_number.set(str(current_seq))
-            self.update_filename_preview()
-            
-            # 名前変更と移動処理
-            _, file_extension = os.path.splitext(source_path)
-            
-            new_filename = self.filename_pattern.get() + file_extension
-            destination_path = os.path.join(dest_dir, new_filename)
-            
-            # 絶対パスに変換して正規化
-            source_path = os.path.abspath(os.path.normpath(source_path))
-            destination_path = os.path.abspath(os.path.normpath(destination_path))
-            
-            # 既に同名のファイルが存在するかチェック（自分自身以外）
-            if os.path.exists(destination_path) and source_path != destination_path:
-                result = messagebox.askyesno("確認", f"既に同じ名前のファイルが存在します: {new_filename}\n上書きしますか？")
-                if not result:
-                    new_files.append(source_path)  # 元のパスを保持
+                return False
+        return True
+
+    def get_conflict_policy(self):
+        label = self.conflict_policy.get()
+        for policy, policy_label in CONFLICT_POLICY_LABELS.items():
+            if policy_label == label:
+                return policy
+        return CONFLICT_ASK
+
+    def confirm_overwrites(self, plan, preflight):
+        """
+        実行前に同名ファイルの扱いを方針に従って決め、解決結果（ConflictResolution）を返す
+        方針で決まらなかったものは1つのダイアログでまとめて確認する。中止した場合は None
+        """
+        with METRICS.timer("conflicts"):
+            resolution = resolve_conflicts(plan.entries, self.get_conflict_policy(), DestinationIndex(preflight))
+
+        if resolution.unresolved:
+            names = [entry.filename for entry in resolution.unresolved[:self.CONFLICT_REVIEW_LIMIT]]
+            if len(resolution.unresolved) > self.CONFLICT_REVIEW_LIMIT:
+                names.append(f"...他{len(resolution.unresolved) - self.CONFLICT_REVIEW_LIMIT}個")
+            result = messagebox.askyesnocancel(
+                "確認",
+                f"{len(resolution.unresolved)}個のファイルが既に同じ名前で存在します。\n\n"
+                + "\n".join(names)
+                + "\n\nはい: すべて上書き / いいえ: すべてスキップ / キャンセル: 中止")
+            if result is None:
+                return None
+            if result:
+                resolution.approve_unresolved()
+            else:
+                resolution.skip_unresolved()
+
+        return resolution
+
+    def is_batch_running(self):
+        if self.batch_job is not None and self.batch_job.is_running:
+            self.status_var.set("一括処理を実行中です。完了するかキャンセルしてください")
+            return True
+        if self.ingest_state is not None:
+            self.status_var.set("ファイルを取り込み中です。完了するかキャンセルしてください")
+            return True
+        return False
+
+    def get_worker_count(self):
+        try:
+            return max(1, int(self.worker_count.get()))
+        except ValueError:
+            return 1
+
+    def start_batch_job(self, plan, resolution, action_name, done_message, undo_record=None):
+        """
+        実行計画をバックグラウンドで実行し、進捗を root.after で受け取る
+        実行前に計画を先行書き込みログに保存する。保存できない場合は実行せずに False を返す
+        undo_record: 元に戻す処理の場合、その履歴（終了時に履歴から取り除く）
+        """
+        report = BatchReport(action_name)
+        report.add_entries(resolution.missing, STATUS_MISSING)
+        report.add_entries(resolution.skipped, STATUS_SKIPPED)
+        entries = resolution.entries
+        try:
+            folder_limits = parse_device_limits(self.device_limits.get())
+        except ValueError as e:
+            messagebox.showerror("エラー", str(e))
+            return False
+        # 連鎖・循環する名前の付け替え（番号の振り直しなど）は順番に実行する
+        units = order_moves(entries, resolution.index)
+        # 移動元・移動先のデバイスの組み合わせごとに並列に実行する
+        scheduler = DeviceScheduler.for_index(resolution.index, self.get_worker_count(), folder_limits)
+        try:
+            wal = BatchWriteAheadLog.create(report, entries)
+        except OSError as e:
+            messagebox.showerror("エラー", f"一括処理の記録を保存できないため実行を中止しました: {str(e)}")
+            return False
+        self.batch_context = {
+            "plan": plan,
+            "report": report,
+            "wal": wal,
+            "undo_record": undo_record,
+            "done_message": done_message,
+            "processed": 0,
+            "entries": {entry.index: entry for entry in entries},  # 一覧の位置 -> エントリ
+        }
+        # 移動が終わるたびにワーカーから完了を記録する
+        operation = wal.wrap(partial(execute_entry, index=resolution.index))
+        if self.profile_session is not None:
+            operation = self.profile_session.wrap(operation)
+        self.batch_job = BatchJob(units, operation, scheduler=scheduler)
+        # 一覧の「変更後の名前」には、衝突を解決した後の名前（スキップ・見つからないファイルは元の名前）を表示する
+        self.batch_names = {}
+        for entry in resolution.skipped + resolution.missing:
+            path = self.selected_files[entry.index]
+            self.batch_names[path] = os.path.basename(path)
+        for entry in entries:
+            self.batch_names[self.selected_files[entry.index]] = entry.filename
+        self.files_list.refresh()
+        self.cancel_button.configure(state=tk.NORMAL)
+        self.status_var.set(f"{action_name}を実行中... 0/{len(entries)}")
+        self.batch_job.start()
+        self.root.after(self.BATCH_POLL_MS, self.poll_batch_job)
+        return True
+
+    def check_unfinished_batches(self):
+        """前回中断した一括処理があれば、再開するか元に戻すかを確認する"""
+        try:
+            batches = find_unfinished_batches()
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("エラー", f"中断した一括処理の記録を読み込めません: {str(e)}")
+            return
+        try:
+            for batch in batches:
+                state = batch.inspect()
+                result = messagebox.askyesnocancel(
+                    "中断した一括処理",
+                    f"前回の{batch.action_name}（{batch.created}）が完了していません。\n\n"
+                    f"完了: {len(state.done)}個 / 未処理: {len(state.pending)}個 / 見つからない: {len(state.lost)}個"
+                    + (f" / 要確認: {len(state.uncertain)}個" if state.uncertain else "")
+                    + "\n\nはい: 続きを実行 / いいえ: 元に戻す / キャンセル: 次回の起動時に確認")
+                if result is None:
                     continue
-            
+                self.show_uncertain_entries(state)
+                if result:
+                    # 同時に実行できる一括処理は1つなので、残りは次回の起動時に確認する
+                    self.resume_unfinished_batch(batch, state)
+                    return
+                self.rollback_unfinished_batch(batch, state)
+        finally:
+            # 確認しなかったログのロックを解除する（次回の起動時にまた確認する）
+            for batch in batches:
+                batch.release()
+
+    def replace_selection(self, paths):
+        """一括処理の一覧を paths で置き換えて一括処理モードにする"""
+        self.selected_files = FileSelection(paths)
+        self.file_status.clear()
+        self.batch_names.clear()
+        self.files_list.clear_selection()
+        self.files_list.set_count(len(self.selected_files))
+        self.batch_mode.set(True)
+        self.toggle_batch_mode()
+
+    def resume_unfinished_batch(self, batch, state):
+        """未処理のファイルを一覧に戻して、同じ計画で続きを実行する（フォルダの再取り込みはしない）"""
+        self.replace_selection(entry.source for entry in state.pending)
+        preflight = self.create_preflight_scan()
+        resolution = ConflictResolution(DestinationIndex(preflight))
+        for index, entry in enumerate(state.pending):
+            resumed = PlanEntry(index, entry.source, entry.destination, entry.filename)
+            resumed.overwrite = entry.overwrite
+            resumed.staged_source = entry.staged_source
+            resolution.entries.append(resumed)
+        if self.start_batch_job(None, resolution, batch.action_name, "ファイルの処理を再開しました"):
+            batch.discard()
+
+    def undo_last_batch(self):
+        """直前の一括処理を逆向きの計画で元に戻す（再起動後も直近の履歴から戻せる）"""
+        if self.is_batch_running():
+            return
+        try:
+            record = self.undo_history.latest()
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("エラー", f"元に戻す履歴を読み込めません: {str(e)}")
+            return
+        if record is None:
+            messagebox.showinfo("元に戻す", "元に戻せる一括処理がありません")
+            return
+        if not messagebox.askyesno("確認", f"{record.finished} の{record.action_name}（{len(record.moves)}個）を元に戻しますか？"):
+            return
+
+        entries = record.reverse_entries()
+        self.replace_selection(entry.source for entry in entries)
+        preflight = self.create_preflight_scan()
+        resolution = ConflictResolution(DestinationIndex(preflight))
+        for entry in entries:
+            if preflight.exists(entry.source):
+                resolution.entries.append(entry)
+            else:
+                resolution.missing.append(entry)
+        self.start_batch_job(None, resolution, f"元に戻す（{record.action_name}）", "ファイルを元に戻しました",
+                             undo_record=record)
+
+    def update_undo_history(self, report, undo_record):
+        """
+        終わった一括処理を元に戻す履歴に追加する
+        元に戻す処理だった場合は、戻せなかった移動（失敗・キャンセル）だけを履歴に残す
+        """
+        try:
+            if undo_record is None:
+                self.undo_history.record(report)
+            else:
+                self.undo_history.record_undo(undo_record, report)
+        except OSError as e:
+            messagebox.showerror("エラー", f"元に戻す履歴を保存できません: {str(e)}")
+
+    def show_uncertain_entries(self, state):
+        """移動済みか判断できず、再開・元に戻す対象にしなかったファイルを表示する"""
+        if not state.uncertain:
+            return
+        names = [f"{entry.source} → {entry.destination}" for entry in state.uncertain[:self.CONFLICT_REVIEW_LIMIT]]
+        if len(state.uncertain) > self.CONFLICT_REVIEW_LIMIT:
+            names.append(f"...他{len(state.uncertain) - self.CONFLICT_REVIEW_LIMIT}個")
+        messagebox.showwarning(
+            "要確認",
+            f"次の{len(state.uncertain)}個は、同じ一括処理の別のファイルと名前が重なるため、"
+            "移動済みかどうか判断できません。処理しないので、内容を確認してください。\n\n" + "\n".join(names))
+
+    def rollback_unfinished_batch(self, batch, state):
+        """移動済みのファイルを元の場所に戻す"""
+        failures = batch.rollback(state)
+        batch.discard()
+        # コマンドラインで Ctrl+C で止めた一括処理は履歴にも残っているので、元に戻した移動を除く
+        try:
+            self.undo_history.record_rollback(batch.batch_id, state, failures)
+        except OSError as e:
+            messagebox.showerror("エラー", f"元に戻す履歴を保存できません: {str(e)}")
+        restored = len(state.done) - len(failures)
+        if failures:
+            names = [f"{os.path.basename(entry.destination)}: {str(error)}"
+                     for entry, error in failures[:self.CONFLICT_REVIEW_LIMIT]]
+            if len(failures) > self.CONFLICT_REVIEW_LIMIT:
+                names.append(f"...他{len(failures) - self.CONFLICT_REVIEW_LIMIT}個")
+            messagebox.showwarning("警告", f"{restored}個のファイルを元に戻しました。次のファイルは戻せませんでした。\n\n"
+                                   + "\n".join(names))
+        self.status_var.set(f"中断した{batch.action_name}を元に戻しました（{restored}個）")
+
+    def cancel_batch_job(self):
+        if self.ingest_state is not None:
+            self.ingest_state["cancelled"] = True
+            return
+        if self.batch_job is not None and self.batch_job.is_running:
+            self.batch_job.cancel()
+            self.status_var.set("キャンセルしています... 実行中のファイルが終わると停止します")
+
+    def poll_batch_job(self):
+        """ワーカーからの進捗イベントを取り出してUIに反映する（エラーは最後にまとめて表示）"""
+        job = self.batch_job
+        context = self.batch_context
+        report = context["report"]
+        finished = False
+        # 届いているイベントはすべて取り出す（時間を使い切った場合だけ次の呼び出しに回す）
+        deadline = time.perf_counter() + self.BATCH_POLL_BUDGET
+        while time.perf_counter() < deadline:
             try:
-                shutil.move(source_path, destination_path)
-                new_files.append(destination_path)
-                success_count += 1
-            except PermissionError:
-                messagebox.showerror("エラー", f"ファイル '{new_filename}' へのアクセス権限がありません。")
-                new_files.append(source_path)  # 元のパスを保持
-            except FileNotFoundError:
-                messagebox.showerror("エラー", f"ファイルが見つかりません: {os.path.basename(source_path)}")
-                new_files.append(source_path)  # 元のパスを保持
-            except Exception as e:
-                new_files.append(source_path)  # 失敗した場合は元のパスを保持
-                messagebox.showerror("エラー", f"ファイル '{os.path.basename(source_path)}' の名前変更と移動中にエラーが発生しました: {str(e)}")
-        
-        # 成功したファイルをリストに更新
-        self.selected_files = new_files
-        
-        # リストボックスを更新
-        self.files_listbox.delete(0, tk.END)
-        for file in self.selected_files:
-            self.files_listbox.insert(tk.END, os.path.basename(file))
-        
-        # 最終連番 + 1 を設定
-        if self.auto_increment.get():
-            self.sequence_number.set(str(start_seq + len(self.selected_files)))
-            self.update_filename_preview()
-        else:
-            # 元の連番に戻す
-            self.sequence_number.set(str(start_seq))
-            self.update_filename_preview()
-        
-        self.status_var.set(f"{len(self.selected_files)}個中{success_count}個のファイル名を変更し移動しました")
+                kind, result = job.events.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "finished":
+                finished = True
+                break
+
+            context["processed"] += 1
+            report.add(result)
+            self.journal.record_result(report, result)
+            entry = result.entry
+            if result.status == STATUS_SUCCESS:
+                # 成功したファイルは新しいパスに置き換える
+                self.file_status.pop(self.selected_files[entry.index], None)
+                self.batch_names.pop(self.selected_files[entry.index], None)
+                self.batch_names[entry.destination] = entry.filename
+                self.replace_selected_path(entry, context["entries"])
+                self.file_status[entry.destination] = STATUS_SUCCESS
+            else:
+                self.file_status[entry.source] = result.status
 
-    def save_settings(self):
-        settings = {
-            "filename_templates": self.filename_templates,
-            "dest_templates": self.dest_templates,
+        # 表示中の行だけ更新
+        with METRICS.timer("ui_refresh"):
+            self.files_list.refresh()
+
+        if finished:
+            self.finish_batch_job()
+            return
+
+        if not job.is_cancelled:
+            self.status_var.set(f"{report.action_name}を実行中... {context['processed']}/{job.total}"
+                                + self.format_group_progress(job))
+        # 取り出しきれなかった場合はすぐに続きを処理する
+        self.root.after(1 if not job.events.empty() else self.BATCH_POLL_MS, self.poll_batch_job)
+
+    def format_group_progress(self, job):
+        """デバイスのグループが複数ある場合、グループごとの進捗を「  E:→D: 10/40」の形で返す"""
+        if job.scheduler is None or len(job.scheduler.groups) < 2:
+            return ""
+        groups = job.scheduler.progress()
+        parts = [f"{os.path.basename(group['source']) or group['source']}→"
+                 f"{os.path.basename(group['destination']) or group['destination']} {group['done']}/{group['total']}"
+                 for group in groups[:self.GROUP_PROGRESS_LIMIT]]
+        if len(groups) > self.GROUP_PROGRESS_LIMIT:
+            parts.append(f"...他{len(groups) - self.GROUP_PROGRESS_LIMIT}グループ")
+        return "  （" + " / ".join(parts) + "）"
+
+    def replace_selected_path(self, entry, entries):
+        """
+        成功したファイルの一覧の行を移動後のパスに置き換える
+
+        循環する名前の付け替えでは、移動先がまだ一時的な名前へ移したファイルの元のパスとして一覧に
+        残っているので、その行を先に一時的な名前に置き換える（そのファイルの移動が終われば保存先になる）。
+        """
+        other = entries.get(self.selected_files.index(entry.destination)) \
+            if entry.destination in self.selected_files else None
+        if other is not None and other is not entry and other.staged_source is not None:
+            self.selected_files[other.index] = other.staged_source
+        try:
+            self.selected_files[entry.index] = entry.destination
+        except ValueError:
+            # 一覧にある別のファイルを上書きした場合は、その行が移動後のファイルを指すので元の行はそのままにする
+            pass
+
+    def finish_batch_job(self):
+        job = self.batch_job
+        context = self.batch_context
+        plan = context["plan"]
+        report = context["report"]
+        report.add_entries(job.cancelled_entries, STATUS_CANCELLED)
+        report.finish(job.scheduler)
+        context["wal"].finish()
+        # 実行しなかったファイル（スキップ・見つからない・キャンセル）と全体のスループットを記録
+        self.journal.record_results(report, [result for result in report.results
+                                             if result.status not in (STATUS_SUCCESS, STATUS_FAILED)])
+        self.journal.record_batch(report)
+        self.update_undo_history(report, context["undo_record"])
+        METRICS.count("batches")
+        METRICS.record("batch", report.elapsed)
+        for status, count in report.counts().items():
+            METRICS.count(f"files_{status}", count)
+        for result in report.results:
+            if result.status != STATUS_SUCCESS:
+                self.file_status[result.entry.source] = result.status
+        self.files_list.refresh()
+        self.last_batch_report = report
+        self.cancel_button.configure(state=tk.DISABLED)
+        self.report_button.configure(state=tk.NORMAL)
+
+        # 最終連番 + 1 を設定（計画作成時は連番を変更しないので、自動増加なしなら元の連番のまま）
+        if self.auto_increment.get() and plan is not None and plan.start_seq is not None:
+            batch_names = self.batch_names
+            self.sequence_number.set(str(plan.start_seq + len(self.selected_files)))
+            # 連番を進めても、次に設定を変えるまでは実行した結果の名前を表示する
+            self.batch_names = batch_names
+            self.files_list.refresh()
+
+        message = f"{len(self.selected_files)}個中{report.count(STATUS_SUCCESS)}個の{context['done_message']}"
+        if job.is_cancelled:
+            message += f"（キャンセル: {len(job.cancelled_entries)}個未処理）"
+        self.status_var.set(message)
+        self.flush_settings()
+        self.stop_profile()
+
+        # 失敗があった場合のみ結果レポートを1回だけ表示
+        if report.failures:
+            self.show_batch_report()
+
+    def describe_result(self, result):
+        """結果レポートに表示する説明文"""
+        if result.status == STATUS_SKIPPED:
+            return "同名ファイルがあるためスキップしました"
+        if result.status == STATUS_MISSING:
+            return "ファイルが見つかりません"
+        if result.status == STATUS_CANCELLED:
+            return "キャンセルにより未処理です"
+        error = result.error
+        if isinstance(error, PermissionError):
+            return "アクセス権限がありません"
+        if isinstance(error, FileNotFoundError):
+            return "ファイルが見つかりません"
+        return f"エラーが発生しました: {str(error)}"
+
+    def show_batch_report(self):
+        """直前の一括処理の結果レポートを表示する"""
+        report = self.last_batch_report
+        if report is None:
+            messagebox.showinfo("結果レポート", "まだ一括処理を実行していません")
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title("結果レポート")
+        window.geometry("640x400")
+        ttk.Label(window, text=report.summary(), wraplength=600).pack(fill=tk.X, padx=10, pady=5)
+
+        tree_frame = ttk.Frame(window)
+        tree_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        tree = ttk.Treeview(tree_frame, columns=("status", "file", "detail"), show="headings")
+        tree.heading("status", text="状態")
+        tree.heading("file", text="ファイル")
+        tree.heading("detail", text="詳細")
+        tree.column("status", width=80, stretch=False)
+        tree.column("file", width=200)
+        tree.column("detail", width=300)
+        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        # 成功以外のみ一覧表示（すべての結果はエクスポートで確認）
+        for result in report.results:
+            if result.status != STATUS_SUCCESS:
+                tree.insert("", tk.END, values=(result.status, os.path.basename(result.entry.source),
+                                                self.describe_result(result)))
+
+        button_frame = ttk.Frame(window)
+        button_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Button(button_frame, text="CSVに出力", command=lambda: self.export_batch_report("csv")).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="JSONに出力", command=lambda: self.export_batch_report("json")).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="閉じる", command=window.destroy).pack(side=tk.RIGHT, padx=5)
+
+    def run_profiled(self, name, func, *args, **kwargs):
+        """
+        操作をプロファイルしながら実行する
+
+        一括処理や取り込みを開始した場合は、それが終わったときに保存する。
+        """
+        if self.profile_mode is None or self.profile_session is not None:
+            return func(*args, **kwargs)
+        self.profile_session = ProfileSession(name, self.profile_mode).start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            batch_running = self.batch_job is not None and self.batch_job.is_running
+            if not batch_running and self.ingest_state is None:
+                self.stop_profile()
+
+    def stop_profile(self):
+        session = self.profile_session
+        if session is None:
+            return
+        self.profile_session = None
+        try:
+            path = session.stop()
+        except Exception as e:
+            print(f"プロファイルを保存できません: {e}", file=sys.stderr)
+            return
+        print(f"プロファイルを保存しました: {path}", file=sys.stderr)
+
+    def show_diagnostics(self):
+        """段階ごと・デバイスごとの所要時間（p50/p95/p99）を表示する"""
+        window = tk.Toplevel(self.root)
+        window.title("診断")
+        window.geometry("720x400")
+        counters_var = tk.StringVar()
+        ttk.Label(window, textvariable=counters_var, wraplength=680).pack(fill=tk.X, padx=10, pady=5)
+
+        tree_frame = ttk.Frame(window)
+        tree_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        columns = ("phase", "device", "count", "p50", "p95", "p99", "max")
+        headings = ("段階", "デバイス", "回数", "p50 (ms)", "p95 (ms)", "p99 (ms)", "最大 (ms)")
+        tree = ttk.Treeview(tree_frame, columns=columns, show="headings")
+        for column, heading in zip(columns, headings):
+            tree.heading(column, text=heading)
+            tree.column(column, width=120 if column == "phase" else 80, anchor=tk.W if column == "phase" else tk.E)
+        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        def ms(value):
+            return "" if value is None else f"{value * 1000:.2f}"
+
+        def refresh():
+            snapshot = METRICS.snapshot()
+            counters_var.set(", ".join(f"{name}: {value}" for name, value in sorted(snapshot["counters"].items()))
+                             or "まだ計測された処理はありません")
+            tree.delete(*tree.get_children())
+            for phase, stats in sorted(snapshot["phases"].items()):
+                rows = [("全体", stats)] + sorted(snapshot["devices"].get(phase, {}).items())
+                for device, device_stats in rows:
+                    tree.insert("", tk.END, values=(phase, device, device_stats["count"], ms(device_stats["p50"]),
+                                                    ms(device_stats["p95"]), ms(device_stats["p99"]),
+                                                    ms(device_stats["max"])))
+
+        def reset():
+            METRICS.reset()
+            refresh()
+
+        button_frame = ttk.Frame(window)
+        button_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Button(button_frame, text="更新", command=refresh).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="JSONに出力", command=self.export_metrics).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="リセット", command=reset).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="閉じる", command=window.destroy).pack(side=tk.RIGHT, padx=5)
+        refresh()
+
+    def export_metrics(self):
+        path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON", "*.json")])
+        if not path:
+            return
+        try:
+            METRICS.export_json(path)
+            self.status_var.set(f"診断情報を出力しました: {path}")
+        except Exception as e:
+            messagebox.showerror("エラー", f"診断情報の出力中にエラーが発生しました: {str(e)}")
+
+    def export_metrics_on_exit(self):
+        path = metrics_export_path()
+        if path:
+            try:
+                METRICS.export_json(path)
+            except OSError as e:
+                print(f"診断情報を出力できません: {path}: {e}", file=sys.stderr)
+
+    def export_batch_report(self, file_format):
+        report = self.last_batch_report
+        path = filedialog.asksaveasfilename(
+            defaultextension=f".{file_format}",
+            filetypes=[(file_format.upper(), f"*.{file_format}")],
+            initialfile=f"batch_report_{report.started_at.strftime('%Y%m%d_%H%M%S')}.{file_format}")
+        if not path:
+            return
+        try:
+            if file_format == "csv":
+                report.export_csv(path)
+            else:
+                report.export_json(path)
+            self.status_var.set(f"結果レポートを出力しました: {path}")
+        except Exception as e:
+            messagebox.showerror("エラー", f"結果レポートの出力中にエラーが発生しました: {str(e)}")
+
+    def collect_settings(self):
+        return {
             "sequence_digits": self.sequence_digits.get(),
-            "auto_increment": self.auto_increment.get()
+            "auto_increment": self.auto_increment.get(),
+            "worker_count": self.worker_count.get(),
+            "device_limits": self.device_limits.get(),
+            "conflict_policy": self.get_conflict_policy(),
+            "ingest_max_depth": self.ingest_max_depth.get(),
+            "ingest_include": self.ingest_include.get(),
+            "ingest_exclude": self.ingest_exclude.get()
         }
-        
-        # 実行ファイルのディレクトリを基準にする
-        if getattr(sys, 'frozen', False):
-            # PyInstallerで実行される場合
-            application_path = os.path.dirname(sys.executable)
-        else:
-            # 通常のPythonスクリプトとして実行される場合
-            application_path = os.path.dirname(os.path.abspath(__file__))
-        
-        settings_path = os.path.join(application_path, 'file_manager_settings.json')
-        
+
+    def save_settings(self):
+        """設定を今すぐ保存する"""
+        settings_path = self.settings_persistence.path
         try:
-            with open(settings_path, 'w') as f:
-                json.dump(settings, f)
+            self.settings_persistence.flush(force=True)
             self.status_var.set(f"設定を保存しました: {settings_path}")
         except Exception as e:
             messagebox.showerror("エラー", f"設定保存中にエラーが発生しました: {str(e)}")
 
+    def flush_settings(self):
+        """未保存の変更があれば保存する（一括処理の終了時など）"""
+        try:
+            self.settings_persistence.flush()
+        except Exception as e:
+            self.on_settings_save_error(e)
+
+    def on_settings_save_error(self, error):
+        messagebox.showerror("エラー", f"設定保存中にエラーが発生しました: {str(error)}")
+
+    def on_close(self):
+        # 実行中の一括処理は現在のファイルが終わったところで止める
+        if self.batch_job is not None and self.batch_job.is_running:
+            self.batch_job.cancel()
+        self.flush_settings()
+        self.template_store.close()
+        self.journal.close()
+        self.export_metrics_on_exit()
+        self.stop_profile()
+        self.root.destroy()
+
+    @profiled("load_settings")
     def load_settings(self):
-        # 実行ファイルのディレクトリを基準にする
-        if getattr(sys, 'frozen', False):
-            # PyInstallerで実行される場合
-            application_path = os.path.dirname(sys.executable)
-        else:
-            # 通常のPythonスクリプトとして実行される場合
-            application_path = os.path.dirname(os.path.abspath(__file__))
-
-        settings_path = os.path.join(application_path, 'file_manager_settings.json')
+        settings_path = self.settings_persistence.path
 
         try:
-            if os.path.exists(settings_path):
-                with open(settings_path, 'r') as f:
-                    settings = json.load(f)
-
-                if "filename_templates" in settings:
-                    self.filename_templates = settings["filename_templates"]
-                    self.update_filename_templates_combo()
-
-                if "dest_templates" in settings:
-                    self.dest_templates = settings["dest_templates"]
-                    # 詳細設定タブ削除に伴い、dest_template_comboは存在しないため更新処理は行わない
+            settings = load_settings_file(settings_path)
+            # 以前の設定ファイルに保存されていたテンプレートを一度だけ取り込む
+            if self.template_store.migrate_settings(settings):
+                self.settings_persistence.mark_dirty()
 
+            if settings is not None:
                 if "sequence_digits" in settings:
                     self.sequence_digits.set(settings["sequence_digits"])
 
                 if "auto_increment" in settings:
                     self.auto_increment.set(settings["auto_increment"])
 
+                if "worker_count" in settings:
+                    self.worker_count.set(settings["worker_count"])
+
+                if "device_limits" in settings:
+                    self.device_limits.set(settings["device_limits"])
+
+                if settings.get("conflict_policy") in CONFLICT_POLICY_LABELS:
+                    self.conflict_policy.set(CONFLICT_POLICY_LABELS[settings["conflict_policy"]])
+
+                for key, var in (("ingest_max_depth", self.ingest_max_depth),
+                                 ("ingest_include", self.ingest_include),
+                                 ("ingest_exclude", self.ingest_exclude)):
+                    if key in settings:
+                        var.set(settings[key])
+
 
                 self.status_var.set(f"設定を読み込みました: {settings_path}")
 
                 # テンプレートが1つ以上あれば、最初のテンプレートを自動で読み込む
-                if self.filename_templates:
-                    first_template_name = list(self.filename_templates.keys())[0]
-                    template = self.filename_templates[first_template_name]
+                first_template = self.template_store.first(KIND_FILENAME)
+                if first_template is not None:
+                    first_template_name, template = first_template
+                    self.template_choice.set(first_template_name)
                     self.pattern_entry.delete(0, tk.END)
                     self.pattern_entry.insert(0, template["pattern"])
                     self.date_format.set(template.get("date_format", ""))
@@ -1185,7 +1983,6 @@ class FileManagerApp:
             # かんたんモード
             try:
                 self.batch_file_frame.pack_forget()
-                self.files_listbox.pack_forget()
                 self.file_label.pack(fill='x', pady=10)
                 self.single_file_frame.pack(fill='x', pady=5)
             except:
@@ -1212,12 +2009,25 @@ class FileManagerApp:
             except:
                 pass
     def on_drop_files(self, event):
-        # 複数ファイルの場合は最初のファイルのみ使用
         files = self.root.tk.splitlist(event.data)
-        if files:
-            file_path = files[0]
-            self.selected_file_path.set(file_path)
-            self.status_var.set(f"ドロップされたファイルを選択しました: {file_path}")
+        if not files:
+            return
+
+        # 複数ファイル・フォルダのドロップ、または一括処理モード中は一覧に取り込む
+        if len(files) > 1 or self.batch_mode.get() or os.path.isdir(files[0]):
+            if self.batch_job is not None and self.batch_job.is_running:
+                self.status_var.set("一括処理を実行中です。完了するかキャンセルしてください")
+                return
+            if not self.batch_mode.get():
+                self.batch_mode.set(True)
+                self.toggle_batch_mode()
+            self.ingest_paths(files)
+            return
+
+        file_path = files[0]
+        self.selected_file_path.set(file_path)
+        self.status_var.set(f"ドロップされたファイルを選択しました: {file_path}")
+
     def toggle_component_frame(self):
         if hasattr(self, 'components_frame'):
             if self.show_component_frame.get():
@@ -1234,7 +2044,7 @@ class FileManagerApp:
 
     # 送り先ラベルへのD&D対応
     def enable_dest_drop(self):
-        self.dest_label.drop_target_register(tkdnd.DND_FILES)
+        self.dest_label.drop_target_register(load_tkdnd().DND_FILES)
         self.dest_label.dnd_bind('<<Drop>>', self.on_drop_destination)
 
     def on_drop_destination(self, event):
@@ -1248,9 +2058,37 @@ class FileManagerApp:
                 self.status_var.set("フォルダをドロップしてください。")
             self.update_filename_preview()
 
+_tkdnd = None
+
+def load_tkdnd():
+    """tkinterdnd2 を必要になったときに読み込む（インストールされていなければ None）"""
+    global _tkdnd
+    if _tkdnd is None:
+        try:
+            import tkinterdnd2
+        except ImportError:
+            return None
+        _tkdnd = tkinterdnd2
+    return _tkdnd
+
+def report_startup_time(root, init_started, init_finished):
+    """起動から最初の描画までの時間を表示して終了する（--measure-startup）"""
+    root.update_idletasks()
+    first_paint = time.perf_counter()
+    print(f"imports: {(init_started - STARTUP_STARTED) * 1000:.1f} ms, "
+          f"init: {(init_finished - init_started) * 1000:.1f} ms, "
+          f"time-to-first-paint: {(first_paint - STARTUP_STARTED) * 1000:.1f} ms")
+    root.destroy()
+
 def main():
-    root = tkdnd.TkinterDnD.Tk()
+    measure_startup = "--measure-startup" in sys.argv[1:]
+    tkdnd = load_tkdnd()
+    init_started = time.perf_counter()
+    root = tkdnd.TkinterDnD.Tk() if tkdnd is not None else tk.Tk()
     app = FileManagerApp(root)
+    if measure_startup:
+        # 最初の描画が終わった時点で計測する
+        root.after_idle(report_startup_time, root, init_started, time.perf_counter())
     root.mainloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,370 @@
+"""
+コマンドラインからの一括処理（Tk不要）
+
+保存済みのテンプレートを使って、GUIと同じ規則でファイル名変更・移動を行う。
+tkinter / tkinterdnd2 / pyperclip は読み込まないので、ディスプレイのないサーバーでも動く。
+
+    python file_manager.py run --template NAME --dest DIR FILES...
+    python file_manager.py run --template NAME --from-list paths.txt
+    python file_manager.py recover [--resume | --rollback]
+    python file_manager.py undo [--list]
+
+結果は1行のJSONで標準出力に書き出す。終了コードは 0: 成功、1: 失敗あり、2: 指定の誤り。
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+from batch_engine import (
+    CONFLICT_ASK, CONFLICT_POLICIES, STATUS_CANCELLED, STATUS_FAILED, STATUS_MISSING, STATUS_SKIPPED,
+    STATUS_SUCCESS,
+    BatchJob, BatchReport, ConflictResolution, DestinationIndex, DeviceScheduler, FileSelection, PlanEntry,
+    PreflightScan, RenamePlan,
+    execute_entry, iter_ingest_paths, order_moves, parse_device_limits, resolve_conflicts
+)
+from batch_journal import (
+    BatchWriteAheadLog, OperationJournal, UndoHistory, find_unfinished_batches, get_journal_path
+)
+from diagnostics import METRICS, metrics_export_path
+from settings_store import get_settings_path, load_settings_file
+from template_store import KIND_FILENAME, TemplateStore, get_templates_path
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+MODE_RENAME = "rename"
+MODE_MOVE = "move"
+MODE_RENAME_MOVE = "rename-move"
+MODE_ACTION_NAMES = {
+    MODE_RENAME: "名前変更",
+    MODE_MOVE: "移動",
+    MODE_RENAME_MOVE: "名前変更と移動",
+}
+
+
+class UsageError(Exception):
+    pass
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="file_manager.py", description="ファイル管理ユーティリティ（コマンドライン）")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run = subparsers.add_parser("run", help="保存済みテンプレートで一括処理を実行する")
+    run.add_argument("files", nargs="*", help="対象のファイルまたはフォルダ")
+    run.add_argument("--template", required=True, help="使用するテンプレート名")
+    run.add_argument("--dest", help="保存先フォルダ（省略時はテンプレートの保存先）")
+    run.add_argument("--from-list", help="対象のパスを1行に1つ書いたファイル（- で標準入力）")
+    run.add_argument("--mode", choices=(MODE_RENAME, MODE_MOVE, MODE_RENAME_MOVE),
+                     help="省略時は保存先があれば rename-move、なければ rename")
+    run.add_argument("--start-seq", type=int, default=1, help="連番の開始番号（既定: 1）")
+    run.add_argument("--conflict", choices=CONFLICT_POLICIES,
+                     help="同名ファイルがある場合の方針（ask は確認できないため skip として扱う）")
+    run.add_argument("--workers", type=int, help="デバイスごとの同時実行数")
+    run.add_argument("--device-limit", action="append", default=[], metavar="フォルダ=数",
+                     help="そのフォルダのあるデバイスの同時実行数（複数指定可）")
+    run.add_argument("--max-depth", type=int, help="フォルダをたどる階層の上限")
+    run.add_argument("--settings", help="設定ファイルのパス（既定: file_manager_settings.json）")
+    run.add_argument("--templates", help="テンプレートのパス（既定: file_manager_templates.db）")
+    run.add_argument("--report", help="結果をJSONで保存するパス")
+    run.add_argument("--dry-run", action="store_true", help="実行せずに計画だけを出力する")
+    run.add_argument("--journal", help="操作ジャーナルのパス（既定: file_manager_journal.jsonl）")
+    run.add_argument("--metrics", help="段階ごとの所要時間をJSONで保存するパス")
+
+    recover = subparsers.add_parser("recover", help="中断した一括処理を表示・再開・元に戻す")
+    action = recover.add_mutually_exclusive_group()
+    action.add_argument("--resume", action="store_true", help="未処理のファイルを同じ計画で実行する")
+    action.add_argument("--rollback", action="store_true", help="移動済みのファイルを元の場所に戻す")
+    recover.add_argument("--workers", type=int, default=1, help="デバイスごとの同時実行数（--resume の場合）")
+    recover.add_argument("--journal", help="操作ジャーナルのパス（既定: file_manager_journal.jsonl）")
+
+    undo = subparsers.add_parser("undo", help="直前の一括処理を元に戻す")
+    undo.add_argument("--list", action="store_true", help="元に戻せる一括処理の一覧を表示する")
+    undo.add_argument("--workers", type=int, default=1, help="デバイスごとの同時実行数")
+    undo.add_argument("--journal", help="操作ジャーナルのパス（既定: file_manager_journal.jsonl）")
+    return parser
+
+
+def read_path_list(path):
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        return [line.rstrip("\r\n") for line in stream if line.strip()]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def load_template(settings_path, templates_path, name):
+    settings = load_settings_file(settings_path) or {}
+    store = TemplateStore(templates_path)
+    try:
+        # GUIをまだ起動していない場合に備えて、以前の設定ファイルのテンプレートも取り込む
+        store.migrate_settings(settings)
+        template = store.get(KIND_FILENAME, name)
+    finally:
+        store.close()
+    if template is None:
+        raise UsageError(f"テンプレートが存在しません: {name}")
+    return settings, template
+
+
+def run_batch(args):
+    settings_path = args.settings or get_settings_path()
+    settings, template = load_template(settings_path, args.templates or get_templates_path(), args.template)
+
+    selection = FileSelection()
+    paths = list(args.files)
+    if args.from_list:
+        paths.extend(read_path_list(args.from_list))
+    selection.extend(iter_ingest_paths(paths, args.max_depth))
+    if not selection:
+        raise UsageError("ファイルが指定されていません")
+
+    dest_dir = args.dest or template.get("destination_path") or None
+    mode = args.mode or (MODE_RENAME_MOVE if dest_dir else MODE_RENAME)
+    if mode != MODE_RENAME and not dest_dir:
+        raise UsageError("保存先が指定されていません")
+
+    with METRICS.timer("plan"):
+        plan = RenamePlan(
+            selection,
+            pattern=template["pattern"],
+            date_format=template.get("date_format") or "%Y%m%d",
+            sequence_digits=template.get("sequence_digits", settings.get("sequence_digits", 4)),
+            custom_text=template.get("custom_text", ""),
+            start_seq=args.start_seq,
+            dest_dir=dest_dir if mode != MODE_RENAME else None,
+            rename=mode != MODE_MOVE,
+        )
+
+    # 確認ダイアログは出せないので「まとめて確認」はスキップとして扱う
+    policy = args.conflict or settings.get("conflict_policy", CONFLICT_ASK)
+    with METRICS.timer("preflight"):
+        preflight = PreflightScan(selection)
+    METRICS.count("scandir", preflight.scandir_count)
+    with METRICS.timer("conflicts"):
+        resolution = resolve_conflicts(plan.entries, policy, DestinationIndex(preflight))
+        resolution.skip_unresolved()
+
+    report = BatchReport(MODE_ACTION_NAMES[mode])
+    report.add_entries(resolution.missing, STATUS_MISSING)
+    report.add_entries(resolution.skipped, STATUS_SKIPPED)
+
+    if args.dry_run:
+        report.finish()
+        return report, [{"source": entry.source, "destination": entry.destination} for entry in resolution.entries]
+
+    if dest_dir and mode != MODE_RENAME:
+        os.makedirs(dest_dir, exist_ok=True)
+
+    workers = args.workers or settings.get("worker_count", 1)
+    # 設定ファイルの上限に、コマンドラインで指定した上限を重ねる
+    folder_limits = parse_device_limits(settings.get("device_limits", ""))
+    folder_limits.update(parse_device_limits(";".join(args.device_limit)))
+    execute_resolution(resolution, report, int(workers), args.journal, folder_limits)
+    update_undo_history(report)
+    return report, None
+
+
+def update_undo_history(report, undo_record=None):
+    """
+    終わった一括処理を元に戻す履歴に保存する（undo_record: 元に戻す処理だった場合、その履歴）
+
+    ファイルの移動は終わっているので、保存できなくても標準エラーに警告を書くだけにして、
+    結果の出力と終了コードは一括処理の結果のままにする。
+    """
+    history = UndoHistory()
+    try:
+        if undo_record is None:
+            history.record(report)
+        else:
+            history.record_undo(undo_record, report)
+    except OSError as e:
+        print(f"警告: 元に戻す履歴を保存できません: {e}", file=sys.stderr)
+
+
+def execute_resolution(resolution, report, workers, journal_path=None, folder_limits=None):
+    """
+    解決済みの実行計画を実行して report に結果を追加する
+
+    移動元・移動先のデバイスの組み合わせごとに、デバイスごとの上限（既定は workers）で並列に実行する。
+
+    実行前に計画を先行書き込みログに保存し、成功したファイルをワーカーから記録する。
+    Ctrl+C で止めた場合はログが残り、recover で再開・元に戻すことができる。
+    """
+    # 連鎖・循環する名前の付け替えは順番に実行する（一時的な名前をログに残すため、ログより先に決める）
+    units = order_moves(resolution.entries, resolution.index)
+    wal = BatchWriteAheadLog.create(report, resolution.entries)
+    journal = OperationJournal(journal_path or get_journal_path()).start()
+    scheduler = DeviceScheduler.for_index(resolution.index, workers, folder_limits)
+    # 移動が終わるたびにワーカーから完了を記録する
+    operation = wal.wrap(lambda entry: execute_entry(entry, resolution.index))
+    job = BatchJob(units, operation, scheduler=scheduler).start()
+    interrupted = False
+    try:
+        while True:
+            kind, result = job.events.get()
+            if kind == "finished":
+                break
+            report.add(result)
+            journal.record_result(report, result)
+    except KeyboardInterrupt:
+        # 実行中のファイルが終わったところで止める
+        interrupted = True
+        job.cancel()
+        job.wait()
+        while not job.events.empty():
+            kind, result = job.events.get()
+            if kind == "result":
+                report.add(result)
+                journal.record_result(report, result)
+    wal.sync()
+    if interrupted:
+        wal.close()
+    else:
+        wal.finish()
+    report.add_entries(job.cancelled_entries, STATUS_CANCELLED)
+    report.finish(scheduler)
+    journal.record_results(report, [result for result in report.results
+                                    if result.status not in (STATUS_SUCCESS, STATUS_FAILED)])
+    journal.record_batch(report)
+    journal.close()
+    METRICS.record("batch", report.elapsed)
+    for status, count in report.counts().items():
+        METRICS.count(f"files_{status}", count)
+
+
+def recover_batches(args):
+    """中断した一括処理を一覧表示し、--resume / --rollback が指定されていれば処理する"""
+    batches = []
+    ok = True
+    for batch in find_unfinished_batches():
+        try:
+            state = batch.inspect()
+            summary = {
+                "batch": batch.batch_id,
+                "action": batch.action_name,
+                "created": batch.created,
+                "done": len(state.done),
+                "pending": len(state.pending),
+                "lost": len(state.lost),
+                # 移動済みか判断できないため処理しないエントリ
+                "uncertain": [{"source": entry.source, "destination": entry.destination} for entry in state.uncertain],
+            }
+            if (args.resume or args.rollback) and state.uncertain:
+                ok = False
+            if args.resume:
+                selection = FileSelection(entry.source for entry in state.pending)
+                resolution = ConflictResolution(DestinationIndex(PreflightScan(selection)))
+                for index, entry in enumerate(state.pending):
+                    resumed = PlanEntry(index, entry.source, entry.destination, entry.filename)
+                    resumed.overwrite = entry.overwrite
+                    resumed.staged_source = entry.staged_source
+                    resolution.entries.append(resumed)
+                report = BatchReport(batch.action_name)
+                execute_resolution(resolution, report, max(1, args.workers), args.journal)
+                batch.discard()
+                update_undo_history(report)
+                summary["counts"] = report.counts()
+                summary["failures"] = [result.as_dict() for result in report.failures]
+                ok = ok and not report.failures
+            elif args.rollback:
+                failures = batch.rollback(state)
+                batch.discard()
+                # Ctrl+C で止めた一括処理の履歴から、元に戻した移動を除く
+                try:
+                    UndoHistory().record_rollback(batch.batch_id, state, failures)
+                except OSError as e:
+                    print(f"警告: 元に戻す履歴を保存できません: {e}", file=sys.stderr)
+                summary["restored"] = len(state.done) - len(failures)
+                summary["failures"] = [{"source": entry.source, "destination": entry.destination, "error": str(error)}
+                                       for entry, error in failures]
+                ok = ok and not failures
+            batches.append(summary)
+        finally:
+            batch.release()
+    print(json.dumps({"ok": ok, "batches": batches}, ensure_ascii=False))
+    return EXIT_OK if ok else EXIT_FAILED
+
+
+def undo_last_batch(args):
+    """直前の一括処理を逆向きの計画で元に戻す（--list の場合は履歴を表示するだけ）"""
+    history = UndoHistory()
+    if args.list:
+        records = [{"batch": record.batch_id, "action": record.action_name, "finished": record.finished,
+                    "files": len(record.moves)} for record in history.records()]
+        print(json.dumps({"ok": True, "history": records}, ensure_ascii=False))
+        return EXIT_OK
+    record = history.latest()
+    if record is None:
+        raise UsageError("元に戻せる一括処理がありません")
+
+    entries = record.reverse_entries()
+    preflight = PreflightScan(entry.source for entry in entries)
+    resolution = ConflictResolution(DestinationIndex(preflight))
+    for entry in entries:
+        if preflight.exists(entry.source):
+            resolution.entries.append(entry)
+        else:
+            resolution.missing.append(entry)
+    report = BatchReport(f"元に戻す（{record.action_name}）")
+    report.add_entries(resolution.missing, STATUS_MISSING)
+    execute_resolution(resolution, report, max(1, args.workers), args.journal)
+    update_undo_history(report, record)
+    print(json.dumps({
+        "ok": not report.failures,
+        "batch": record.batch_id,
+        "action": report.action_name,
+        "counts": report.counts(),
+        "failures": [result.as_dict() for result in report.failures],
+    }, ensure_ascii=False))
+    return EXIT_OK if not report.failures else EXIT_FAILED
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command in ("recover", "undo"):
+        try:
+            return recover_batches(args) if args.command == "recover" else undo_last_batch(args)
+        except (UsageError, OSError, ValueError, KeyError) as e:
+            print(json.dumps({"ok": False, "error": str(e)}, ensure_ascii=False))
+            return EXIT_USAGE
+    if args.command != "run":
+        parser.print_help()
+        return EXIT_USAGE
+
+    metrics_path = args.metrics or metrics_export_path()
+    if metrics_path:
+        METRICS.enabled = True
+
+    try:
+        report, planned = run_batch(args)
+    except (UsageError, OSError, ValueError, sqlite3.Error) as e:
+        print(json.dumps({"ok": False, "error": str(e)}, ensure_ascii=False))
+        return EXIT_USAGE
+
+    summary = {
+        "ok": not report.failures,
+        "action": report.action_name,
+        "elapsed": round(report.elapsed, 3),
+        "counts": report.counts(),
+        "groups": report.groups,
+        "failures": [result.as_dict() for result in report.failures],
+    }
+    if planned is not None:
+        summary["dry_run"] = True
+        summary["planned"] = planned
+    if args.report:
+        report.export_json(args.report)
+    if metrics_path:
+        METRICS.export_json(metrics_path)
+    print(json.dumps(summary, ensure_ascii=False))
+    return EXIT_OK if summary["ok"] else EXIT_FAILED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
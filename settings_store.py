@@ -0,0 +1,99 @@
+"""
+設定ファイル（file_manager_settings.json）の読み書き
+
+変数が変わるたびに書き込むのではなく、変更済みの印を付けておき
+一定時間後にまとめて一度だけ保存する。保存は一時ファイル＋リネームで行う。
+"""
+import json
+import os
+import sys
+import tempfile
+
+SETTINGS_FILENAME = 'file_manager_settings.json'
+
+
+def get_application_path():
+    """実行ファイル（またはスクリプト）のディレクトリを返す"""
+    if getattr(sys, 'frozen', False):
+        # PyInstallerで実行される場合
+        return os.path.dirname(sys.executable)
+    # 通常のPythonスクリプトとして実行される場合
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def get_settings_path():
+    return os.path.join(get_application_path(), SETTINGS_FILENAME)
+
+
+def write_json_atomic(path, data):
+    """一時ファイルに書き込んでから置き換える（途中で落ちても元のファイルは壊れない）"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_settings_file(path=None):
+    """設定ファイルを読み込む。存在しない場合は None を返す"""
+    path = path or get_settings_path()
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class SettingsPersistence:
+    """
+    設定保存のまとめ役
+
+    collect: 保存する設定の辞書を返す関数
+    schedule / cancel: root.after / root.after_cancel に相当する関数
+    on_error: 遅延保存中に発生した例外を受け取る関数
+    """
+
+    def __init__(self, collect, schedule, cancel, path=None, delay_ms=500, on_error=None):
+        self.collect = collect
+        self.schedule = schedule
+        self.cancel = cancel
+        self.path = path or get_settings_path()
+        self.delay_ms = delay_ms
+        self.on_error = on_error
+        self.dirty = False
+        self._after_id = None
+
+    def mark_dirty(self):
+        """変更済みの印を付け、最後の変更から delay_ms 後に保存する"""
+        self.dirty = True
+        if self._after_id is not None:
+            self.cancel(self._after_id)
+        self._after_id = self.schedule(self.delay_ms, self._on_timer)
+
+    def _on_timer(self):
+        self._after_id = None
+        try:
+            self.flush()
+        except Exception as e:
+            if self.on_error is None:
+                raise
+            self.on_error(e)
+
+    def flush(self, force=False):
+        """未保存の変更があれば今すぐ保存する。保存した場合は True を返す"""
+        if self._after_id is not None:
+            self.cancel(self._after_id)
+            self._after_id = None
+        if not (self.dirty or force):
+            return False
+        write_json_atomic(self.path, self.collect())
+        self.dirty = False
+        return True
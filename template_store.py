@@ -0,0 +1,131 @@
+"""
+テンプレートの保存（file_manager_templates.db）
+
+テンプレートは1件ずつSQLiteに保存する。保存・削除のたびに全件を書き直さず、
+変更したテンプレートの行だけを書き込む。名前は大文字小文字を区別しない索引を持ち、
+入力中の文字列に一致する名前だけを取り出せる。
+"""
+import json
+import os
+import sqlite3
+
+from settings_store import get_application_path
+
+TEMPLATES_FILENAME = 'file_manager_templates.db'
+
+KIND_FILENAME = 'filename'
+KIND_DESTINATION = 'destination'
+
+# 以前の設定ファイルでテンプレートを保存していたキー
+SETTINGS_TEMPLATE_KEYS = {
+    KIND_FILENAME: 'filename_templates',
+    KIND_DESTINATION: 'dest_templates',
+}
+
+# 前方一致の範囲検索で使う上限（UTF-8で最大のコードポイント）
+_KEY_UPPER_BOUND = '\U0010ffff'
+
+
+def get_templates_path():
+    return os.path.join(get_application_path(), TEMPLATES_FILENAME)
+
+
+def name_key(name):
+    """検索用のキー（大文字小文字を区別しない）"""
+    return name.casefold()
+
+
+class TemplateStore:
+    """
+    種類（KIND_FILENAME / KIND_DESTINATION）ごとのテンプレート
+
+    値はJSONにして保存する。names / matching は登録順ではなく名前順で返す。
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_templates_path()
+        self.conn = sqlite3.connect(self.path)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS templates ("
+                " id INTEGER PRIMARY KEY,"
+                " kind TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " name_key TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " UNIQUE (kind, name))")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS templates_name_key ON templates (kind, name_key)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, kind, name):
+        """テンプレートを返す。存在しない場合は None"""
+        row = self.conn.execute("SELECT data FROM templates WHERE kind = ? AND name = ?", (kind, name)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, kind, name, data):
+        """1件だけ保存する（同じ名前があれば上書きし、登録順は変えない）"""
+        data = json.dumps(data, ensure_ascii=False)
+        with self.conn:
+            cursor = self.conn.execute("UPDATE templates SET data = ? WHERE kind = ? AND name = ?", (data, kind, name))
+            if cursor.rowcount == 0:
+                self.conn.execute("INSERT INTO templates (kind, name, name_key, data) VALUES (?, ?, ?, ?)",
+                                  (kind, name, name_key(name), data))
+
+    def delete(self, kind, name):
+        """削除した場合は True を返す"""
+        with self.conn:
+            cursor = self.conn.execute("DELETE FROM templates WHERE kind = ? AND name = ?", (kind, name))
+        return cursor.rowcount > 0
+
+    def count(self, kind):
+        return self.conn.execute("SELECT COUNT(*) FROM templates WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def first(self, kind):
+        """最初に登録されたテンプレートの (名前, 値) を返す。なければ None"""
+        row = self.conn.execute("SELECT name, data FROM templates WHERE kind = ? ORDER BY id LIMIT 1", (kind,)).fetchone()
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def names(self, kind, limit=None):
+        return self.matching(kind, "", limit)
+
+    def matching(self, kind, text, limit=None):
+        """
+        text に一致する名前を返す（大文字小文字は区別しない）
+
+        前方一致を索引で先に取り出し、足りない分を部分一致で補う。
+        """
+        key = name_key(text)
+        limit = -1 if limit is None else limit
+        names = [row[0] for row in self.conn.execute(
+            "SELECT name FROM templates WHERE kind = ? AND name_key >= ? AND name_key < ?"
+            " ORDER BY name_key LIMIT ?", (kind, key, key + _KEY_UPPER_BOUND, limit))]
+        if key and (limit < 0 or len(names) < limit):
+            remaining = -1 if limit < 0 else limit - len(names)
+            names.extend(row[0] for row in self.conn.execute(
+                "SELECT name FROM templates WHERE kind = ? AND instr(name_key, ?) > 1"
+                " ORDER BY name_key LIMIT ?", (kind, key, remaining)))
+        return names
+
+    def migrate_settings(self, settings):
+        """
+        以前の設定ファイルに保存されていたテンプレートを一度だけ取り込む
+
+        取り込んだ場合は True を返す。
+        """
+        if not settings or self._get_meta('migrated_settings') is not None:
+            return False
+        with self.conn:
+            for kind, key in SETTINGS_TEMPLATE_KEYS.items():
+                for name, data in (settings.get(key) or {}).items():
+                    self.conn.execute(
+                        "INSERT OR IGNORE INTO templates (kind, name, name_key, data) VALUES (?, ?, ?, ?)",
+                        (kind, name, name_key(name), json.dumps(data, ensure_ascii=False)))
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_settings', '1')")
+        return True
+
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
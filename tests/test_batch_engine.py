@@ -0,0 +1,807 @@
+"""
+batch_engine の計画・衝突解決・実行順のテスト（Tk は使わない）
+"""
+import errno
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import batch_engine
+
+from batch_engine import (
+    CONFLICT_ASK, CONFLICT_NEWER, CONFLICT_OVERWRITE, CONFLICT_RENAME, CONFLICT_SKIP, MOVE_COPY, MOVE_RENAME,
+    STATUS_SUCCESS,
+    BatchJob, BatchReport, DestinationIndex, DeviceScheduler, FileSelection, FilenameFormatter, MoveChain, PlanEntry,
+    PreflightScan, RenamePlan,
+    copy_across_devices, copy_file_data, execute_entry, iter_files, iter_ingest_paths, move_file, move_strategy,
+    order_moves, parse_device_limits, parse_glob_patterns, resolve_conflicts, tokenize_pattern
+)
+
+NOW = datetime(2024, 5, 6, 7, 8, 9)
+
+
+class FilenameFormatterTest(unittest.TestCase):
+    def test_tokenize_pattern(self):
+        self.assertEqual(tokenize_pattern("IMG_{date}-{seq}{text}.bak"), (
+            ("literal", "IMG_"), ("date", None), ("literal", "-"), ("seq", None), ("text", None),
+            ("literal", ".bak")))
+        self.assertEqual(tokenize_pattern(""), ())
+        self.assertEqual(tokenize_pattern("{unknown}"), (("literal", "{unknown}"),))
+
+    def test_constant_parts_are_folded(self):
+        formatter = FilenameFormatter("{date}_{text}_{seq}_end", custom_text="旅行", now=NOW)
+        # 日付とテキストは作成時に固定文字列になり、連番の位置だけが残る
+        self.assertEqual(formatter._chunks, ["20240506_旅行_", "_end"])
+        self.assertEqual(formatter.format(7), "20240506_旅行_0007_end")
+
+    def test_several_sequence_placeholders(self):
+        formatter = FilenameFormatter("{seq}-{seq}", sequence_digits=2)
+        self.assertEqual(formatter.format(3), "03-03")
+
+    def test_pattern_without_sequence(self):
+        # 連番を使わないパターンでは桁数を解釈しない
+        formatter = FilenameFormatter("{date}{text}", sequence_digits="", custom_text="x", now=NOW)
+        self.assertFalse(formatter.has_seq)
+        self.assertEqual(formatter.format(1), "20240506x")
+        self.assertEqual(formatter.format(2), "20240506x")
+
+    def test_text_is_not_expanded(self):
+        formatter = FilenameFormatter("{text}_{seq}", custom_text="{date}{seq}", now=NOW)
+        self.assertEqual(formatter.format(1), "{date}{seq}_0001")
+
+    def test_date_is_taken_once(self):
+        formatter = FilenameFormatter("{date}")
+        self.assertEqual(formatter.format(), formatter.now.strftime("%Y%m%d"))
+
+
+class RenamePlanTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = os.path.abspath("photos")
+        self.sources = [os.path.join(self.dir, name) for name in ("b.jpg", "a.JPG", "c")]
+
+    def plan(self, **options):
+        options.setdefault("pattern", "{date}_{text}_{seq}")
+        options.setdefault("custom_text", "旅行")
+        options.setdefault("now", NOW)
+        return RenamePlan(self.sources, **options)
+
+    def test_rename_in_place(self):
+        plan = self.plan()
+        self.assertEqual([entry.filename for entry in plan],
+                         ["20240506_旅行_0001.jpg", "20240506_旅行_0002.JPG", "20240506_旅行_0003"])
+        self.assertEqual([entry.destination for entry in plan],
+                         [os.path.join(self.dir, entry.filename) for entry in plan])
+        self.assertEqual([entry.index for entry in plan], [0, 1, 2])
+        self.assertEqual(len(plan), 3)
+
+    def test_start_seq_and_digits(self):
+        plan = self.plan(pattern="IMG{seq}", start_seq="98", sequence_digits=3)
+        self.assertEqual([entry.filename for entry in plan], ["IMG098.jpg", "IMG099.JPG", "IMG100"])
+
+    def test_single_digit_is_not_padded(self):
+        plan = self.plan(pattern="{seq}", start_seq=9, sequence_digits=1)
+        self.assertEqual([entry.filename for entry in plan], ["9.jpg", "10.JPG", "11"])
+
+    def test_date_format(self):
+        plan = self.plan(pattern="{date}", date_format="%Y-%m-%d %H%M")
+        self.assertEqual(plan.entries[0].filename, "2024-05-06 0708.jpg")
+
+    def test_rename_and_move(self):
+        dest_dir = os.path.abspath("sorted")
+        plan = self.plan(pattern="{seq}", dest_dir=dest_dir)
+        self.assertEqual(plan.entries[0].destination, os.path.join(dest_dir, "0001.jpg"))
+
+    def test_move_keeps_filename(self):
+        dest_dir = os.path.abspath("sorted")
+        plan = self.plan(dest_dir=dest_dir, rename=False)
+        self.assertEqual([entry.filename for entry in plan], ["b.jpg", "a.JPG", "c"])
+        self.assertEqual(plan.mapping(), {source: os.path.join(dest_dir, os.path.basename(source))
+                                          for source in self.sources})
+
+    def test_move_does_not_parse_start_seq(self):
+        # 移動のみ・連番のないパターンでは、連番の欄が空でも計画を作れる
+        plan = self.plan(dest_dir=os.path.abspath("sorted"), rename=False, start_seq="", sequence_digits="")
+        self.assertIsNone(plan.start_seq)
+        self.assertEqual(plan.entries[0].filename, "b.jpg")
+        plan = self.plan(pattern="{date}", start_seq="x")
+        self.assertIsNone(plan.start_seq)
+        self.assertEqual(plan.entries[0].filename, "20240506.jpg")
+
+    def test_invalid_start_seq(self):
+        with self.assertRaises(ValueError):
+            self.plan(start_seq="x")
+
+    def test_plan_shares_one_formatter(self):
+        plan = self.plan()
+        self.assertEqual(plan.formatter.now, NOW)
+        self.assertIsNone(self.plan(rename=False).formatter)
+
+    def test_paths_are_absolute_and_normalized(self):
+        plan = RenamePlan([os.path.join("photos", "sub", "..", "b.jpg")], pattern="x", now=NOW)
+        self.assertEqual(plan.entries[0].source, os.path.join(self.dir, "b.jpg"))
+        self.assertEqual(plan.entries[0].destination, os.path.join(self.dir, "x.jpg"))
+
+
+class FileSelectionTest(unittest.TestCase):
+    def setUp(self):
+        self.paths = [os.path.join("dir", f"f{i}.txt") for i in range(6)]
+        self.selection = FileSelection(self.paths)
+
+    def test_keeps_order_without_duplicates(self):
+        self.assertEqual(self.selection.extend([self.paths[1], os.path.join("dir", ".", "f2.txt"), "new.txt"]), 1)
+        self.assertFalse(self.selection.add(os.path.join("dir", "sub", "..", "f0.txt")))
+        self.assertEqual(list(self.selection), self.paths + ["new.txt"])
+        self.assertEqual(len(self.selection), 7)
+        self.assertIn(os.path.join("dir", ".", "f3.txt"), self.selection)
+
+    @unittest.skipUnless(os.path.normcase("A") == "a", "大文字小文字を区別しないファイルシステムのみ")
+    def test_case_and_separator_are_ignored(self):
+        self.assertFalse(self.selection.add("DIR/F1.TXT"))
+
+    def test_remove(self):
+        self.assertTrue(self.selection.remove(self.paths[2]))
+        self.assertFalse(self.selection.remove(self.paths[2]))
+        self.assertNotIn(self.paths[2], self.selection)
+        self.assertEqual(len(self.selection), 5)
+        self.assertEqual(list(self.selection), self.paths[:2] + self.paths[3:])
+        # 削除したファイルは追加し直すと最後に並ぶ
+        self.assertTrue(self.selection.add(self.paths[2]))
+        self.assertEqual(self.selection[-1], self.paths[2])
+
+    def test_positions_are_compacted_after_remove(self):
+        self.selection.remove(self.paths[0])
+        self.selection.remove(self.paths[3])
+        self.assertEqual(self.selection.index(self.paths[4]), 2)
+        self.assertEqual(self.selection[0], self.paths[1])
+        self.assertEqual([self.selection[i] for i in range(len(self.selection))],
+                         [self.paths[1], self.paths[2], self.paths[4], self.paths[5]])
+
+    def test_remove_indices(self):
+        self.selection.remove(self.paths[0])
+        # 表示上の位置（削除済みのファイルを詰めた位置）で指定する
+        self.selection.remove_indices([0, 2])
+        self.assertEqual(list(self.selection), [self.paths[2], self.paths[4], self.paths[5]])
+        self.assertEqual(self.selection.index(self.paths[5]), 2)
+
+    def test_clear(self):
+        self.selection.remove(self.paths[0])
+        self.selection.clear()
+        self.assertEqual(len(self.selection), 0)
+        self.assertEqual(list(self.selection), [])
+        self.assertTrue(self.selection.add(self.paths[0]))
+
+    def test_replace_path(self):
+        self.selection.remove(self.paths[0])
+        self.selection[1] = "moved.txt"
+        self.assertEqual(list(self.selection), [self.paths[1], "moved.txt"] + self.paths[3:])
+        self.assertNotIn(self.paths[2], self.selection)
+        self.assertEqual(self.selection.index("moved.txt"), 1)
+        self.assertEqual(len(self.selection), 5)
+
+    def test_replace_with_same_path(self):
+        # 同じファイルを別の書き方にするだけなら置き換えられる
+        self.selection[2] = os.path.join("dir", ".", "f2.txt")
+        self.selection[-1] = "last.txt"
+        self.assertEqual(list(self.selection),
+                         self.paths[:2] + [os.path.join("dir", ".", "f2.txt")] + self.paths[3:5] + ["last.txt"])
+        self.assertEqual(self.selection.index("last.txt"), 5)
+
+    def test_replace_with_path_of_other_file(self):
+        with self.assertRaises(ValueError):
+            self.selection[0] = os.path.join("dir", "sub", "..", "f3.txt")
+        # 一覧は変わらず、どちらのファイルも元の位置のまま
+        self.assertEqual(list(self.selection), self.paths)
+        self.assertEqual(self.selection.index(self.paths[0]), 0)
+        self.assertEqual(self.selection.index(self.paths[3]), 3)
+        self.selection.remove(self.paths[3])
+        self.assertEqual(len(self.selection), 5)
+        self.assertNotIn(self.paths[3], self.selection)
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def write(self, name, content=None, mtime=None):
+        with open(self.path(name), "w", encoding="utf-8") as f:
+            f.write(name if content is None else content)
+        if mtime is not None:
+            os.utime(self.path(name), (mtime, mtime))
+
+    def read(self, name):
+        with open(self.path(name), encoding="utf-8") as f:
+            return f.read()
+
+    def listdir(self):
+        return sorted(os.listdir(self.dir))
+
+    def plan(self, *moves):
+        """(移動元の名前, 保存先の名前) の組から計画を作る"""
+        return [PlanEntry(i, self.path(source), self.path(destination), destination)
+                for i, (source, destination) in enumerate(moves)]
+
+    def resolve(self, entries, policy):
+        index = DestinationIndex(PreflightScan(entry.source for entry in entries))
+        return resolve_conflicts(entries, policy, index)
+
+    def execute(self, resolution, workers=4):
+        """GUI・CLIと同じく order_moves の単位を BatchJob で実行し、結果の一覧を返す"""
+        units = order_moves(resolution.entries, resolution.index)
+        job = BatchJob(units, lambda entry: execute_entry(entry, resolution.index), max_workers=workers).start()
+        results = []
+        while True:
+            kind, result = job.events.get(timeout=10)
+            if kind == "finished":
+                return results
+            results.append(result)
+
+    def assertAllSucceeded(self, results, count):
+        self.assertEqual(len(results), count)
+        self.assertEqual([result.error for result in results if result.status != STATUS_SUCCESS], [])
+
+    @staticmethod
+    def indices(entries):
+        return sorted(entry.index for entry in entries)
+
+
+class IterFilesTest(BatchTestCase):
+    def setUp(self):
+        super().setUp()
+        for name in ("b.jpg", "a.mp4", "z.txt", os.path.join("sub", "c.jpg"), os.path.join("sub", "deep", "d.jpg"),
+                     os.path.join("skip", "e.jpg"), os.path.join("another", "f.JPG")):
+            os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+            self.write(name)
+
+    def names(self, paths):
+        return [os.path.relpath(path, self.dir) for path in paths]
+
+    def test_files_first_then_subfolders_in_name_order(self):
+        self.assertEqual(self.names(iter_files(self.dir)), [
+            "a.mp4", "b.jpg", "z.txt", os.path.join("another", "f.JPG"), os.path.join("skip", "e.jpg"),
+            os.path.join("sub", "c.jpg"), os.path.join("sub", "deep", "d.jpg")])
+
+    def test_max_depth(self):
+        self.assertEqual(self.names(iter_files(self.dir, max_depth=0)), ["a.mp4", "b.jpg", "z.txt"])
+        self.assertEqual(self.names(iter_files(self.dir, max_depth=1)), [
+            "a.mp4", "b.jpg", "z.txt", os.path.join("another", "f.JPG"), os.path.join("skip", "e.jpg"),
+            os.path.join("sub", "c.jpg")])
+
+    def test_include_and_exclude(self):
+        include = parse_glob_patterns("*.jpg; *.JPG")
+        exclude = parse_glob_patterns("skip, deep")
+        self.assertEqual(include, ["*.jpg", "*.JPG"])
+        self.assertEqual(self.names(iter_files(self.dir, include=include, exclude=exclude)), [
+            "b.jpg", os.path.join("another", "f.JPG"), os.path.join("sub", "c.jpg")])
+        self.assertEqual(self.names(iter_files(self.dir, max_depth=0, exclude=["*.mp4", "*.txt"])), ["b.jpg"])
+
+    def test_empty_patterns(self):
+        self.assertEqual(parse_glob_patterns(""), [])
+        self.assertEqual(parse_glob_patterns(None), [])
+        self.assertEqual(parse_glob_patterns(" ; ,"), [])
+
+    def test_missing_folder(self):
+        self.assertEqual(list(iter_files(self.path("nothing"))), [])
+
+    def test_ingest_paths(self):
+        paths = [self.path("z.txt"), self.path("sub")]
+        self.assertEqual(self.names(iter_ingest_paths(paths, max_depth=0)), ["z.txt", os.path.join("sub", "c.jpg")])
+
+
+class OrderMovesTest(BatchTestCase):
+    def test_independent_entries_stay_separate(self):
+        entries = self.plan(("a", "x"), ("b", "y"))
+        self.assertEqual(order_moves(entries), entries)
+
+    def test_swap_is_a_cycle_with_one_parked_entry(self):
+        entries = self.plan(("a", "b"), ("b", "a"))
+        units = order_moves(entries)
+        self.assertEqual(len(units), 1)
+        chain = units[0]
+        self.assertIsInstance(chain, MoveChain)
+        self.assertEqual(len(chain), 2)
+        self.assertIs(chain.entries[-1], chain.parked)
+        self.assertEqual(os.path.dirname(chain.parked.staged_source), self.dir)
+
+    def test_shift_runs_from_the_free_end(self):
+        entries = self.plan(("f1", "f2"), ("f2", "f3"), ("f3", "f4"))
+        units = order_moves(entries)
+        self.assertEqual(len(units), 1)
+        self.assertIsNone(units[0].parked)
+        self.assertEqual([entry.index for entry in units[0]], [2, 1, 0])
+
+    def test_duplicate_destinations_run_in_plan_order(self):
+        entries = self.plan(("a", "same"), ("b", "same"), ("c", "same"), ("d", "other"))
+        units = order_moves(entries)
+        chains = [unit for unit in units if isinstance(unit, MoveChain)]
+        self.assertEqual(len(chains), 1)
+        self.assertEqual([entry.index for entry in chains[0]], [0, 1, 2])
+        self.assertIn(entries[3], units)
+
+    def test_swap_executes(self):
+        self.write("a")
+        self.write("b")
+        results = self.execute(self.resolve(self.plan(("a", "b"), ("b", "a")), CONFLICT_SKIP))
+        self.assertAllSucceeded(results, 2)
+        self.assertEqual(self.read("a"), "b")
+        self.assertEqual(self.read("b"), "a")
+        self.assertEqual(self.listdir(), ["a", "b"])
+
+    def test_rotation_executes(self):
+        for name in ("a", "b", "c"):
+            self.write(name)
+        resolution = self.resolve(self.plan(("a", "b"), ("b", "c"), ("c", "a")), CONFLICT_SKIP)
+        self.assertEqual(resolution.unresolved + resolution.skipped, [])
+        self.assertAllSucceeded(self.execute(resolution), 3)
+        self.assertEqual([self.read(name) for name in ("a", "b", "c")], ["c", "a", "b"])
+        self.assertEqual(self.listdir(), ["a", "b", "c"])
+
+    def test_renumbering_shift_executes(self):
+        for i in range(1, 51):
+            self.write(f"{i:03d}")
+        entries = self.plan(*[(f"{i:03d}", f"{i + 1:03d}") for i in range(1, 51)])
+        resolution = self.resolve(entries, CONFLICT_SKIP)
+        self.assertEqual(len(resolution.entries), 50)
+        self.assertAllSucceeded(self.execute(resolution), 50)
+        self.assertEqual(self.listdir(), [f"{i:03d}" for i in range(2, 52)])
+        self.assertEqual(self.read("051"), "050")
+
+    def run_failing_chain(self, fail_at):
+        units = order_moves(self.plan(("a", "b"), ("b", "a")))
+        calls = []
+
+        def operation(entry):
+            calls.append(entry)
+            if len(calls) == fail_at:
+                raise OSError("失敗")
+            os.rename(entry.current_source, entry.destination)
+
+        results = list(units[0].execute(operation))
+        return units[0], [result.status == STATUS_SUCCESS for result in results]
+
+    def test_failure_in_cycle_restores_parked_file(self):
+        self.write("a")
+        self.write("b")
+        _, statuses = self.run_failing_chain(fail_at=1)
+        self.assertEqual(statuses, [False, False])
+        # 一時的な名前に移したファイルは元の場所に戻る
+        self.assertEqual(self.listdir(), ["a", "b"])
+        self.assertEqual(self.read("a"), "a")
+
+    def test_failure_of_parked_entry_keeps_staged_file(self):
+        self.write("a")
+        self.write("b")
+        chain, statuses = self.run_failing_chain(fail_at=2)
+        self.assertEqual(statuses, [True, False])
+        # 元の場所は別のファイルで埋まっているので、一時的な名前のまま残す
+        self.assertEqual(self.listdir(), sorted(["a", os.path.basename(chain.parked.staged_source)]))
+
+
+class ResolveConflictsTest(BatchTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write("a", mtime=1000)
+        self.write("b", mtime=3000)
+        self.write("x", "既存", mtime=2000)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            self.resolve(self.plan(("a", "x")), "merge")
+
+    def test_no_conflict(self):
+        for policy in (CONFLICT_ASK, CONFLICT_SKIP, CONFLICT_OVERWRITE, CONFLICT_RENAME, CONFLICT_NEWER):
+            resolution = self.resolve(self.plan(("a", "y"), ("b", "b")), policy)
+            self.assertEqual(self.indices(resolution.entries), [0, 1])
+            self.assertEqual(resolution.skipped + resolution.unresolved + resolution.renamed, [])
+
+    def test_skip(self):
+        resolution = self.resolve(self.plan(("a", "x"), ("b", "y")), CONFLICT_SKIP)
+        self.assertEqual(self.indices(resolution.entries), [1])
+        self.assertEqual(self.indices(resolution.skipped), [0])
+
+    def test_missing_source(self):
+        resolution = self.resolve(self.plan(("a", "y"), ("nothing", "z")), CONFLICT_SKIP)
+        self.assertEqual(self.indices(resolution.missing), [1])
+        self.assertEqual(self.indices(resolution.entries), [0])
+
+    def test_overwrite(self):
+        resolution = self.resolve(self.plan(("a", "x")), CONFLICT_OVERWRITE)
+        self.assertEqual(self.indices(resolution.entries), [0])
+        self.assertTrue(resolution.entries[0].overwrite)
+        self.assertEqual(resolution.skipped, [])
+
+    def test_newer(self):
+        resolution = self.resolve(self.plan(("a", "x"), ("b", "y")), CONFLICT_NEWER)
+        self.assertEqual(self.indices(resolution.skipped), [0])
+        resolution = self.resolve(self.plan(("b", "x")), CONFLICT_NEWER)
+        self.assertEqual(self.indices(resolution.entries), [0])
+
+    def test_ask(self):
+        resolution = self.resolve(self.plan(("a", "x"), ("b", "y")), CONFLICT_ASK)
+        self.assertEqual(self.indices(resolution.entries), [1])
+        self.assertEqual(self.indices(resolution.unresolved), [0])
+
+    def test_ask_then_approve(self):
+        resolution = self.resolve(self.plan(("a", "x"), ("b", "y")), CONFLICT_ASK)
+        resolution.approve_unresolved()
+        self.assertEqual([entry.index for entry in resolution.entries], [0, 1])
+        self.assertTrue(resolution.entries[0].overwrite)
+        self.assertEqual(resolution.unresolved, [])
+
+    def test_ask_then_skip(self):
+        resolution = self.resolve(self.plan(("a", "x"), ("b", "y")), CONFLICT_ASK)
+        resolution.skip_unresolved()
+        self.assertEqual(self.indices(resolution.entries), [1])
+        self.assertEqual(self.indices(resolution.skipped), [0])
+
+    def test_rename(self):
+        self.write("x_1")
+        resolution = self.resolve(self.plan(("a", "x")), CONFLICT_RENAME)
+        self.assertEqual([entry.filename for entry in resolution.entries], ["x_2"])
+        self.assertEqual(resolution.entries[0].destination, self.path("x_2"))
+        self.assertEqual(self.indices(resolution.renamed), [0])
+
+    def test_rename_duplicates_in_batch(self):
+        resolution = self.resolve(self.plan(("a", "same.txt"), ("b", "same.txt"), ("x", "same.txt")),
+                                  CONFLICT_RENAME)
+        self.assertEqual([entry.filename for entry in resolution.entries], ["same.txt", "same_1.txt", "same_2.txt"])
+        self.assertEqual(self.indices(resolution.renamed), [1, 2])
+
+    def test_chain_into_vacated_source_is_not_a_conflict(self):
+        resolution = self.resolve(self.plan(("a", "b"), ("b", "c"), ("c", "d")), CONFLICT_SKIP)
+        self.assertEqual(self.indices(resolution.entries), [0, 1])
+        self.assertEqual(self.indices(resolution.missing), [2])
+        resolution = self.resolve(self.plan(("a", "b"), ("b", "a")), CONFLICT_SKIP)
+        self.assertEqual(self.indices(resolution.entries), [0, 1])
+
+    def test_chain_is_skipped_when_its_free_end_is_skipped(self):
+        # b→x は x が既にあるのでスキップされ、b が空かないので a→b もスキップする
+        resolution = self.resolve(self.plan(("a", "b"), ("b", "x")), CONFLICT_SKIP)
+        self.assertEqual(resolution.entries, [])
+        self.assertEqual(self.indices(resolution.skipped), [0, 1])
+
+    def test_skip_duplicates_in_batch(self):
+        resolution = self.resolve(self.plan(("a", "same"), ("b", "same")), CONFLICT_SKIP)
+        self.assertEqual(self.indices(resolution.entries), [0])
+        self.assertEqual(self.indices(resolution.skipped), [1])
+
+    def test_ask_duplicates_in_batch(self):
+        resolution = self.resolve(self.plan(("a", "same"), ("b", "same")), CONFLICT_ASK)
+        self.assertEqual(self.indices(resolution.entries), [0])
+        self.assertEqual(self.indices(resolution.unresolved), [1])
+
+    def duplicates(self):
+        return self.plan(("a", "same"), ("b", "same"), ("x", "same"))
+
+    def test_overwrite_keeps_last_duplicate(self):
+        resolution = self.resolve(self.duplicates(), CONFLICT_OVERWRITE)
+        self.assertEqual(self.indices(resolution.entries), [2])
+        self.assertEqual(self.indices(resolution.skipped), [0, 1])
+        self.assertAllSucceeded(self.execute(resolution), 1)
+        self.assertEqual(self.read("same"), "既存")
+        self.assertEqual(self.listdir(), ["a", "b", "same"])
+
+    def test_newer_keeps_newest_duplicate(self):
+        # b（mtime 3000）が a・x より新しい
+        resolution = self.resolve(self.duplicates(), CONFLICT_NEWER)
+        self.assertEqual(self.indices(resolution.entries), [1])
+        self.assertEqual(self.indices(resolution.skipped), [0, 2])
+        self.assertAllSucceeded(self.execute(resolution), 1)
+        self.assertEqual(self.read("same"), "b")
+
+    def test_skip_keeps_first_duplicate(self):
+        resolution = self.resolve(self.duplicates(), CONFLICT_SKIP)
+        self.assertAllSucceeded(self.execute(resolution), 1)
+        self.assertEqual(self.read("same"), "a")
+        self.assertEqual(self.listdir(), ["b", "same", "x"])
+
+    def test_ask_then_approve_keeps_last_duplicate(self):
+        resolution = self.resolve(self.duplicates(), CONFLICT_ASK)
+        self.assertEqual(self.indices(resolution.unresolved), [1, 2])
+        resolution.approve_unresolved()
+        self.assertEqual(self.indices(resolution.entries), [2])
+        self.assertEqual(self.indices(resolution.skipped), [0, 1])
+        self.assertAllSucceeded(self.execute(resolution), 1)
+        self.assertEqual(self.read("same"), "既存")
+
+
+class ExecuteEntryTest(BatchTestCase):
+    def test_move_updates_index(self):
+        self.write("a")
+        entries = self.plan(("a", "b"))
+        index = DestinationIndex(PreflightScan(entry.source for entry in entries))
+        resolution = resolve_conflicts(entries, CONFLICT_SKIP, index)
+        execute_entry(resolution.entries[0], index)
+        self.assertEqual(self.listdir(), ["b"])
+        self.assertTrue(index.exists_on_disk(self.path("b")))
+        self.assertFalse(index.exists_on_disk(self.path("a")))
+
+    def test_does_not_overwrite_without_permission(self):
+        self.write("a")
+        self.write("b")
+        index = DestinationIndex(PreflightScan([self.path("a")]))
+        first, second = self.plan(("a", "c"), ("b", "c"))
+        execute_entry(first, index)
+        # 索引に反映済みの移動先には、上書きを許可していなければ移動しない
+        with self.assertRaises(FileExistsError):
+            execute_entry(second, index)
+        self.assertEqual(self.read("c"), "a")
+        second.overwrite = True
+        execute_entry(second, index)
+        self.assertEqual(self.listdir(), ["c"])
+        self.assertEqual(self.read("c"), "b")
+
+class MoveFileTest(BatchTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = os.urandom(300 * 1024)
+        with open(self.path("src.bin"), "wb") as f:
+            f.write(self.data)
+        os.utime(self.path("src.bin"), (1000000000, 1000000000))
+
+    def assertMoved(self, name="dst.bin"):
+        with open(self.path(name), "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(os.stat(self.path(name)).st_mtime, 1000000000)
+        self.assertEqual(self.listdir(), [name])
+
+    def assertNotMoved(self):
+        self.assertEqual(self.listdir(), ["src.bin"])
+
+    def test_move_strategy(self):
+        self.assertEqual(move_strategy(1, 1), MOVE_RENAME)
+        self.assertEqual(move_strategy(1, 2), MOVE_COPY)
+        self.assertEqual(move_strategy(None, 2), MOVE_RENAME)
+
+    def test_rename_on_same_device(self):
+        self.assertEqual(move_file(self.path("src.bin"), self.path("dst.bin")), MOVE_RENAME)
+        self.assertMoved()
+
+    def test_rename_overwrites_destination(self):
+        self.write("dst.bin")
+        self.assertEqual(move_file(self.path("src.bin"), self.path("dst.bin"), MOVE_RENAME), MOVE_RENAME)
+        self.assertMoved()
+
+    def test_falls_back_to_copy_on_exdev(self):
+        replace = os.replace
+
+        def cross_device(source, destination):
+            if source == self.path("src.bin"):
+                raise OSError(errno.EXDEV, "Invalid cross-device link")
+            replace(source, destination)
+
+        with mock.patch("batch_engine.os.replace", side_effect=cross_device):
+            self.assertEqual(move_file(self.path("src.bin"), self.path("dst.bin"), MOVE_RENAME), MOVE_COPY)
+        self.assertMoved()
+
+    def test_other_rename_errors_are_raised(self):
+        with self.assertRaises(FileNotFoundError):
+            move_file(self.path("nothing"), self.path("dst.bin"), MOVE_RENAME)
+        self.assertNotMoved()
+
+    def test_copy(self):
+        self.write("dst.bin", "既存")
+        self.assertEqual(move_file(self.path("src.bin"), self.path("dst.bin"), MOVE_COPY), MOVE_COPY)
+        self.assertMoved()
+
+    def test_copy_empty_file(self):
+        open(self.path("empty"), "wb").close()
+        copy_across_devices(self.path("empty"), self.path("copied"))
+        self.assertEqual(os.path.getsize(self.path("copied")), 0)
+        self.assertNotIn("empty", self.listdir())
+
+    def test_failed_copy_removes_temporary_file(self):
+        self.write("dst.bin", "既存")
+        with mock.patch("batch_engine.copy_file_data", side_effect=OSError(errno.ENOSPC, "No space left on device")):
+            with self.assertRaises(OSError):
+                copy_across_devices(self.path("src.bin"), self.path("dst.bin"))
+        # 移動元と既存の保存先はそのまま残り、一時ファイル（.fmpart）は残らない
+        self.assertEqual(self.listdir(), ["dst.bin", "src.bin"])
+        self.assertEqual(self.read("dst.bin"), "既存")
+
+    def test_short_copy_is_detected(self):
+        def short_copy(src, dst):
+            dst.write(src.read(1000))
+
+        with mock.patch("batch_engine.copy_file_data", side_effect=short_copy):
+            with self.assertRaises(OSError) as caught:
+                copy_across_devices(self.path("src.bin"), self.path("dst.bin"))
+        self.assertEqual(caught.exception.errno, errno.EIO)
+        self.assertNotMoved()
+
+    def test_interrupted_copy_removes_temporary_file(self):
+        with mock.patch("batch_engine.copy_file_data", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                copy_across_devices(self.path("src.bin"), self.path("dst.bin"))
+        self.assertNotMoved()
+
+    def copy_data(self):
+        with open(self.path("src.bin"), "rb") as src, open(self.path("dst.bin"), "wb") as dst:
+            copy_file_data(src, dst)
+        with open(self.path("dst.bin"), "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_copy_file_data(self):
+        self.copy_data()
+
+    def test_copy_file_data_falls_back_to_buffered_copy(self):
+        unsupported = OSError(errno.ENOSYS, "Function not implemented")
+        with mock.patch.object(batch_engine.os, "copy_file_range", side_effect=unsupported, create=True), \
+                mock.patch.object(batch_engine.os, "sendfile", side_effect=unsupported, create=True):
+            self.copy_data()
+
+    def test_copy_file_data_raises_other_errors(self):
+        with mock.patch.object(batch_engine.os, "copy_file_range", side_effect=OSError(errno.EIO, "I/O error"),
+                               create=True):
+            with self.assertRaises(OSError):
+                self.copy_data()
+
+
+class DeviceSchedulerTest(unittest.TestCase):
+    # フォルダ名をそのままデバイスとみなす
+    @staticmethod
+    def key_of(unit):
+        entry = unit.entries[0] if isinstance(unit, MoveChain) else unit
+        return (os.path.dirname(entry.current_source), os.path.dirname(entry.destination))
+
+    def units(self, *moves):
+        """(移動元のデバイス, 保存先のデバイス) の組から実行単位を作る"""
+        return [PlanEntry(i, f"{source}/{i}.jpg", f"{dest}/{i}.jpg", f"{i}.jpg")
+                for i, (source, dest) in enumerate(moves)]
+
+    def scheduler(self, units, default_limit=1, limits=None):
+        scheduler = DeviceScheduler(self.key_of, default_limit, limits)
+        scheduler.add(units)
+        return scheduler
+
+    def acquire_later(self, scheduler):
+        """別のスレッドで acquire し、(スレッド, 結果のリスト) を返す"""
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(scheduler.acquire()))
+        thread.start()
+        return thread, acquired
+
+    def test_parse_device_limits(self):
+        self.assertEqual(parse_device_limits("E:\\=1; \\\\nas\\share=2\n/mnt/a=b=3;"),
+                         {"E:\\": 1, "\\\\nas\\share": 2, "/mnt/a=b": 3})
+        self.assertEqual(parse_device_limits(""), {})
+        self.assertEqual(parse_device_limits(None), {})
+        for text in ("E:\\", "=2", "E:\\=0", "E:\\=x", "E:\\=-1"):
+            with self.assertRaises(ValueError):
+                parse_device_limits(text)
+
+    def test_groups_by_device_pair(self):
+        scheduler = self.scheduler(self.units(("card1", "ssd"), ("card2", "ssd"), ("card1", "ssd")))
+        self.assertEqual([(group.key, group.total) for group in scheduler.groups],
+                         [(("card1", "ssd"), 2), (("card2", "ssd"), 1)])
+
+    def test_groups_take_turns(self):
+        units = self.units(("card1", "ssd"), ("card1", "ssd"), ("card2", "ssd"), ("card2", "ssd"))
+        scheduler = self.scheduler(units, default_limit=4)
+        order = []
+        for _ in units:
+            unit = scheduler.acquire()
+            order.append(unit.index)
+            scheduler.release(unit)
+        self.assertEqual(order, [0, 2, 1, 3])
+        self.assertIsNone(scheduler.acquire())
+
+    def test_device_limit(self):
+        units = self.units(("card1", "ssd"), ("card2", "ssd"), ("card3", "ssd"))
+        scheduler = self.scheduler(units, default_limit=1, limits={"ssd": 2})
+        first, second = scheduler.acquire(), scheduler.acquire()
+        self.assertEqual((first.index, second.index), (0, 1))
+        # ssd の上限（2）に達しているので、空くまで待つ
+        thread, acquired = self.acquire_later(scheduler)
+        thread.join(0.3)
+        self.assertEqual(acquired, [])
+        scheduler.release(first)
+        thread.join(5)
+        self.assertEqual([unit.index for unit in acquired], [2])
+
+    def test_skips_groups_on_busy_devices(self):
+        units = self.units(("card1", "hdd"), ("card1", "hdd"), ("card2", "ssd"))
+        scheduler = self.scheduler(units, default_limit=2, limits={"hdd": 1})
+        self.assertEqual(scheduler.acquire().index, 0)
+        # hdd は使用中なので card2 -> ssd のグループを先に実行する
+        self.assertEqual(scheduler.acquire().index, 2)
+
+    def test_move_within_one_device_counts_once(self):
+        scheduler = self.scheduler(self.units(("hdd", "hdd"), ("hdd", "hdd")), default_limit=1)
+        self.assertEqual(scheduler.worker_count(), 1)
+        unit = scheduler.acquire()
+        self.assertEqual(unit.index, 0)
+        thread, acquired = self.acquire_later(scheduler)
+        thread.join(0.3)
+        self.assertEqual(acquired, [])
+        scheduler.release(unit)
+        thread.join(5)
+        self.assertEqual([unit.index for unit in acquired], [1])
+
+    def test_worker_count(self):
+        units = self.units(("card1", "ssd"), ("card2", "ssd"), ("card3", "hdd"))
+        self.assertEqual(self.scheduler(units, default_limit=1).worker_count(), 5)
+        self.assertEqual(self.scheduler(units, default_limit=2, limits={"ssd": 4}).worker_count(), 12)
+        self.assertEqual(self.scheduler(units, default_limit=100).worker_count(), 32)
+        self.assertEqual(self.scheduler([]).worker_count(), 1)
+
+    def test_cancel_stops_waiting(self):
+        scheduler = self.scheduler(self.units(("hdd", "hdd"), ("hdd", "hdd")))
+        scheduler.acquire()
+        cancel_event = threading.Event()
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(scheduler.acquire(cancel_event)))
+        thread.start()
+        cancel_event.set()
+        thread.join(5)
+        self.assertEqual(acquired, [None])
+        self.assertEqual([unit.index for unit in scheduler.remaining()], [1])
+
+    def test_progress(self):
+        units = self.units(("card1", "ssd"), ("card1", "ssd"), ("card2", "ssd"))
+        scheduler = self.scheduler(units, default_limit=4)
+        for _ in range(2):
+            scheduler.release(scheduler.acquire())
+        groups = scheduler.progress()
+        self.assertEqual([(group["source"], group["destination"], group["done"], group["total"])
+                          for group in groups], [("card1", "ssd", 1, 2), ("card2", "ssd", 1, 1)])
+        self.assertIsNotNone(groups[1]["elapsed"])
+
+    def test_batch_job_cancel(self):
+        units = self.units(("hdd", "hdd"), ("hdd", "hdd"), ("card", "hdd"))
+        scheduler = DeviceScheduler(self.key_of, default_limit=1)
+        started, proceed = threading.Event(), threading.Event()
+
+        def operation(entry):
+            started.set()
+            proceed.wait(5)
+
+        job = BatchJob(units, operation, max_workers=8, scheduler=scheduler).start()
+        self.assertTrue(started.wait(5))
+        job.cancel()
+        proceed.set()
+        self.assertTrue(job.wait(5))
+        # hdd の上限は1なので、キャンセルしたときには1件しか実行していない
+        self.assertEqual(sorted(entry.index for entry in job.cancelled_entries), [1, 2])
+
+
+class DeviceSchedulerBatchTest(BatchTestCase):
+    def test_for_index(self):
+        os.mkdir(self.path("dest"))
+        for name in ("a", "b", "c"):
+            self.write(name)
+        resolution = self.resolve(self.plan(("a", "dest/a"), ("b", "dest/b"), ("c", "c2")), CONFLICT_SKIP)
+        index = resolution.index
+        device = os.stat(self.dir).st_dev
+        scheduler = DeviceScheduler.for_index(index, default_limit=3,
+                                              folder_limits={self.dir: 2, self.path("dest"): 1,
+                                                             self.path("nothing"): 5})
+        # 同じデバイスのフォルダは小さいほうの上限、調べられないフォルダは無視する
+        self.assertEqual(scheduler.limits, {device: 1})
+
+        units = order_moves(resolution.entries, index)
+        report = BatchReport("移動")
+        job = BatchJob(units, lambda entry: execute_entry(entry, index), scheduler=scheduler).start()
+        while True:
+            kind, result = job.events.get(timeout=10)
+            if kind == "finished":
+                break
+            report.add(result)
+        report.finish(scheduler)
+        self.assertEqual(report.count(STATUS_SUCCESS), 3)
+        self.assertEqual([(group["source_device"], group["dest_device"], group["done"], group["total"])
+                          for group in report.groups], [(device, device, 3, 3)])
+        self.assertEqual(self.listdir(), ["c2", "dest"])
+
+
+if __name__ == "__main__":
+    unittest.main()
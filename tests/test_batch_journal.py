@@ -0,0 +1,396 @@
+"""
+操作ジャーナル（OperationJournal）、先行書き込みログ（BatchWriteAheadLog）からの
+再開・元に戻す、元に戻す履歴（UndoHistory）のテスト（Tk は使わない）
+"""
+import json
+import os
+import tempfile
+import unittest
+
+from batch_engine import (
+    CONFLICT_SKIP, STATUS_FAILED, STATUS_SKIPPED, STATUS_SUCCESS, BatchReport, DestinationIndex, OperationResult,
+    PlanEntry, PreflightScan, execute_entry, order_moves, resolve_conflicts
+)
+from batch_journal import (
+    WAL_SUFFIX, BatchWriteAheadLog, OperationJournal, RecoveryState, UndoHistory, find_unfinished_batches,
+    lock_file
+)
+
+
+class JournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+        self.path = os.path.join(self.dir, "journal.jsonl")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def read_lines(self, path=None):
+        with open(path or self.path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    @staticmethod
+    def result(index, status=STATUS_SUCCESS, error=None, size=None):
+        entry = PlanEntry(index, f"/src/{index}.txt", f"/dst/{index}.txt", f"{index}.txt")
+        return OperationResult(entry, status, error, 0.25, {"bytes": size, "source_device": 1, "dest_device": 2})
+
+
+class OperationJournalTest(JournalTestCase):
+    def test_operations_and_summary(self):
+        report = BatchReport("移動")
+        for result in (self.result(0, size=1024), self.result(1, size=2048),
+                       self.result(2, STATUS_FAILED, OSError("失敗")), self.result(3, STATUS_SKIPPED)):
+            report.add(result)
+        report.finish()
+        journal = OperationJournal(self.path).start()
+        journal.record_results(report, report.results)
+        journal.record_batch(report)
+        journal.close()
+
+        lines = self.read_lines()
+        self.assertEqual([line["type"] for line in lines], ["operation"] * 4 + ["batch"])
+        self.assertEqual({line["batch"] for line in lines}, {report.batch_id})
+        first, failed = lines[0], lines[2]
+        self.assertEqual((first["action"], first["status"], first["source"], first["destination"]),
+                         ("移動", STATUS_SUCCESS, "/src/0.txt", "/dst/0.txt"))
+        self.assertEqual((first["bytes"], first["duration"], first["source_device"], first["dest_device"]),
+                         (1024, 0.25, 1, 2))
+        self.assertIsNone(first["error"])
+        self.assertEqual((failed["status"], failed["error"]), (STATUS_FAILED, "失敗"))
+
+        summary = lines[-1]
+        self.assertEqual(summary["counts"], report.counts())
+        # スループットは成功したファイルだけで計算する
+        self.assertEqual((summary["files"], summary["bytes"]), (2, 3072))
+        self.assertEqual(summary["files_per_second"], round(2 / report.elapsed, 1))
+
+    def test_appends_to_existing_journal(self):
+        report = BatchReport("名前変更")
+        for index in range(2):
+            journal = OperationJournal(self.path).start()
+            journal.record_result(report, self.result(index))
+            journal.close()
+        self.assertEqual([line["source"] for line in self.read_lines()], ["/src/0.txt", "/src/1.txt"])
+
+    def test_rotation(self):
+        report = BatchReport("移動")
+        journal = OperationJournal(self.path, max_bytes=1200, backup_count=2, buffer_lines=1).start()
+        for index in range(20):
+            journal.record_result(report, self.result(index))
+        journal.close()
+
+        self.assertEqual(sorted(os.listdir(self.dir)), ["journal.jsonl", "journal.jsonl.1", "journal.jsonl.2"])
+        kept = []
+        for path in (self.path + ".2", self.path + ".1", self.path):
+            self.assertLessEqual(os.path.getsize(path), 1200)
+            kept.extend(line["source"] for line in self.read_lines(path))
+        # 古いものから削除され、残った記録は順番どおりに並ぶ
+        self.assertEqual(kept, [f"/src/{index}.txt" for index in range(20 - len(kept), 20)])
+        self.assertLess(len(kept), 20)
+
+    def test_write_error_does_not_stop_the_batch(self):
+        journal = OperationJournal(os.path.join(self.dir, "missing", "journal.jsonl")).start()
+        journal.record_result(BatchReport("移動"), self.result(0))
+        journal.close()
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "missing")))
+
+
+class UndoHistoryTest(JournalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.history = UndoHistory(self.dir)
+        self._batches = 0
+
+    def report(self, *results):
+        report = BatchReport("移動")
+        # 名前順が作成順になるよう、日時で始まる batch_id を決めておく
+        self._batches += 1
+        report.batch_id = f"20240101-000000-{self._batches:06d}"
+        for result in results:
+            report.add(result)
+        return report
+
+    def test_record_keeps_successful_moves_in_plan_order(self):
+        same = OperationResult(PlanEntry(3, "/src/same", "/src/same", "same"), STATUS_SUCCESS)
+        record = self.history.record(self.report(self.result(2), self.result(1, STATUS_FAILED), self.result(0), same))
+        self.assertEqual(record.moves, [["/src/0.txt", "/dst/0.txt"], ["/src/2.txt", "/dst/2.txt"]])
+        latest = self.history.latest()
+        self.assertEqual((latest.batch_id, latest.action_name, latest.moves),
+                         (record.batch_id, "移動", record.moves))
+
+    def test_nothing_to_record(self):
+        self.assertIsNone(self.history.record(self.report(self.result(0, STATUS_SKIPPED))))
+        self.assertIsNone(self.history.latest())
+        self.assertEqual(self.history.records(), [])
+
+    def test_keeps_ten_newest(self):
+        ids = [self.history.record(self.report(self.result(i))).batch_id for i in range(12)]
+        self.assertEqual(len(os.listdir(self.dir)), 10)
+        self.assertEqual([record.batch_id for record in self.history.records()], ids[:1:-1])
+        self.assertEqual(self.history.latest().batch_id, ids[-1])
+
+    def test_reverse_plan(self):
+        record = self.history.record(self.report(self.result(0), self.result(1)))
+        entries = record.reverse_entries()
+        self.assertEqual([(entry.index, entry.source, entry.destination) for entry in entries],
+                         [(0, "/dst/1.txt", "/src/1.txt"), (1, "/dst/0.txt", "/src/0.txt")])
+        self.assertEqual(entries[0].filename, "1.txt")
+
+    def test_record_undo_keeps_only_moves_left_to_undo(self):
+        record = self.history.record(self.report(self.result(0), self.result(1)))
+        entries = record.reverse_entries()
+        undo = BatchReport("元に戻す")
+        undo.add(OperationResult(entries[0], STATUS_SUCCESS))
+        undo.add(OperationResult(entries[1], STATUS_FAILED, OSError("失敗")))
+        self.history.record_undo(record, undo)
+        self.assertEqual(self.history.latest().moves, [["/src/0.txt", "/dst/0.txt"]])
+
+        undo = BatchReport("元に戻す")
+        undo.add(OperationResult(entries[1], STATUS_SUCCESS))
+        self.history.record_undo(record, undo)
+        self.assertIsNone(self.history.latest())
+
+    def test_record_rollback_removes_restored_moves(self):
+        # Ctrl+C で止めた一括処理の履歴を、recover で元に戻した結果に合わせる
+        results = [self.result(0), self.result(1), self.result(2)]
+        record = self.history.record(self.report(*results))
+        state = RecoveryState()
+        state.done = [result.entry for result in results]
+        self.history.record_rollback(record.batch_id, state, [(results[1].entry, FileExistsError("既存"))])
+        self.assertEqual(self.history.latest().moves, [["/src/1.txt", "/dst/1.txt"]])
+
+        self.history.record_rollback(record.batch_id, state, [])
+        self.assertIsNone(self.history.latest())
+        # 履歴のない一括処理は何もしない
+        self.history.record_rollback(record.batch_id, state, [])
+
+
+class WriteAheadLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = os.path.join(self._tmp.name, "files")
+        self.pending_dir = os.path.join(self._tmp.name, "pending")
+        os.makedirs(self.dir)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def write(self, name):
+        with open(self.path(name), "w", encoding="utf-8") as f:
+            f.write(name)
+
+    def read(self, name):
+        with open(self.path(name), encoding="utf-8") as f:
+            return f.read()
+
+    def listdir(self):
+        return sorted(os.listdir(self.dir))
+
+    def start(self, *moves):
+        """計画を解決してログを作り、(ログ, 実行単位) を返す"""
+        entries = [PlanEntry(i, self.path(source), self.path(destination), destination)
+                   for i, (source, destination) in enumerate(moves)]
+        resolution = resolve_conflicts(entries, CONFLICT_SKIP, DestinationIndex(PreflightScan(
+            entry.source for entry in entries)))
+        units = order_moves(resolution.entries, resolution.index)
+        wal = BatchWriteAheadLog.create(BatchReport("移動"), resolution.entries, self.pending_dir)
+        return wal, units
+
+    def recover(self):
+        batches = find_unfinished_batches(self.pending_dir)
+        self.assertEqual(len(batches), 1)
+        self.addCleanup(batches[0].release)
+        return batches[0], batches[0].inspect()
+
+    @staticmethod
+    def indices(entries):
+        return sorted(entry.index for entry in entries)
+
+
+class RecoveryTest(WriteAheadLogTestCase):
+    def crash_independent_moves(self):
+        """1件目は記録済み、2件目は記録前に落ち、3件目は未実行"""
+        for name in ("a", "b", "c"):
+            self.write(name)
+        wal, units = self.start(("a", "x"), ("b", "y"), ("c", "z"))
+        wal.wrap(execute_entry)(units[0])
+        execute_entry(units[1])
+        wal.close()
+
+    def test_finished_batch_leaves_nothing(self):
+        self.write("a")
+        wal, units = self.start(("a", "x"))
+        wal.wrap(execute_entry)(units[0])
+        wal.finish()
+        self.assertEqual(find_unfinished_batches(self.pending_dir), [])
+        self.assertEqual(os.listdir(self.pending_dir), [])
+
+    def test_incomplete_logs_are_removed(self):
+        os.makedirs(self.pending_dir)
+        for name, content in (("tmp" + WAL_SUFFIX + ".tmp", "{"), ("broken" + WAL_SUFFIX, "{")):
+            with open(os.path.join(self.pending_dir, name), "w", encoding="utf-8") as f:
+                f.write(content)
+        self.assertEqual(find_unfinished_batches(self.pending_dir), [])
+        self.assertEqual(os.listdir(self.pending_dir), [])
+
+    def test_inspect_independent_moves(self):
+        self.crash_independent_moves()
+        batch, state = self.recover()
+        self.assertEqual(batch.action_name, "移動")
+        self.assertEqual(self.indices(state.done), [0, 1])
+        self.assertEqual(self.indices(state.pending), [2])
+        self.assertEqual(state.lost + state.uncertain, [])
+
+    def test_checkpoint_is_written_at_once(self):
+        self.write("a")
+        wal, units = self.start(("a", "x"))
+        try:
+            wal.wrap(execute_entry)(units[0])
+            # 閉じる前でも完了の記録はファイルに渡っている
+            with open(wal.path, encoding="utf-8") as f:
+                self.assertEqual(f.read().splitlines()[-1], "0")
+        finally:
+            wal.close()
+        self.assertIsNone(wal.error)
+
+    def test_partial_last_line_is_ignored(self):
+        self.write("a")
+        wal, _ = self.start(("a", "x"))
+        wal._file.write("0")
+        wal.close()
+        batch, _ = self.recover()
+        self.assertEqual(batch.completed, set())
+
+    def test_resume(self):
+        self.crash_independent_moves()
+        batch, state = self.recover()
+        for entry in state.pending:
+            execute_entry(entry)
+        batch.discard()
+        self.assertEqual(self.listdir(), ["x", "y", "z"])
+        self.assertEqual(find_unfinished_batches(self.pending_dir), [])
+
+    def test_rollback(self):
+        self.crash_independent_moves()
+        batch, state = self.recover()
+        self.assertEqual(batch.rollback(state), [])
+        batch.discard()
+        self.assertEqual(self.listdir(), ["a", "b", "c"])
+        self.assertEqual([self.read(name) for name in ("a", "b", "c")], ["a", "b", "c"])
+
+    def test_rollback_does_not_overwrite(self):
+        self.crash_independent_moves()
+        batch, state = self.recover()
+        self.write("a")
+        failures = batch.rollback(state)
+        self.assertEqual([(entry.index, type(error)) for entry, error in failures], [(0, FileExistsError)])
+        self.assertEqual(self.listdir(), ["a", "b", "c", "x"])
+
+    def test_lost_entry(self):
+        self.write("a")
+        wal, _ = self.start(("a", "x"))
+        wal.close()
+        os.remove(self.path("a"))
+        _, state = self.recover()
+        self.assertEqual(self.indices(state.lost), [0])
+
+    def test_rollback_of_checkpointed_swap(self):
+        self.write("a")
+        self.write("b")
+        wal, units = self.start(("a", "b"), ("b", "a"))
+        self.assertEqual(len(units), 1)
+        for result in units[0].execute(wal.wrap(execute_entry)):
+            self.assertIsNone(result.error)
+        wal.close()
+        batch, state = self.recover()
+        self.assertEqual(self.indices(state.done), [0, 1])
+        self.assertEqual(batch.rollback(state), [])
+        self.assertEqual([self.read(name) for name in ("a", "b")], ["a", "b"])
+
+    def test_unrecorded_swap_is_uncertain(self):
+        # 入れ替えた後、完了を記録する前に落ちると存在だけでは判定できない
+        self.write("a")
+        self.write("b")
+        wal, units = self.start(("a", "b"), ("b", "a"))
+        for _ in units[0].execute(execute_entry):
+            pass
+        wal.close()
+        batch, state = self.recover()
+        self.assertEqual(state.done + state.pending + state.lost, [])
+        self.assertEqual(self.indices(state.uncertain), [0, 1])
+        self.assertEqual(batch.rollback(state), [])
+        self.assertEqual([self.read(name) for name in ("a", "b")], ["b", "a"])
+
+    def test_rollback_of_parked_cycle(self):
+        # 循環を崩すために一時的な名前へ移したところで落ちた
+        self.write("a")
+        self.write("b")
+        wal, units = self.start(("a", "b"), ("b", "a"))
+        chain = units[0]
+        chain._park()
+        wal.close()
+        batch, state = self.recover()
+        self.assertEqual(self.indices(state.pending), [chain.parked.index])
+        self.assertEqual(len(state.uncertain), 1)
+        self.assertEqual(batch.rollback(state), [])
+        self.assertEqual(self.listdir(), ["a", "b"])
+        self.assertEqual([self.read(name) for name in ("a", "b")], ["a", "b"])
+
+    def test_resume_of_parked_cycle(self):
+        self.write("a")
+        self.write("b")
+        wal, units = self.start(("a", "b"), ("b", "a"))
+        chain = units[0]
+        chain._park()
+        # もう一方を移して記録し、一時的な名前のエントリを実行する前に落ちた
+        wal.wrap(execute_entry)(chain.entries[0])
+        wal.close()
+        batch, state = self.recover()
+        self.assertEqual(self.indices(state.done), [chain.entries[0].index])
+        self.assertEqual(self.indices(state.pending), [chain.parked.index])
+        for entry in state.pending:
+            execute_entry(entry)
+        batch.discard()
+        self.assertEqual(self.listdir(), ["a", "b"])
+        self.assertEqual([self.read(name) for name in ("a", "b")], ["b", "a"])
+
+
+class LockTest(WriteAheadLogTestCase):
+    def test_running_batch_is_skipped(self):
+        self.write("a")
+        wal, _ = self.start(("a", "x"))
+        try:
+            self.assertEqual(find_unfinished_batches(self.pending_dir), [])
+        finally:
+            wal.close()
+        self.assertEqual(len(find_unfinished_batches(self.pending_dir)), 1)
+
+    def test_recovered_batch_is_held_until_released(self):
+        self.write("a")
+        wal, _ = self.start(("a", "x"))
+        wal.close()
+        batch, _ = self.recover()
+        self.assertEqual(find_unfinished_batches(self.pending_dir), [])
+        batch.release()
+        batches = find_unfinished_batches(self.pending_dir)
+        self.assertEqual(len(batches), 1)
+        batches[0].release()
+
+    def test_locked_tmp_is_kept(self):
+        os.makedirs(self.pending_dir)
+        tmp_path = os.path.join(self.pending_dir, "writing" + WAL_SUFFIX + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            self.assertTrue(lock_file(f))
+            self.assertEqual(find_unfinished_batches(self.pending_dir), [])
+            self.assertTrue(os.path.exists(tmp_path))
+        # 書いていたプロセスが落ちた
+        find_unfinished_batches(self.pending_dir)
+        self.assertFalse(os.path.exists(tmp_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,307 @@
+"""
+コマンドラインの一括処理（file_manager_cli）の終了コードと出力のテスト（Tk は使わない）
+"""
+import io
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from unittest import mock
+
+import file_manager_cli
+from batch_engine import STATUS_SUCCESS, BatchReport, OperationResult, PlanEntry, execute_entry, order_moves
+from batch_journal import BatchWriteAheadLog, UndoHistory, find_unfinished_batches, get_pending_dir
+from file_manager_cli import EXIT_FAILED, EXIT_OK, EXIT_USAGE, main
+from settings_store import write_json_atomic
+from template_store import KIND_FILENAME, TemplateStore
+
+
+class CliTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = self._tmp.name
+        self.dir = os.path.join(self.root, "files")
+        self.dest = os.path.join(self.root, "dest")
+        os.makedirs(self.dir)
+        self.settings_path = os.path.join(self.root, "settings.json")
+        self.templates_path = os.path.join(self.root, "templates.db")
+        write_json_atomic(self.settings_path, {
+            "sequence_digits": 3,
+            "filename_templates": {
+                "連番": {"pattern": "photo_{seq}", "custom_text": ""},
+                "整理": {"pattern": "{text}{seq}", "custom_text": "doc", "destination_path": self.dest},
+            },
+        })
+        for name in ("b.jpg", "a.jpg", "c.txt"):
+            self.write(name)
+        # ジャーナルなどを作業フォルダに書かないようにする
+        patcher = mock.patch("batch_journal.get_application_path", return_value=self.root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def write(self, name):
+        with open(self.path(name), "w", encoding="utf-8") as f:
+            f.write(name)
+
+    def run_cli(self, *argv):
+        """(終了コード, 標準出力のJSON) を返す"""
+        output = io.StringIO()
+        with redirect_stdout(output):
+            code = main(list(argv))
+        return code, json.loads(output.getvalue())
+
+    def run_batch(self, *argv):
+        return self.run_cli("run", "--settings", self.settings_path, "--templates", self.templates_path, *argv)
+
+
+class RunTest(CliTestCase):
+    def test_rename(self):
+        code, summary = self.run_batch("--template", "連番", self.path("b.jpg"), self.path("a.jpg"))
+        self.assertEqual(code, EXIT_OK)
+        self.assertTrue(summary["ok"])
+        self.assertEqual(summary["action"], "名前変更")
+        self.assertEqual(summary["counts"]["success"], 2)
+        self.assertEqual(summary["failures"], [])
+        self.assertEqual(sorted(os.listdir(self.dir)), ["c.txt", "photo_001.jpg", "photo_002.jpg"])
+        with open(self.path("photo_001.jpg"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), "b.jpg")
+
+    def test_folder_and_template_destination(self):
+        code, summary = self.run_batch("--template", "整理", "--start-seq", "5", self.dir)
+        self.assertEqual(code, EXIT_OK)
+        self.assertEqual(summary["action"], "名前変更と移動")
+        self.assertEqual(sorted(os.listdir(self.dest)), ["doc005.jpg", "doc006.jpg", "doc007.txt"])
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_move_from_list(self):
+        list_path = os.path.join(self.root, "paths.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            f.write(self.path("a.jpg") + "\n\n" + self.path("c.txt") + "\n")
+        code, summary = self.run_batch("--template", "連番", "--mode", "move", "--dest", self.dest,
+                                       "--from-list", list_path)
+        self.assertEqual(code, EXIT_OK)
+        self.assertEqual(summary["action"], "移動")
+        self.assertEqual(sorted(os.listdir(self.dest)), ["a.jpg", "c.txt"])
+
+    def test_dry_run(self):
+        code, summary = self.run_batch("--template", "連番", "--dry-run", self.path("a.jpg"))
+        self.assertEqual(code, EXIT_OK)
+        self.assertTrue(summary["dry_run"])
+        self.assertEqual(summary["planned"], [{"source": self.path("a.jpg"), "destination": self.path("photo_001.jpg")}])
+        self.assertEqual(sorted(os.listdir(self.dir)), ["a.jpg", "b.jpg", "c.txt"])
+
+    def test_conflicts_are_skipped(self):
+        self.write("photo_001.jpg")
+        code, summary = self.run_batch("--template", "連番", self.path("a.jpg"))
+        self.assertEqual(code, EXIT_OK)
+        self.assertEqual(summary["counts"]["skipped"], 1)
+        self.assertEqual(summary["counts"]["success"], 0)
+        with open(self.path("photo_001.jpg"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), "photo_001.jpg")
+
+    def test_conflict_policy_option(self):
+        self.write("photo_001.jpg")
+        code, summary = self.run_batch("--template", "連番", "--conflict", "rename", self.path("a.jpg"))
+        self.assertEqual(code, EXIT_OK)
+        self.assertEqual(summary["counts"]["success"], 1)
+        self.assertIn("photo_001_1.jpg", os.listdir(self.dir))
+
+    def test_failures(self):
+        def fail_b(entry, *args):
+            if entry.source == self.path("b.jpg"):
+                raise PermissionError("アクセスが拒否されました")
+            return execute_entry(entry, *args)
+
+        report_path = os.path.join(self.root, "report.json")
+        with mock.patch.object(file_manager_cli, "execute_entry", fail_b):
+            code, summary = self.run_batch("--template", "連番", "--report", report_path,
+                                           self.path("a.jpg"), self.path("b.jpg"))
+        self.assertEqual(code, EXIT_FAILED)
+        self.assertFalse(summary["ok"])
+        self.assertEqual(summary["counts"]["success"], 1)
+        self.assertEqual([(failure["source"], failure["error_type"]) for failure in summary["failures"]],
+                         [(self.path("b.jpg"), "PermissionError")])
+        with open(report_path, encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["counts"], summary["counts"])
+
+    def test_undo_history_error_is_a_warning(self):
+        errors = io.StringIO()
+        with mock.patch.object(UndoHistory, "save", side_effect=PermissionError("denied")), redirect_stderr(errors):
+            code, summary = self.run_batch("--template", "連番", self.path("b.jpg"), self.path("a.jpg"))
+        # 移動は終わっているので、結果はそのまま出力する
+        self.assertEqual(code, EXIT_OK)
+        self.assertTrue(summary["ok"])
+        self.assertEqual(summary["counts"]["success"], 2)
+        self.assertIn("denied", errors.getvalue())
+        self.assertEqual(sorted(os.listdir(self.dir)), ["c.txt", "photo_001.jpg", "photo_002.jpg"])
+
+    def test_journal(self):
+        journal_path = os.path.join(self.root, "journal.jsonl")
+        self.run_batch("--template", "連番", "--journal", journal_path, self.path("a.jpg"), self.path("nothing"))
+        with open(journal_path, encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([(line["type"], line.get("status")) for line in lines],
+                         [("operation", "success"), ("operation", "missing"), ("batch", None)])
+        self.assertEqual(lines[0]["destination"], self.path("photo_001.jpg"))
+
+    def test_template_from_store_without_settings(self):
+        store = TemplateStore(self.templates_path)
+        store.put(KIND_FILENAME, "保存済み", {"pattern": "saved_{seq}", "sequence_digits": 2})
+        store.close()
+        os.remove(self.settings_path)
+        code, summary = self.run_batch("--template", "保存済み", self.path("a.jpg"))
+        self.assertEqual(code, EXIT_OK)
+        self.assertIn("saved_01.jpg", os.listdir(self.dir))
+
+    def test_unknown_template(self):
+        code, summary = self.run_batch("--template", "なし", self.path("a.jpg"))
+        self.assertEqual(code, EXIT_USAGE)
+        self.assertFalse(summary["ok"])
+        self.assertIn("なし", summary["error"])
+
+    def test_no_files(self):
+        empty = os.path.join(self.root, "empty")
+        os.makedirs(empty)
+        code, summary = self.run_batch("--template", "連番", empty)
+        self.assertEqual(code, EXIT_USAGE)
+        self.assertFalse(summary["ok"])
+
+    def test_missing_file(self):
+        code, summary = self.run_batch("--template", "連番", self.path("a.jpg"), self.path("nothing.jpg"))
+        self.assertEqual(code, EXIT_OK)
+        self.assertEqual(summary["counts"]["missing"], 1)
+        self.assertEqual(summary["counts"]["success"], 1)
+
+    def test_move_without_destination(self):
+        code, summary = self.run_batch("--template", "連番", "--mode", "move", self.path("a.jpg"))
+        self.assertEqual(code, EXIT_USAGE)
+        self.assertFalse(summary["ok"])
+        self.assertEqual(sorted(os.listdir(self.dir)), ["a.jpg", "b.jpg", "c.txt"])
+
+
+class UndoTest(CliTestCase):
+    def test_undo_last_batch(self):
+        self.run_batch("--template", "連番", self.path("a.jpg"))
+        self.run_batch("--template", "整理", self.path("b.jpg"), self.path("photo_001.jpg"))
+        code, summary = self.run_cli("undo", "--list")
+        self.assertEqual(code, EXIT_OK)
+        self.assertEqual([(record["action"], record["files"]) for record in summary["history"]],
+                         [("名前変更と移動", 2), ("名前変更", 1)])
+
+        code, summary = self.run_cli("undo")
+        self.assertEqual(code, EXIT_OK)
+        self.assertEqual(summary["action"], "元に戻す（名前変更と移動）")
+        self.assertEqual(summary["counts"]["success"], 2)
+        self.assertEqual(sorted(os.listdir(self.dir)), ["b.jpg", "c.txt", "photo_001.jpg"])
+        self.assertEqual(os.listdir(self.dest), [])
+
+        self.assertEqual(self.run_cli("undo")[0], EXIT_OK)
+        self.assertEqual(sorted(os.listdir(self.dir)), ["a.jpg", "b.jpg", "c.txt"])
+        self.assertEqual(UndoHistory().records(), [])
+
+    def test_nothing_to_undo(self):
+        code, summary = self.run_cli("undo")
+        self.assertEqual(code, EXIT_USAGE)
+        self.assertFalse(summary["ok"])
+        self.assertEqual(self.run_cli("undo", "--list"), (EXIT_OK, {"ok": True, "history": []}))
+
+    def test_undo_history_error_is_a_warning(self):
+        self.run_batch("--template", "連番", self.path("a.jpg"), self.path("b.jpg"))
+        errors = io.StringIO()
+        with mock.patch.object(UndoHistory, "remove", side_effect=PermissionError("denied")), \
+                redirect_stderr(errors):
+            code, summary = self.run_cli("undo")
+        self.assertEqual(code, EXIT_OK)
+        self.assertEqual(summary["counts"]["success"], 2)
+        self.assertIn("denied", errors.getvalue())
+        self.assertEqual(sorted(os.listdir(self.dir)), ["a.jpg", "b.jpg", "c.txt"])
+
+    def test_missing_file_is_reported(self):
+        self.run_batch("--template", "連番", self.path("a.jpg"), self.path("b.jpg"))
+        os.remove(self.path("photo_002.jpg"))
+        code, summary = self.run_cli("undo")
+        self.assertEqual(code, EXIT_OK)
+        self.assertEqual((summary["counts"]["success"], summary["counts"]["missing"]), (1, 1))
+        self.assertIn("a.jpg", os.listdir(self.dir))
+
+
+class RecoverTest(CliTestCase):
+    def setUp(self):
+        super().setUp()
+        # a.jpg は移動して記録済み、b.jpg は未処理のところで Ctrl+C で止めた一括処理
+        entries = [PlanEntry(i, self.path(source), self.path(destination), destination)
+                   for i, (source, destination) in enumerate((("a.jpg", "1.jpg"), ("b.jpg", "2.jpg")))]
+        report = BatchReport("名前変更")
+        wal = BatchWriteAheadLog.create(report, entries)
+        wal.wrap(execute_entry)(entries[0])
+        wal.close()
+        # 途中までの移動は元に戻す履歴にも残る
+        report.add(OperationResult(entries[0], STATUS_SUCCESS))
+        UndoHistory().record(report)
+
+    def test_nothing_to_recover(self):
+        find_unfinished_batches()[0].discard()
+        self.assertEqual(self.run_cli("recover"), (EXIT_OK, {"ok": True, "batches": []}))
+
+    def test_list(self):
+        code, summary = self.run_cli("recover")
+        self.assertEqual(code, EXIT_OK)
+        self.assertEqual([(batch["action"], batch["done"], batch["pending"], batch["lost"], batch["uncertain"])
+                          for batch in summary["batches"]], [("名前変更", 1, 1, 0, [])])
+        self.assertEqual(len(find_unfinished_batches()), 1)
+
+    def test_resume(self):
+        code, summary = self.run_cli("recover", "--resume")
+        self.assertEqual(code, EXIT_OK)
+        self.assertEqual(summary["batches"][0]["counts"]["success"], 1)
+        self.assertEqual(sorted(os.listdir(self.dir)), ["1.jpg", "2.jpg", "c.txt"])
+        self.assertEqual(os.listdir(get_pending_dir()), [])
+        # 止める前の分と再開した分の両方を元に戻せる
+        self.assertEqual([record.moves for record in UndoHistory().records()],
+                         [[[self.path("b.jpg"), self.path("2.jpg")]], [[self.path("a.jpg"), self.path("1.jpg")]]])
+
+    def test_rollback(self):
+        code, summary = self.run_cli("recover", "--rollback")
+        self.assertEqual(code, EXIT_OK)
+        self.assertEqual(summary["batches"][0]["restored"], 1)
+        self.assertEqual(sorted(os.listdir(self.dir)), ["a.jpg", "b.jpg", "c.txt"])
+        self.assertEqual(os.listdir(get_pending_dir()), [])
+        # 元に戻した移動は履歴から除くので、undo で二度戻さない
+        self.assertEqual(UndoHistory().records(), [])
+        self.assertEqual(self.run_cli("undo")[0], EXIT_USAGE)
+
+    def test_rollback_failure(self):
+        self.write("a.jpg")
+        code, summary = self.run_cli("recover", "--rollback")
+        self.assertEqual(code, EXIT_FAILED)
+        self.assertFalse(summary["ok"])
+        self.assertEqual([failure["source"] for failure in summary["batches"][0]["failures"]], [self.path("a.jpg")])
+        # 戻せなかった移動は履歴に残る
+        self.assertEqual(UndoHistory().latest().moves, [[self.path("a.jpg"), self.path("1.jpg")]])
+
+    def test_uncertain_entries_are_left_alone(self):
+        find_unfinished_batches()[0].discard()
+        # 入れ替えを実行し、完了を記録する前に落ちた
+        entries = [PlanEntry(0, self.path("b.jpg"), self.path("c.txt"), "c.txt"),
+                   PlanEntry(1, self.path("c.txt"), self.path("b.jpg"), "b.jpg")]
+        wal = BatchWriteAheadLog.create(BatchReport("名前変更"), entries)
+        for result in order_moves(entries)[0].execute(execute_entry):
+            self.assertIsNone(result.error)
+        wal.close()
+        code, summary = self.run_cli("recover", "--rollback")
+        self.assertEqual(code, EXIT_FAILED)
+        self.assertEqual([item["source"] for item in summary["batches"][0]["uncertain"]],
+                         [self.path("b.jpg"), self.path("c.txt")])
+        with open(self.path("b.jpg"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), "c.txt")
+
+
+if __name__ == "__main__":
+    unittest.main()
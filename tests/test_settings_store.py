@@ -0,0 +1,124 @@
+"""
+設定の遅延保存（SettingsPersistence）と一時ファイル経由の書き込みのテスト（Tk は使わない）
+"""
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from settings_store import SettingsPersistence, load_settings_file, write_json_atomic
+
+
+class FakeTimer:
+    """root.after / root.after_cancel の代わり（run() で予約中の処理を実行する）"""
+
+    def __init__(self):
+        self.pending = {}
+        self.cancelled = []
+        self._next_id = 0
+
+    def schedule(self, delay_ms, callback):
+        self._next_id += 1
+        self.pending[self._next_id] = (delay_ms, callback)
+        return self._next_id
+
+    def cancel(self, after_id):
+        self.cancelled.append(after_id)
+        self.pending.pop(after_id, None)
+
+    def run(self):
+        pending, self.pending = self.pending, {}
+        for _, callback in pending.values():
+            callback()
+
+
+class SettingsTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+        self.path = os.path.join(self.dir, "settings.json")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+
+class WriteJsonAtomicTest(SettingsTestCase):
+    def test_write_and_load(self):
+        write_json_atomic(self.path, {"名前": "値"})
+        self.assertEqual(load_settings_file(self.path), {"名前": "値"})
+        self.assertEqual(os.listdir(self.dir), ["settings.json"])
+
+    def test_missing_file(self):
+        self.assertIsNone(load_settings_file(self.path))
+
+    def test_failure_keeps_previous_file(self):
+        write_json_atomic(self.path, {"version": 1})
+        with self.assertRaises(TypeError):
+            write_json_atomic(self.path, {"version": object()})
+        self.assertEqual(load_settings_file(self.path), {"version": 1})
+        # 書きかけの一時ファイルは残さない
+        self.assertEqual(os.listdir(self.dir), ["settings.json"])
+
+    def test_failure_to_replace_removes_temporary_file(self):
+        with mock.patch("settings_store.os.replace", side_effect=OSError("置き換えできません")):
+            with self.assertRaises(OSError):
+                write_json_atomic(self.path, {"version": 1})
+        self.assertEqual(os.listdir(self.dir), [])
+
+
+class SettingsPersistenceTest(SettingsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.timer = FakeTimer()
+        self.settings = {"count": 0}
+        self.collected = 0
+        self.persistence = SettingsPersistence(self.collect, self.timer.schedule, self.timer.cancel,
+                                               path=self.path, delay_ms=300)
+
+    def collect(self):
+        self.collected += 1
+        return dict(self.settings)
+
+    def test_changes_are_coalesced(self):
+        for count in range(1, 6):
+            self.settings["count"] = count
+            self.persistence.mark_dirty()
+        # 最後の変更の分だけ予約が残る
+        self.assertEqual(len(self.timer.pending), 1)
+        self.assertEqual([delay for delay, _ in self.timer.pending.values()], [300])
+        self.assertEqual(len(self.timer.cancelled), 4)
+        self.assertFalse(os.path.exists(self.path))
+
+        self.timer.run()
+        self.assertEqual(self.collected, 1)
+        self.assertFalse(self.persistence.dirty)
+        with open(self.path, encoding="utf-8") as f:
+            self.assertEqual(json.load(f), {"count": 5})
+
+    def test_flush_saves_immediately_and_cancels_timer(self):
+        self.persistence.mark_dirty()
+        self.assertTrue(self.persistence.flush())
+        self.assertEqual(self.timer.pending, {})
+        self.assertEqual(load_settings_file(self.path), {"count": 0})
+
+    def test_flush_without_changes(self):
+        self.assertFalse(self.persistence.flush())
+        self.assertEqual(self.collected, 0)
+        self.assertTrue(self.persistence.flush(force=True))
+        self.assertEqual(self.collected, 1)
+
+    def test_error_in_delayed_save(self):
+        errors = []
+        self.persistence.on_error = errors.append
+        self.persistence.path = os.path.join(self.dir, "missing", "settings.json")
+        self.persistence.mark_dirty()
+        self.timer.run()
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], OSError)
+        # 保存できなかった変更は次の保存で書き込む
+        self.assertTrue(self.persistence.dirty)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+テンプレートの保存（TemplateStore）のテスト
+"""
+import os
+import tempfile
+import unittest
+
+from template_store import KIND_DESTINATION, KIND_FILENAME, TemplateStore
+
+
+class TemplateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmp.name, "templates.db")
+        self.store = TemplateStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self._tmp.cleanup()
+
+    def put_names(self, *names):
+        for name in names:
+            self.store.put(KIND_FILENAME, name, {"pattern": name})
+
+    def test_put_get_delete(self):
+        self.assertIsNone(self.store.get(KIND_FILENAME, "写真"))
+        self.store.put(KIND_FILENAME, "写真", {"pattern": "{date}_{seq}"})
+        self.assertEqual(self.store.get(KIND_FILENAME, "写真"), {"pattern": "{date}_{seq}"})
+        self.store.put(KIND_FILENAME, "写真", {"pattern": "{seq}"})
+        self.assertEqual(self.store.get(KIND_FILENAME, "写真"), {"pattern": "{seq}"})
+        self.assertEqual(self.store.count(KIND_FILENAME), 1)
+        self.assertTrue(self.store.delete(KIND_FILENAME, "写真"))
+        self.assertFalse(self.store.delete(KIND_FILENAME, "写真"))
+        self.assertEqual(self.store.count(KIND_FILENAME), 0)
+
+    def test_kinds_are_separate(self):
+        self.store.put(KIND_FILENAME, "共通", {"pattern": "x"})
+        self.store.put(KIND_DESTINATION, "共通", "/tmp/dest")
+        self.assertEqual(self.store.get(KIND_DESTINATION, "共通"), "/tmp/dest")
+        self.assertTrue(self.store.delete(KIND_DESTINATION, "共通"))
+        self.assertEqual(self.store.get(KIND_FILENAME, "共通"), {"pattern": "x"})
+
+    def test_saved_rows_survive_reopen(self):
+        self.put_names("b", "a")
+        self.store.close()
+        self.store = TemplateStore(self.path)
+        self.assertEqual(self.store.names(KIND_FILENAME), ["a", "b"])
+
+    def test_first_is_oldest_even_after_overwrite(self):
+        self.assertIsNone(self.store.first(KIND_FILENAME))
+        self.put_names("zeta", "alpha")
+        self.store.put(KIND_FILENAME, "zeta", {"pattern": "changed"})
+        self.assertEqual(self.store.first(KIND_FILENAME), ("zeta", {"pattern": "changed"}))
+
+    def test_names_are_sorted_case_insensitively(self):
+        self.put_names("beta", "Alpha", "gamma")
+        self.assertEqual(self.store.names(KIND_FILENAME), ["Alpha", "beta", "gamma"])
+        self.assertEqual(self.store.names(KIND_FILENAME, limit=2), ["Alpha", "beta"])
+
+    def test_prefix_matches_come_before_substring_matches(self):
+        self.put_names("Photo 2024", "old photos", "photo", "video", "写真フォト")
+        self.assertEqual(self.store.matching(KIND_FILENAME, "PHO"), ["photo", "Photo 2024", "old photos"])
+        self.assertEqual(self.store.matching(KIND_FILENAME, "pho", limit=2), ["photo", "Photo 2024"])
+        self.assertEqual(self.store.matching(KIND_FILENAME, "フォト"), ["写真フォト"])
+        self.assertEqual(self.store.matching(KIND_FILENAME, "none"), [])
+        self.assertEqual(self.store.matching(KIND_DESTINATION, "pho"), [])
+
+    def test_migrate_settings_once(self):
+        settings = {
+            "filename_templates": {"写真": {"pattern": "{seq}"}},
+            "dest_templates": {"保存先": "/tmp/dest"},
+        }
+        self.store.put(KIND_FILENAME, "写真", {"pattern": "既に保存済み"})
+        self.assertTrue(self.store.migrate_settings(settings))
+        # 同じ名前が既にある場合は上書きしない
+        self.assertEqual(self.store.get(KIND_FILENAME, "写真"), {"pattern": "既に保存済み"})
+        self.assertEqual(self.store.get(KIND_DESTINATION, "保存先"), "/tmp/dest")
+
+        # 取り込んだ後に削除したテンプレートは、次の起動で戻らない
+        self.store.delete(KIND_DESTINATION, "保存先")
+        self.store.close()
+        self.store = TemplateStore(self.path)
+        self.assertFalse(self.store.migrate_settings(settings))
+        self.assertIsNone(self.store.get(KIND_DESTINATION, "保存先"))
+
+    def test_migrate_without_settings(self):
+        self.assertFalse(self.store.migrate_settings(None))
+        self.assertFalse(self.store.migrate_settings({}))
+        self.assertEqual(self.store.count(KIND_FILENAME), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()